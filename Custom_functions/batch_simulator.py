@@ -0,0 +1,221 @@
+"""
+Simulation of protocols without the Tk dialogs of debugger.Protocol_Simulator, e.g. on a headless machine
+
+* simulate_protocol() converts (for notebooks), bundles and simulates one protocol, using the simulation cache
+  notebooks are converted in memory, writing the converted script next to the notebook is optional
+* simulate_batch() simulates many protocols in parallel worker processes, one process per simulation since
+  the opentrons simulator keeps global state, with one log per protocol and a summary table
+* the module is also a command line tool:
+    python -m Vesynta_Tech.OpenTrons2.batch_simulator protocol1.ipynb protocol2.py --labware labware_folder --logs logs
+"""
+############################################################
+from __future__ import absolute_import
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+from opentrons.simulate import simulate
+
+from Vesynta_Tech.OpenTrons2 import building_blocks as bb
+from Vesynta_Tech.OpenTrons2 import bundler
+from Vesynta_Tech.OpenTrons2.simulation_cache import SimulationCache
+
+############################################################
+
+# Simulations of unchanged protocols are read from the cache in the user's home directory
+cached_simulations = SimulationCache()
+
+def notebook_source(notebook_path: str):
+    """
+    Source of the code cells of a notebook, read from its JSON
+    The IPython magics and shell commands (lines starting with % or !) are commented out,
+    as well as the whole cells run by a cell magic (first line starting with %%, e.g. %%bash)
+    """
+    with open(notebook_path, 'r', encoding='utf-8') as file_reader:
+        notebook = json.load(file_reader)
+    cells = []
+    for cell in notebook['cells']:
+        if cell['cell_type'] != 'code':
+            continue
+        source = cell['source'] if isinstance(cell['source'], str) else ''.join(cell['source'])
+        lines = source.split('\n')
+        if source.lstrip().startswith('%%'):
+            lines = ['# ' + line for line in lines]
+        else:
+            lines = ['# ' + line if line.lstrip().startswith(('%', '!')) else line for line in lines]
+        cells.append('\n'.join(lines).rstrip() + '\n')
+    return '\n\n'.join(cells)
+def convert_notebook(notebook_path: str,
+                     write_script: bool = False,
+                     report: bool = False):
+    """
+    Converts a notebook to a protocol script bundled with the Vesynta_Tech modules it imports
+    (see bundler.bundle_protocol), returns the source of the script
+    - write_script also writes the script next to the notebook (same name, .py extension)
+    - report prints the size and import time of the bundle before and after tree shaking
+    """
+    source = notebook_source(notebook_path)
+    script = bundler.bundle_protocol(source)
+    if report:
+        print(bundler.bundle_report(source))
+    if write_script:
+        _write_script(os.path.splitext(notebook_path)[0] + '.py', script)
+    return script
+def _write_script(script_path: str, script: str):
+    # Writes a converted script, if it is missing or was modified
+    if os.path.exists(script_path):
+        with open(script_path, 'r') as file_reader:
+            if file_reader.read() == script:
+                return
+    with open(script_path, 'w') as outfile:
+        outfile.write(script)
+def simulate_protocol(protocol_path: str,
+                      custom_labware_directory: str = None,
+                      use_cache: bool = True,
+                      write_script: bool = False,
+                      report: bool = False):
+    """
+    Simulates a protocol file, a '.py' script or a '.ipynb' notebook converted in memory (see convert_notebook())
+    Returns (script, run_log, cached), script being the source simulated
+    - use_cache reads the simulations of unchanged protocols (same protocol file, Custom_functions, labware definitions
+      and opentrons version) from cached_simulations, in which case cached is True and the run_log is sanitized
+      (see simulation_cache.sanitize_run_log)
+    - write_script writes the converted script of a notebook next to it
+    - report prints the size and import time of the bundle of a notebook before and after tree shaking
+    """
+    extension = os.path.splitext(protocol_path)[1]
+    if extension not in ('.ipynb', '.py'):
+        raise ValueError("Protocol file type of {} not recognised, use '.py' or '.ipynb' files".format(protocol_path))
+    script_path = os.path.splitext(protocol_path)[0] + '.py'
+    cache_key = cached_simulations.key(protocol_path, custom_labware_directory) if use_cache else None
+    cached = cached_simulations.get(cache_key) if use_cache else None
+    if cached is not None:
+        if extension == '.ipynb' and write_script:
+            _write_script(script_path, cached[0])
+        return cached[0], cached[1], True
+    if extension == '.ipynb':
+        script = convert_notebook(protocol_path, write_script, report)
+    else:
+        with open(script_path, 'r') as file_reader:
+            script = file_reader.read()
+    file_name = os.path.basename(script_path)
+    # Protocols importing the modules (instead of bundling them) would otherwise see the wells of the previous simulation
+    bb.reset_deck_state()
+    if custom_labware_directory is None:
+        run_log = simulate(protocol_file=io.StringIO(script), file_name=file_name)
+    else:
+        run_log = simulate(protocol_file=io.StringIO(script), file_name=file_name,
+                           custom_labware_paths=[custom_labware_directory])
+    if use_cache:
+        cached_simulations.put(cache_key, script, run_log)
+    return script, run_log, False
+############################################################
+
+class BatchResult:
+    """
+    Result of the simulation of a protocol by simulate_batch()
+
+    - passed is False if the conversion or simulation raised an error, given in error
+    - commands is the number of entries of the run_log, elapsed the duration of the simulation (s)
+    - cached is True if the simulation was read from the cache
+    """
+    def __init__(self, protocol_path: str, log_path: str, passed: bool, commands: int, elapsed: float, cached: bool,
+                 error: str = ''):
+        self.protocol_path = protocol_path
+        self.log_path = log_path
+        self.passed = passed
+        self.commands = commands
+        self.elapsed = elapsed
+        self.cached = cached
+        self.error = error
+
+def _simulation_task(protocol_path: str,
+                     custom_labware_directory: str,
+                     log_path: str,
+                     use_cache: bool,
+                     write_script: bool):
+    # Simulates one protocol in a worker process, everything printed goes to the log of the protocol
+    start = time.perf_counter()
+    with open(log_path, 'w') as log, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        print('Protocol:', protocol_path)
+        try:
+            script, run_log, cached = simulate_protocol(protocol_path, custom_labware_directory, use_cache, write_script)
+        except Exception as error:
+            traceback.print_exc()
+            return BatchResult(protocol_path, log_path, False, 0, time.perf_counter() - start, False,
+                               '{}: {}'.format(type(error).__name__, error))
+        print('Cached simulation' if cached else 'Simulated, script of {} lines'.format(script.count('\n')))
+        print()
+        for entry in run_log[0]:
+            print('\t'*entry['level'] + entry['payload']['text'])
+    return BatchResult(protocol_path, log_path, True, len(run_log[0]), time.perf_counter() - start, cached)
+def _run_task(task: tuple):
+    return _simulation_task(*task)
+
+def simulate_batch(protocol_paths: list,
+                   custom_labware_directory: str = None,
+                   log_directory: str = 'simulation_logs',
+                   processes: int = None,
+                   use_cache: bool = True,
+                   write_scripts: bool = False):
+    """
+    Simulates protocols in parallel, returns their BatchResult in the order of protocol_paths
+    - log_directory receives one log per protocol (the run_log texts, or the error) and summary.txt
+    - processes is the number of worker processes (the number of CPUs by default), each worker process simulates
+      a single protocol and is then replaced, so that no simulator state is shared between protocols
+    - write_scripts writes the converted scripts of the notebooks next to them
+    """
+    os.makedirs(log_directory, exist_ok=True)
+    tasks = []
+    for i, protocol_path in enumerate(protocol_paths):
+        name = os.path.splitext(os.path.basename(protocol_path))[0]
+        log_path = os.path.join(log_directory, '{:03d}_{}.log'.format(i+1, name))
+        tasks.append((os.path.abspath(protocol_path), custom_labware_directory, log_path, use_cache, write_scripts))
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(processes, maxtasksperchild=1) as pool:
+        results = pool.map(_run_task, tasks, chunksize=1)
+    with open(os.path.join(log_directory, 'summary.txt'), 'w') as outfile:
+        outfile.write(summary_table(results) + '\n')
+    return results
+def summary_table(results: list):
+    # Table of the results of simulate_batch(): pass/fail, number of commands and elapsed time of each protocol
+    rows = [('Protocol', 'Result', 'Commands', 'Time (s)', 'Cached')]
+    for result in results:
+        rows.append((os.path.basename(result.protocol_path), 'pass' if result.passed else 'FAIL', str(result.commands),
+                     str(round(result.elapsed, 1)), 'yes' if result.cached else 'no'))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    lines = ['  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in rows]
+    lines.insert(1, '  '.join('-'*width for width in widths))
+    for result in results:
+        if not result.passed:
+            lines.append('{}: {} (see {})'.format(os.path.basename(result.protocol_path), result.error, result.log_path))
+    passed = sum(result.passed for result in results)
+    lines.append('{} of {} protocols passed'.format(passed, len(results)))
+    return '\n'.join(lines)
+############################################################
+
+def main(arguments: list = None):
+    parser = argparse.ArgumentParser(description='Simulates OT-2 protocols (.py or .ipynb) in parallel, without dialogs')
+    parser.add_argument('protocols', nargs='+', help='protocol files to simulate')
+    parser.add_argument('--labware', default=None, help='folder containing the custom labware JSON definitions')
+    parser.add_argument('--logs', default='simulation_logs', help='folder receiving the logs and the summary')
+    parser.add_argument('--processes', type=int, default=None, help='number of worker processes (number of CPUs by default)')
+    parser.add_argument('--no-cache', action='store_true', help='simulate every protocol, even if it did not change')
+    parser.add_argument('--write-scripts', action='store_true', help='write the converted scripts next to the notebooks')
+    options = parser.parse_args(arguments)
+    results = simulate_batch(options.protocols, options.labware, options.logs, options.processes, not options.no_cache,
+                             options.write_scripts)
+    print(summary_table(results))
+    return 0 if all(result.passed for result in results) else 1
+
+#Code starts here
+if __name__ == "__main__":
+    sys.exit(main())
+############################################################
@@ -1,73 +1,508 @@
 from __future__ import absolute_import
 
+import time
+from collections.abc import MutableMapping
+
 import numpy as np
 from opentrons import types
 
+from Vesynta_Tech.OpenTrons2 import meniscus_tracking as mt
+
 ############################################################
 ### These functions are designed as protocol tools to be used in other functions ###
+class PipetteContext:
+    """
+    Values of a pipette read at every stroke (default flow rates and tip length), cached in pipette.custom_context
+    
+    - hits and misses count the values served from the cache and read from the pipette
+    - tip is the TipState of the tip handled by the custom functions (see prepare_tip())
+    The cache must be invalidated with invalidate_pipette_context() when the flow rates or the tip racks of the pipette change
+    """
+    def __init__(self):
+        self.default_flow_rates = None
+        self.tip_length = None
+        self.hits = 0
+        self.misses = 0
+        self.tip = TipState()
+    
+    def invalidate(self):
+        self.default_flow_rates = None
+        self.tip_length = None
+    def report(self):
+        return '{} values served from the cache, {} read from the pipette'.format(self.hits, self.misses)
+
+def get_pipette_context(pipette: types.Mount):
+    # Cache of a pipette, created on first use
+    context = getattr(pipette, 'custom_context', None)
+    if not isinstance(context, PipetteContext):
+        context = PipetteContext()
+        pipette.custom_context = context
+    return context
+def invalidate_pipette_context(pipette: types.Mount):
+    # To be called after changing the flow rates or tip racks of a pipette, 
+    # the liquid classes bound to the pipette are also removed so that their relative rates are calculated again
+    get_pipette_context(pipette).invalidate()
+    if isinstance(getattr(pipette, 'liquid_classes_dict', None), dict):
+        pipette.liquid_classes_dict = {}
+
 def get_tip_length(pipette: types.Mount):
     # Get tip length currently in use for a pipette
-    tip_racks = pipette._tip_racks[0]
-    tip_length = tip_racks.tip_length
-    return tip_length
+    context = get_pipette_context(pipette)
+    if context.tip_length is None:
+        tip_racks = pipette._tip_racks[0]
+        context.tip_length = tip_racks.tip_length
+        context.misses += 1
+    else:
+        context.hits += 1
+    return context.tip_length
 
 def get_default_flow_rates(pipette: types.Mount):
-    default_flow_rates = {}
-    default_flow_rates['aspirate'] = pipette._implementation._flow_rates.aspirate
-    default_flow_rates['dispense'] = pipette._implementation._flow_rates.dispense
-    default_flow_rates['blow_out'] = pipette._implementation._flow_rates.blow_out
-    return default_flow_rates
+    # Default flow rates of a pipette, the dictionary returned is shared and should not be modified
+    context = get_pipette_context(pipette)
+    if context.default_flow_rates is None:
+        default_flow_rates = {}
+        default_flow_rates['aspirate'] = pipette._implementation._flow_rates.aspirate
+        default_flow_rates['dispense'] = pipette._implementation._flow_rates.dispense
+        default_flow_rates['blow_out'] = pipette._implementation._flow_rates.blow_out
+        context.default_flow_rates = default_flow_rates
+        context.misses += 1
+    else:
+        context.hits += 1
+    return context.default_flow_rates
+
+def get_location_cache(pipette: types.Mount):
+    # Last location a pipette was moved to, None if unknown
+    if hasattr(pipette, 'location_cache'):
+        return pipette.location_cache    # recorder of a command plan, see command_plan.RecordingPipette
+    return pipette._ctx.location_cache
+############################################################
+
+### Storage of the custom information of all wells ###
+class DeckState:
+    """
+    Storage of the custom information (c_info) of every initiated well
+    
+    - volumes, headrooms and volume uncertainties are stored in contiguous numpy arrays indexed by a well id, 
+      given by initiate_well() and kept in well._geometry.custom_well_id
+      Wells are identified by their _geometry: the API returns a new Well object at every access to a well
+      (e.g. labware['A1'] or labware.wells()), all sharing the same _geometry
+    - each pair of vh_functions is stored once, wells only keep the index of their pair
+    - constituent information is only created for the wells where it is used
+    get_c_info() returns a WellInfo view of a well reading and writing directly in this storage
+    """
+    array_names = ('volume', 'headroom', 'volume_uncertainty_random', 'volume_uncertainty_systematic', 'vh_index')
+    
+    def __init__(self, capacity: int = 96):
+        self.wells = []
+        self.volume = np.zeros(capacity)
+        self.headroom = np.zeros(capacity)
+        self.volume_uncertainty_random = np.zeros(capacity)
+        self.volume_uncertainty_systematic = np.zeros(capacity)
+        self.vh_index = np.zeros(capacity, dtype=int)
+        self.vh_functions = []
+        self.constituent_info = {}
+        self.constituent_ids = {}
+        self.constituent_names = []
+        self._vh_indices = {}
+    
+    def add_well(self, well: types.Location):
+        # Returns the id of a well, a new id is only given to wells that are not stored yet
+        well_id = getattr(well._geometry, 'custom_well_id', None)
+        if well_id is not None and well_id < len(self.wells) and self.wells[well_id]._geometry is well._geometry:
+            return well_id
+        well_id = len(self.wells)
+        if well_id == len(self.volume):
+            self._grow()
+        self.wells.append(well)
+        well._geometry.custom_well_id = well_id
+        return well_id
+    def _grow(self):
+        # Doubles the capacity of all arrays
+        for name in self.array_names:
+            array = getattr(self, name)
+            setattr(self, name, np.concatenate([array, np.zeros(max(len(array), 1), dtype=array.dtype)]))
+    
+    def get_vh_index(self, volume_function: list):
+        # Returns the index of a pair of vh_functions, storing it the first time it is used
+        key = (id(volume_function[0]), id(volume_function[1]))
+        if key not in self._vh_indices:
+            self._vh_indices[key] = len(self.vh_functions)
+            self.vh_functions.append((volume_function[0], volume_function[1]))
+        return self._vh_indices[key]
+    def intern_constituent(self, constituent: str):
+        # Returns the id of a constituent name, a new id is given the first time a name is used
+        if constituent not in self.constituent_ids:
+            self.constituent_ids[constituent] = len(self.constituent_names)
+            self.constituent_names.append(constituent)
+        return self.constituent_ids[constituent]
+    def get_constituent_info(self, well_id: int):
+        # Returns the WellConstituents of a well, created empty if the well has none yet
+        if well_id not in self.constituent_info:
+            self.constituent_info[well_id] = WellConstituents()
+        return self.constituent_info[well_id]
+    
+    def ids(self, wells: list):
+        # Returns the ids of a list of wells (or of all the wells of a labware) as an array
+        if hasattr(wells, 'wells'):
+            wells = wells.wells()
+        return np.array([get_well_id(well) for well in wells], dtype=int)
+############################################################
+
+class WellConstituents:
+    """
+    Sparse stock information of the constituents of a well
+    
+    - ids is the sorted array of the ids (see deck_state.constituent_names) of the constituents present in the well
+    - the stock arrays give the information of each of these constituents, in the same order as ids
+    - order lists the ids in the order constituents were added to the well
+    Memory scales with the number of constituents in the well, not with the number of constituents on the deck
+    """
+    array_names = ('volume_stock', 'volume_uncertainty_stock', 'concentrations_stock', 'concentration_uncertainty_stock')
+    
+    def __init__(self):
+        self.constituents_number = 0
+        self.order = []
+        self.ids = np.zeros(0, dtype=int)
+        self.volume_stock = np.zeros(0)
+        self.volume_uncertainty_stock = np.zeros(0)
+        self.concentrations_stock = np.zeros(0)
+        self.concentration_uncertainty_stock = np.zeros(0)
+    def position(self, constituent_id: int):
+        # Returns the position of a constituent in the arrays, or None if it is not in the well
+        position = int(np.searchsorted(self.ids, constituent_id))
+        if position < len(self.ids) and self.ids[position] == constituent_id:
+            return position
+        return None
+    def add(self, constituent_id: int):
+        # Adds a constituent (with 0 stock information) if not present, returns its position in the arrays
+        return int(self.merge(np.array([constituent_id]))[0])
+    def merge(self, ids: np.ndarray):
+        """
+        Sorted union of the constituents of the well with the sorted array ids, returns the positions of ids in the arrays
+        Constituents new to the well are added with 0 stock information, in the order of their names
+        """
+        union_ids = np.union1d(self.ids, ids)
+        if len(union_ids) != len(self.ids):
+            new_ids = np.setdiff1d(ids, self.ids, assume_unique=True)
+            kept_positions = np.searchsorted(union_ids, self.ids)
+            for name in self.array_names:
+                array = np.zeros(len(union_ids))
+                array[kept_positions] = getattr(self, name)
+                setattr(self, name, array)
+            self.ids = union_ids
+            names = deck_state.constituent_names
+            self.order.extend(sorted(new_ids.tolist(), key=lambda constituent_id: names[constituent_id]))
+        return np.searchsorted(self.ids, ids)
+############################################################
+
+class WellInfo(MutableMapping):
+    """
+    Dictionary view of the information of a well (c_info) stored in deck_state, see initiate_well() for the keys
+    Reading or modifying a key reads or modifies deck_state directly
+    """
+    __slots__ = ('well_id',)
+    info_keys = ('constituents_number', 'volume', 'headroom', 'vh_functions', 'volume_uncertainty', 'constituents', 
+                 'concentrations_stock', 'concentration_uncertainty_stock', 'volume_stock', 'volume_uncertainty_stock')
+    
+    def __init__(self, well_id: int):
+        self.well_id = well_id
+    def __getitem__(self, key: str):
+        if key == 'volume':
+            return deck_state.volume[self.well_id]
+        if key == 'headroom':
+            return deck_state.headroom[self.well_id]
+        if key == 'volume_uncertainty':
+            return VolumeUncertaintyInfo(self.well_id)
+        if key == 'vh_functions':
+            v_given_h, h_given_v = deck_state.vh_functions[deck_state.vh_index[self.well_id]]
+            return {'v_given_h': v_given_h, 'h_given_v': h_given_v}
+        if key == 'constituents_number':
+            return deck_state.get_constituent_info(self.well_id).constituents_number
+        if key == 'constituents':
+            names = deck_state.constituent_names
+            return [names[constituent_id] for constituent_id in deck_state.get_constituent_info(self.well_id).order]
+        if key in self.info_keys:
+            return StockInfo(self.well_id, key)
+        raise KeyError(key)
+    def __setitem__(self, key: str, value):
+        if key == 'volume':
+            deck_state.volume[self.well_id] = value
+        elif key == 'headroom':
+            deck_state.headroom[self.well_id] = value
+        elif key == 'volume_uncertainty':
+            deck_state.volume_uncertainty_random[self.well_id] = value['random']
+            deck_state.volume_uncertainty_systematic[self.well_id] = value['systematic']
+        elif key == 'vh_functions':
+            deck_state.vh_index[self.well_id] = deck_state.get_vh_index([value['v_given_h'], value['h_given_v']])
+        elif key == 'constituents_number':
+            deck_state.get_constituent_info(self.well_id).constituents_number = value
+        elif key == 'constituents':
+            for constituent in value:
+                constituent_id = deck_state.intern_constituent(constituent)
+                deck_state.get_constituent_info(self.well_id).add(constituent_id)
+        elif key in self.info_keys:
+            stock_info = StockInfo(self.well_id, key)
+            for constituent, stock_value in value.items():
+                stock_info[constituent] = stock_value
+        else:
+            raise KeyError(key)
+    def __delitem__(self, key: str):
+        raise TypeError('Keys of the well information cannot be deleted')
+    def __iter__(self):
+        return iter(self.info_keys)
+    def __len__(self):
+        return len(self.info_keys)
+    def __repr__(self):
+        return repr(dict(self))
+class VolumeUncertaintyInfo(MutableMapping):
+    # Dictionary view of the random and systematic volume uncertainties of a well stored in deck_state
+    __slots__ = ('well_id',)
+    
+    def __init__(self, well_id: int):
+        self.well_id = well_id
+    def __getitem__(self, key: str):
+        if key == 'random':
+            return deck_state.volume_uncertainty_random[self.well_id]
+        if key == 'systematic':
+            return deck_state.volume_uncertainty_systematic[self.well_id]
+        raise KeyError(key)
+    def __setitem__(self, key: str, value: float):
+        if key == 'random':
+            deck_state.volume_uncertainty_random[self.well_id] = value
+        elif key == 'systematic':
+            deck_state.volume_uncertainty_systematic[self.well_id] = value
+        else:
+            raise KeyError(key)
+    def __delitem__(self, key: str):
+        raise TypeError('Keys of the well information cannot be deleted')
+    def __iter__(self):
+        return iter(('random', 'systematic'))
+    def __len__(self):
+        return 2
+    def __repr__(self):
+        return repr(dict(self))
+class StockInfo(MutableMapping):
+    # Dictionary view {constituent: value} of one of the stock arrays of a well stored in deck_state
+    __slots__ = ('well_id', 'array_name')
+    
+    def __init__(self, well_id: int, array_name: str):
+        self.well_id = well_id
+        self.array_name = array_name
+    def __getitem__(self, constituent: str):
+        constituent_id = deck_state.constituent_ids.get(constituent)
+        info = deck_state.get_constituent_info(self.well_id)
+        position = None if constituent_id is None else info.position(constituent_id)
+        if position is None:
+            raise KeyError(constituent)
+        return getattr(info, self.array_name)[position]
+    def __setitem__(self, constituent: str, value: float):
+        constituent_id = deck_state.intern_constituent(constituent)
+        info = deck_state.get_constituent_info(self.well_id)
+        position = info.add(constituent_id)
+        getattr(info, self.array_name)[position] = value
+    def __delitem__(self, constituent: str):
+        raise TypeError('Constituents cannot be removed from a well')
+    def __iter__(self):
+        names = deck_state.constituent_names
+        return iter([names[constituent_id] for constituent_id in deck_state.get_constituent_info(self.well_id).order])
+    def __len__(self):
+        return len(deck_state.get_constituent_info(self.well_id).order)
+    def __repr__(self):
+        return repr(dict(self))
+############################################################
+
+deck_state = DeckState()
+
+def reset_deck_state():
+    # Empties the storage of well information and the event log, to be called at the start of each protocol run
+    # so that the wells of a previous run in the same session (e.g. notebook or simulator) are not kept
+    global deck_state
+    deck_state = DeckState()
+    event_log.clear()
+def get_well_id(well: types.Location):
+    # Returns the id of an initiated well in deck_state
+    well_id = getattr(well._geometry, 'custom_well_id', None)
+    if well_id is None or well_id >= len(deck_state.wells) or deck_state.wells[well_id]._geometry is not well._geometry:
+        raise AttributeError('Well {} has not been initiated, use initiate_well()'.format(well))
+    return well_id
+############################################################
+
+### Warnings of the custom functions, stored as numbers and only formatted when read ###
+INFO, WARNING, ERROR = 0, 1, 2
+# Severity and message template of each type of event, {well} and {value} are given when the event is recorded
+event_types = {
+    'low_aspiration_height': (WARNING, 'Warning, aspiration height for well {well} is lower than {value} mm'),
+    'aspiration_submersion': (WARNING, 'Warning, aspiration depth was set lower then pipette tip length, it has been changed to {value}'),
+    'dispense_submersion': (WARNING, 'Warning, dispense depth was set lower then pipette tip length, it has been changed to {value}'),
+    'overflow_check_disabled': (WARNING, 'Warning, anti-overflow check has been deactivated by setting the safety height to 0'),
+    'overflow': (ERROR, 'Overflow risks! Dispense cancelled for {well}'),
+    'almost_full': (WARNING, 'Warning, container is almost full: {well}'),
+    'not_circular': (INFO, 'Well {well} is not circular, so just using standard touch_tip() command'),
+    'mixing_fraction': (INFO, 'Volume mixing fraction at {well} is {value:.2f}'),
+    'low_mixing_fraction': (WARNING, 'Volume mixing fraction at {well} is {value:.2f}, which may be too low!'),
+    'high_mixing_fraction': (WARNING, 'Volume mixing fraction at {well} is {value:.2f}, which may be too high!'),
+    'disposal_split': (WARNING, 'Warning, in order to include a disposal volume the transfer from {well} will be split into several passes...'),
+    'precision_target_missed': (WARNING, 'Warning, precision target cannot be reached, the fewest strokes are used with an uncertainty of {value:.3f} uL'),
+}
+event_names = list(event_types)
+event_ids = {name: type_id for type_id, name in enumerate(event_names)}
+
+class EventLog:
+    """
+    Ring buffer of the events of the custom functions (see event_types), replacing print() in the stroke path
+    
+    - events are stored in preallocated arrays (type, well, value), messages are only formatted by messages()
+    - only the last capacity events are kept, counts gives the number of events of each type since the last clear()
+    - events below min_severity are only counted, events at or above echo_severity are also printed when recorded
+    """
+    def __init__(self, capacity: int = 4096, min_severity: int = INFO, echo_severity: int = ERROR):
+        self.capacity = capacity
+        self.min_severity = min_severity
+        self.echo_severity = echo_severity
+        self.severities = np.array([event_types[name][0] for name in event_names])
+        self.types = np.zeros(capacity, dtype=int)
+        self.wells = np.empty(capacity, dtype=object)
+        self.values = np.zeros(capacity)
+        self.clear()
+    
+    def clear(self):
+        self.recorded = 0     # Events recorded since the last clear(), the buffer keeps the last capacity ones
+        self.counts = np.zeros(len(event_names), dtype=int)
+        self.wells[:] = None
+    def record(self, event_type: str, well: types.Location = None, value: float = 0):
+        type_id = event_ids[event_type]
+        self.counts[type_id] += 1
+        severity = self.severities[type_id]
+        if severity >= self.echo_severity:
+            print(self.format(type_id, well, value))
+        if severity < self.min_severity:
+            return
+        i = self.recorded % self.capacity
+        self.types[i] = type_id
+        self.wells[i] = well
+        self.values[i] = value
+        self.recorded += 1
+    def format(self, type_id: int, well: types.Location, value: float):
+        return event_types[event_names[type_id]][1].format(well=well, value=value)
+    def messages(self, min_severity: int = INFO):
+        # Messages of the events kept in the buffer, oldest first
+        kept = min(self.recorded, self.capacity)
+        messages = []
+        for i in range(self.recorded - kept, self.recorded):
+            j = i % self.capacity
+            if self.severities[self.types[j]] >= min_severity:
+                messages.append(self.format(self.types[j], self.wells[j], self.values[j]))
+        return messages
+    def get_counts(self):
+        # Number of events of each type recorded since the last clear(), types without events are omitted
+        return {name: int(count) for name, count in zip(event_names, self.counts) if count > 0}
+
+event_log = EventLog()
+
+def log_event(event_type: str, well: types.Location = None, value: float = 0):
+    # Records an event of the custom functions in event_log
+    event_log.record(event_type, well, value)
+def print_events(min_severity: int = WARNING):
+    # Prints the events kept in event_log, e.g. at the end of a simulation
+    for message in event_log.messages(min_severity):
+        print(message)
 ############################################################
 
 def set_c_info(well: types.Location, c_info: dict):
-    # Set the c_info dictionary attribute of a well from a properly formatted dictionary
-    well._geometry.custom_well_info = c_info
+    # Set the c_info of a well from a properly formatted dictionary (see initiate_well() for the keys)
+    # Views returned by get_c_info() already write in deck_state, they do not need to be set again
+    if isinstance(c_info, WellInfo) and c_info.well_id == getattr(well._geometry, 'custom_well_id', None):
+        return
+    info = WellInfo(deck_state.add_well(well))
+    for key, value in c_info.items():
+        info[key] = value
 def get_c_info(well: types.Location):
-    # Read and returns the c_info attribute of a well
-    c_info = well._geometry.custom_well_info
-    return c_info
+    # Returns a dictionary view of the c_info of a well
+    return WellInfo(get_well_id(well))
 ############################################################
 
 def get_h_from_v(well: types.Location, volume: float):
     # Converts a volume in headroom for a particular well
-    info = get_c_info(well)
-    h_given_v = info['vh_functions']['h_given_v']
+    h_given_v = deck_state.vh_functions[deck_state.vh_index[get_well_id(well)]][1]
     headroom = h_given_v(volume)
     return headroom
 def get_v_from_h(well: types.Location, headroom: float):
     # Converts a headroom in volume for a particular well
-    info = get_c_info(well)
-    v_given_h = info['vh_functions']['v_given_h']
+    v_given_h = deck_state.vh_functions[deck_state.vh_index[get_well_id(well)]][0]
     volume = v_given_h(headroom)
     return volume
 ############################################################
 
+def get_h_from_v_wells(wells: list,
+                       volumes: np.ndarray,
+                       per_well: bool = False):
+    """
+    Converts volumes in headrooms for several wells at once, e.g. all the wells of a rack
+    
+    - wells is a labware or a list of wells
+    - volumes is an array of volumes applied to every well, the result has the shape (number of wells, *volumes.shape)
+    - with per_well = True, the first axis of volumes gives the volumes of each well, the result has the shape of volumes
+    Wells sharing the same vh_functions (i.e. the same gradations) are converted in a single numpy call
+    """
+    return _convert_wells(wells, volumes, 'h_given_v', per_well)
+def get_v_from_h_wells(wells: list,
+                       headrooms: np.ndarray,
+                       per_well: bool = False):
+    """
+    Converts headrooms in volumes for several wells at once, e.g. all the wells of a rack
+    Arguments and shape of the result are the same as for get_h_from_v_wells()
+    """
+    return _convert_wells(wells, headrooms, 'v_given_h', per_well)
+def _convert_wells(wells: list,
+                   values: np.ndarray,
+                   function_name: str,
+                   per_well: bool):
+    # Applies the function_name vh_function of each well to the values, grouping wells by function
+    vh_indices = deck_state.vh_index[deck_state.ids(wells)]
+    values = np.asarray(values, dtype=float)
+    if per_well:
+        assert np.shape(values)[0] == len(vh_indices)
+        results = np.empty(np.shape(values))
+    else:
+        results = np.empty((len(vh_indices),) + np.shape(values))
+    position = {'v_given_h': 0, 'h_given_v': 1}[function_name]
+    for vh_index in np.unique(vh_indices):
+        indices = np.nonzero(vh_indices == vh_index)[0]
+        function = deck_state.vh_functions[vh_index][position]
+        if per_well:
+            results[indices] = function(values[indices])
+        else:
+            # The same values are converted once and copied to all the wells of the group
+            results[indices] = function(values)
+    return results
+############################################################
+
 def set_headroom(well: types.Location, headroom: float):
     # Set the headroom and volume attributes of a well from a headroom input
-    info = get_c_info(well)
-    info['headroom'] = headroom
-    volume = get_v_from_h(well, headroom)
-    info['volume'] = volume
-    set_c_info(well, info)
+    well_id = get_well_id(well)
+    deck_state.headroom[well_id] = headroom
+    deck_state.volume[well_id] = get_v_from_h(well, headroom)
 def get_headroom(well: types.Location):
     # Reads and return the headroom of a well
-    info = get_c_info(well)
-    headroom = info['headroom']
+    headroom = deck_state.headroom[get_well_id(well)]
     return headroom
+def get_headrooms(wells: list):
+    # Reads and return the headrooms of a list of wells (or of all the wells of a labware) as an array
+    return deck_state.headroom[deck_state.ids(wells)]
 ############################################################
 
 def set_volume(well: types.Location, volume: float):
     # Set the headroom and volume attributes of a well from a volume input
-    info = get_c_info(well)
-    info['volume'] = volume
-    headroom = get_h_from_v(well, volume)
-    info['headroom'] = headroom
-    set_c_info(well, info)
+    well_id = get_well_id(well)
+    deck_state.volume[well_id] = volume
+    deck_state.headroom[well_id] = get_h_from_v(well, volume)
 def get_volume(well: types.Location):
     # Reads and return the volume of a well
-    info = get_c_info(well)
-    volume = info['volume']
+    volume = deck_state.volume[get_well_id(well)]
     return volume
+def get_volumes(wells: list):
+    # Reads and return the volumes of a list of wells (or of all the wells of a labware) as an array
+    return deck_state.volume[deck_state.ids(wells)]
 ############################################################
 
 def get_relative_from_flow_rate_aspirate(pipette: types.Mount, flow_rate: float):
@@ -97,19 +532,29 @@ def set_constituent(well: types.Location,
     - uncertainties on the concentration are split between a random and systematic one. 
       If one is 0 or unknown, it doesn't need to be inputed (defaults to 0)
     """
-    c_info = get_c_info(well)
-    c_info['constituents_number'] += 1
-    c_info['constituents'].append(constituent)
-    c_info['concentrations_stock'][constituent] = concentration
-    c_info['concentration_uncertainty_stock'][constituent] = c_uncertainty
-    c_info['volume_stock'][constituent] = get_volume(well)
-    c_info['volume_uncertainty_stock'][constituent] = v_uncertainty
-    set_c_info(well, c_info)
+    constituent_id = deck_state.intern_constituent(constituent)
+    info = deck_state.get_constituent_info(get_well_id(well))
+    info.constituents_number += 1
+    position = info.add(constituent_id)
+    info.concentrations_stock[position] = concentration
+    info.concentration_uncertainty_stock[position] = c_uncertainty
+    info.volume_stock[position] = get_volume(well)
+    info.volume_uncertainty_stock[position] = v_uncertainty
 def get_constituents(well: types.Location):
     # This function reads and returns all the constituents present in a well
     c_info = get_c_info(well)
     constituents = c_info['constituents']  
     return constituents
+def get_constituent_id(constituent: str):
+    # Returns the integer id of a constituent name, shared by all wells (see deck_state.constituent_names)
+    return deck_state.intern_constituent(constituent)
+def has_constituent(well: types.Location,
+                    constituent: str):
+    # Checks if a constituent is present in a well
+    constituent_id = deck_state.constituent_ids.get(constituent)
+    if constituent_id is None:
+        return False
+    return deck_state.get_constituent_info(get_well_id(well)).position(constituent_id) is not None
 ############################################################
 
 def set_pipette_uncertainties(pipette: types.Mount,
@@ -127,6 +572,131 @@ def get_pipette_uncertainties(pipette: types.Mount):
     return pipette.uncertainties_dict
 ############################################################
 
+### Tips handled by the custom functions, reused according to the constituents they carry ###
+tip_policies = ('never', 'same_source', 'same_constituents')
+# Time (in s) after which a tip wetted by a source is not considered wet any more, see get_wetting_cycles()
+tip_wetting_timeout = 60
+
+class TipState:
+    """
+    Tip handled by the custom functions on a pipette, see prepare_tip()
+    
+    - attached is True while the pipette carries a tip picked up by prepare_tip(), tip_id counts the tips picked up
+    - source is the last source aspirated with the tip
+    - wells are the ids of the wells whose liquid the tip touched, constituents the ids of their constituents
+    - untracked is True if one of these wells had no constituent information
+    - wet_well, wet_constituents and wet_time are the id and constituent ids of the last source aspirated, 
+      and the time of that aspiration (time.monotonic())
+    - tips_used and tips_saved count the tips picked up and the transfers done with a reused tip, 
+      wetting_cycles_saved the pre-wetting cycles skipped
+    """
+    def __init__(self):
+        self.attached = False
+        self.tip_id = 0
+        self.source = None
+        self.wells = set()
+        self.constituents = set()
+        self.untracked = False
+        self.wet_well = None
+        self.wet_constituents = set()
+        self.wet_time = None
+        self.tips_used = 0
+        self.tips_saved = 0
+        self.wetting_cycles_saved = 0
+
+def get_tip_state(pipette: types.Mount):
+    return get_pipette_context(pipette).tip
+def _well_constituent_ids(well: types.Location):
+    # Ids of the constituents of a well, as a set
+    return set(deck_state.get_constituent_info(get_well_id(well)).ids.tolist())
+def record_tip_contact(pipette: types.Mount, 
+                       well: types.Location):
+    # Records that the tip touched the liquid of a well, after the constituents of the well are updated
+    tip = get_tip_state(pipette)
+    constituent_ids = _well_constituent_ids(well)
+    tip.wells.add(get_well_id(well))
+    tip.constituents.update(constituent_ids)
+    tip.untracked = tip.untracked or not constituent_ids
+def can_reuse_tip(pipette: types.Mount, 
+                  source: types.Location, 
+                  policy: str):
+    """
+    Checks if the current tip can be used to aspirate from source according to a policy:
+    - 'never': a new tip is used for every transfer
+    - 'same_source': the tip has only touched the liquid of this source
+    - 'same_constituents': the tip carries exactly the constituents of the source, all wells touched having constituent 
+      information (e.g. successive steps of a serial dilution, or several wells of the same stock solution)
+    """
+    assert policy in tip_policies
+    tip = get_tip_state(pipette)
+    if not tip.attached or policy == 'never':
+        return False
+    if policy == 'same_source':
+        return tip.wells <= {get_well_id(source)}
+    source_constituents = _well_constituent_ids(source)
+    return not tip.untracked and bool(source_constituents) and tip.constituents == source_constituents
+def prepare_tip(pipette: types.Mount, 
+                source: types.Location, 
+                policy: str):
+    # Keeps the current tip if the policy allows it for source, otherwise drops it and picks up a new one
+    # The pipette should not carry a tip that was not picked up by this function
+    tip = get_tip_state(pipette)
+    if can_reuse_tip(pipette, source, policy):
+        tip.tips_saved += 1
+    else:
+        if tip.attached:
+            pipette.drop_tip()
+        pipette.pick_up_tip()
+        tip.attached = True
+        tip.tip_id += 1
+        tip.tips_used += 1
+        tip.wells = set()
+        tip.constituents = set()
+        tip.untracked = False
+        tip.wet_well = None
+    tip.source = source
+def record_tip_wetting(pipette: types.Mount, 
+                       source: types.Location):
+    # Records that the tip has just been wetted by an aspiration from source
+    tip = get_tip_state(pipette)
+    tip.wet_well = get_well_id(source)
+    tip.wet_constituents = _well_constituent_ids(source)
+    tip.wet_time = time.monotonic()
+def get_wetting_cycles(pipette: types.Mount, 
+                       source: types.Location, 
+                       cycles: int,
+                       timeout: float = None):
+    """
+    Number of pre-wetting cycles still needed before aspirating from source with the tip handled by prepare_tip()
+    - none if the tip was wetted by the same source less than timeout seconds ago (tip_wetting_timeout by default)
+    - 1 if the tip was wetted by the same source longer ago, or by another source with the same constituents
+    - cycles otherwise, including for tips not handled by prepare_tip()
+    Times are measured when the custom functions are called (i.e. when recording a command plan, not at replay)
+    """
+    timeout = tip_wetting_timeout if timeout is None else timeout
+    tip = get_tip_state(pipette)
+    needed = cycles
+    if tip.attached and tip.wet_well is not None:
+        source_constituents = _well_constituent_ids(source)
+        if tip.wet_well == get_well_id(source):
+            needed = 0 if time.monotonic() - tip.wet_time <= timeout else min(cycles, 1)
+        elif source_constituents and tip.wet_constituents == source_constituents:
+            needed = min(cycles, 1)
+    tip.wetting_cycles_saved += cycles - needed
+    return needed
+def release_tip(pipette: types.Mount):
+    # Drops the tip picked up by prepare_tip(), e.g. at the end of a protocol
+    tip = get_tip_state(pipette)
+    if tip.attached:
+        pipette.drop_tip()
+        tip.attached = False
+        tip.source = None
+def tip_report(pipette: types.Mount):
+    tip = get_tip_state(pipette)
+    return '{} tips used, {} tips saved by reusing tips, {} pre-wetting cycles skipped'.format(tip.tips_used, tip.tips_saved, 
+                                                                                               tip.wetting_cycles_saved)
+############################################################
+
 def get_concentration(well: types.Location,
                       constituent: str):
     # Reads and returns the concentration and uncertainty of a constituent in a well. Dependent on stored stock information
@@ -160,22 +730,22 @@ def get_concentration(well: types.Location,
 ############################################################
 ### This function is used to initiate well attributes ###
 def initiate_well(well: types.Location, 
-                  volume_function: list):
+                  volume_function: list = None):
     """
     This function is used to initiate a well's custom attributes. Those attributes are regrouped as a dictionary 
-    with default values as follows:
+    (stored in deck_state and read with get_c_info()) with default values as follows:
     
     - Numerical values as 0
     - Headroom and vh_functions specific to the well
     - concentrations and uncertainties are dependent on thesubstances used in the protocol 
       and thus initiated as 'None' or left empty
-    """
+    
     c_info = {'constituents_number': 0, 
               'volume': 0,
-              'headroom': None,
+              'headroom': well._geometry._depth,
               'vh_functions': {
-                  'v_given_h': None,
-                  'h_given_v': None},
+                  'v_given_h': volume_function[0],
+                  'h_given_v': volume_function[1]},
               'volume_uncertainty': {
                   'random': 0,
                   'systematic': 0},
@@ -186,10 +756,19 @@ def initiate_well(well: types.Location,
               'volume_uncertainty_stock': {}
              }
     
-    c_info['headroom'] = well._geometry._depth
-    c_info['vh_functions']['v_given_h'] = volume_function[0]
-    c_info['vh_functions']['h_given_v'] = volume_function[1]
-    set_c_info(well, c_info)
+    If volume_function is not given, the vh_functions are found from the labware load name of the well 
+    (see mt.get_vh_functions()), they are then shared with all the other wells of the same type
+    """
+    if volume_function is None:
+        volume_function = mt.get_vh_functions(well.parent.load_name)
+    well_id = deck_state.add_well(well)
+    deck_state.volume[well_id] = 0
+    deck_state.headroom[well_id] = well._geometry._depth
+    deck_state.volume_uncertainty_random[well_id] = 0
+    deck_state.volume_uncertainty_systematic[well_id] = 0
+    deck_state.vh_index[well_id] = deck_state.get_vh_index(volume_function)
+    # Constituents information is created when first used
+    deck_state.constituent_info.pop(well_id, None)
 ############################################################
 
 def print_solution_info(well: types.Location):
@@ -203,13 +782,12 @@ def print_solution_info(well: types.Location):
 def print_constituent_concentration(well: types.Location,
                                     constituent: str,
                                     label: str = None):
-    info = get_c_info(well)
     if label:
         name = label
     else:
         name = well
     
-    if constituent in info['constituents']:
+    if has_constituent(well, constituent):
         concentration, low_unc, high_unc = get_concentration(well, constituent)
         print('\nConcentration of constituent {} in well {} is {} \u00B1 ({} - {}) ng/mL'.format(constituent, name, round(concentration, 2), round(low_unc, 2), round(high_unc, 2)))
     else:
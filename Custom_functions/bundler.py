@@ -0,0 +1,471 @@
+"""
+Bundling of a protocol and of the Custom_functions modules it uses into a single protocol file,
+as required by the OT-2 app and by opentrons.simulate
+
+* the protocol and the modules are parsed with ast, modules imported by other modules are bundled too
+* qualified references to a module (e.g. bb.get_volume) are replaced by the bundled name, other attributes are left untouched
+* top-level names defined in several modules are renamed in the bundle, e.g. _labware_of of command_plan.py
+  becomes _command_plan_labware_of
+* parsed files are cached by the hash of their source, so bundling again only parses the files that changed
+* the bundle is tree shaken: only the statements reachable from the protocol (e.g. from run()) are kept, and the
+  registries of labware load names (e.g. labware_gradations) only keep the labware loaded by the protocol,
+  so that the unused gradation tables and uncertainty profiles are not evaluated when the robot imports the protocol
+The statements are copied from the source files (not regenerated from the ast), so comments and formatting are kept
+"""
+############################################################
+from __future__ import absolute_import
+
+import ast
+import bisect
+import hashlib
+import io
+import os
+import re
+import time
+import tokenize
+
+############################################################
+
+# Packages from which the modules are imported in protocols, e.g. from Vesynta_Tech.OpenTrons2 import building_blocks as bb
+packages = ('Vesynta_Tech.OpenTrons2', 'Custom_functions')
+package_directory = os.path.dirname(os.path.abspath(__file__))
+# Lines added by the conversion of notebooks to scripts, removed from protocols
+cell_marker = re.compile(r'^#\s*In\[[0-9 ]*\]:\s*$')
+# Registries (module, name) of dictionaries keyed by labware load names, pruned to the labware loaded by the protocol
+load_name_registries = [('meniscus_tracking', 'labware_gradations')]
+
+def _package_module(module_name: str):
+    # Name of a module of the package from a full module name, '' for the package itself, None for other modules
+    if module_name is None:
+        return None
+    for package in packages:
+        if module_name == package:
+            return ''
+        if module_name.startswith(package + '.'):
+            return module_name[len(package)+1:]
+    return None
+def _import_text(node: ast.stmt):
+    # Source of an import statement, regenerated from the ast (e.g. for imports spanning several lines)
+    names = ', '.join(alias.name if alias.asname is None else '{} as {}'.format(alias.name, alias.asname)
+                      for alias in node.names)
+    if isinstance(node, ast.Import):
+        return 'import ' + names
+    return 'from {}{} import {}'.format('.'*node.level, node.module or '', names)
+def _string(node: ast.AST):
+    # Value of a string literal, None for other nodes (string literals are ast.Str in python 3.7)
+    if isinstance(node, (ast.Constant, getattr(ast, 'Str', ast.Constant))):
+        value = getattr(node, 'value', getattr(node, 's', None))
+        return value if isinstance(value, str) else None
+    return None
+def _logical_line_starts(source: str):
+    # First lines (counted from 1) of the logical lines of a source, a logical line spanning several lines
+    # for multi-line strings or brackets
+    starts = []
+    new_line = True
+    for token in tokenize.generate_tokens(io.StringIO(source).readline):
+        if token.type in (tokenize.NL, tokenize.COMMENT, tokenize.INDENT, tokenize.DEDENT, tokenize.ENDMARKER):
+            continue
+        if new_line:
+            starts.append(token.start[0])
+        new_line = token.type == tokenize.NEWLINE
+    return starts
+def _bound_names(node: ast.stmt):
+    # Names bound by a top-level statement: functions, classes, assignments and imports
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return [node.name]
+    if isinstance(node, (ast.Import, ast.ImportFrom)):
+        return [alias.asname or alias.name.split('.')[0] for alias in node.names]
+    if isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+        targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+        return [name.id for target in targets for name in ast.walk(target) if isinstance(name, ast.Name)]
+    return []
+############################################################
+
+class ParsedSource:
+    """
+    A protocol or module parsed once, see parse_source()
+
+    - lines are the lines of the source as bytes, since the column offsets of ast are byte offsets
+    - statements are (first line, end line, node) of the top-level statements, end line being the first line
+      of the next statement (lines counted from 0)
+    - imports gives the package imports by name bound: (module, None) for modules, (module, attribute) for names
+      imported from a module
+    - external_imports are (source, names bound) of the other imports, future_imports the sources of the
+      __future__ imports
+    - definitions are the top-level names defined (functions, classes and assignments)
+    """
+    def __init__(self, source: str):
+        self.source = source
+        self.lines = source.encode('utf-8').splitlines(True)
+        self.tree = ast.parse(source)
+        self.imports = {}
+        self.external_imports = []
+        self.future_imports = []
+        self.definitions = []
+        self.docstring = None
+        # The lineno of a multi-line string is its last line in python 3.7, so statements start at the logical line
+        # containing their first line (or their first decorator)
+        line_starts = _logical_line_starts(source)
+        starts = []
+        for node in self.tree.body:
+            first = min([node.lineno] + [decorator.lineno for decorator in getattr(node, 'decorator_list', [])])
+            starts.append(line_starts[bisect.bisect_right(line_starts, first) - 1] - 1)
+        self.statements = list(zip(starts, starts[1:] + [len(self.lines)], self.tree.body))
+        for i, node in enumerate(self.tree.body):
+            if i == 0 and isinstance(node, ast.Expr) and _string(node.value) is not None:
+                self.docstring = node
+            elif isinstance(node, (ast.Import, ast.ImportFrom)):
+                self._add_import(node)
+            else:
+                self.definitions.extend(_bound_names(node))
+
+    def _add_import(self, node: ast.stmt):
+        if isinstance(node, ast.ImportFrom) and node.module == '__future__':
+            self.future_imports.append(_import_text(node))
+            return
+        if isinstance(node, ast.ImportFrom):
+            module = _package_module(node.module) if node.level == 0 else None
+            if module is None:
+                self.external_imports.append((_import_text(node), _bound_names(node)))
+            for alias in node.names:
+                if module == '' and alias.name == '*':
+                    raise ValueError('Line {}: star imports of the package cannot be bundled, import modules by name'
+                                     .format(node.lineno))
+                if module == '':
+                    self.imports[alias.asname or alias.name] = (alias.name, None)
+                elif module is not None:
+                    self.imports[alias.asname or alias.name] = (module, alias.name)
+            return
+        external = [alias for alias in node.names if not _package_module(alias.name)]
+        if external:
+            node = ast.Import(names=external)
+            self.external_imports.append((_import_text(node), _bound_names(node)))
+        for alias in node.names:
+            module = _package_module(alias.name)
+            if module and alias.asname is None:
+                raise ValueError('Line {}: import {} cannot be bundled, use "import {} as ..."'
+                                 .format(node.lineno, alias.name, alias.name))
+            if module:
+                self.imports[alias.asname] = (module, None)
+    def imported_modules(self):
+        # Modules of the package used by this source, in order of import
+        modules = []
+        for module, attribute in self.imports.values():
+            if module not in modules:
+                modules.append(module)
+        return modules
+    def module_aliases(self):
+        # Names bound to modules of the package
+        return {name: module for name, (module, attribute) in self.imports.items() if attribute is None}
+############################################################
+
+_parsed_sources = {}
+
+def parse_source(source: str):
+    # ParsedSource of a source, parsed sources are cached by the hash of the source
+    key = hashlib.sha256(source.encode('utf-8')).hexdigest()
+    if key not in _parsed_sources:
+        _parsed_sources[key] = ParsedSource(source)
+    return _parsed_sources[key]
+def parse_module(module: str, directory: str = None):
+    # ParsedSource of a module of the package, read from its file in directory (the directory of this module by default)
+    directory = package_directory if directory is None else directory
+    path = os.path.join(directory, module + '.py')
+    if not os.path.exists(path):
+        raise ValueError('Module {} not found in {}'.format(module, directory))
+    with open(path, 'r') as file_reader:
+        return parse_source(file_reader.read())
+############################################################
+
+class _Rewriter(ast.NodeVisitor):
+    # Collects the edits replacing module references and renamed names in a parsed source
+    # Names bound locally in a function (arguments or assignments) are not renamed in that function
+    def __init__(self, parsed: ParsedSource, module_aliases: dict, attribute_names: dict, name_map: dict):
+        self.parsed = parsed
+        self.module_aliases = module_aliases
+        self.attribute_names = attribute_names
+        self.name_map = name_map
+        self.shadowed = [set()]
+        self.edits = []
+
+    def _edit(self, line: int, pattern: bytes, replacement: str, start: int = 0):
+        # Replaces the first match of pattern from the column start of a line (counted from 1)
+        match = re.compile(pattern).search(self.parsed.lines[line-1], start)
+        if match is None:
+            raise ValueError('Line {}: reference could not be bundled: {}'.format(line, self.parsed.lines[line-1].decode('utf-8')))
+        self.edits.append((line-1, match.start(1), match.end(1), replacement.encode('utf-8')))
+    def _renamed(self, name: str):
+        return name in self.name_map and not any(name in shadowed for shadowed in self.shadowed)
+    def visit_Attribute(self, node: ast.Attribute):
+        value = node.value
+        if isinstance(value, ast.Name) and value.id in self.module_aliases and not self._renamed(value.id) \
+           and not any(value.id in shadowed for shadowed in self.shadowed):
+            module = self.module_aliases[value.id]
+            pattern = (r'\b(' + re.escape(value.id) + r'\s*\.\s*' + re.escape(node.attr) + r')\b').encode('utf-8')
+            self._edit(value.lineno, pattern, self.attribute_names(module, node.attr), value.col_offset)
+        else:
+            self.generic_visit(node)
+    def visit_Name(self, node: ast.Name):
+        if self._renamed(node.id):
+            self._edit(node.lineno, (r'\b(' + re.escape(node.id) + r')\b').encode('utf-8'), self.name_map[node.id], node.col_offset)
+    def _visit_scope(self, node: ast.AST, local_names: set):
+        self.shadowed.append(local_names)
+        self.generic_visit(node)
+        self.shadowed.pop()
+    def _local_names(self, node: ast.AST):
+        # Names bound in a function: arguments and assigned names (global declarations excluded)
+        arguments = node.args
+        names = {argument.arg for argument in arguments.args + arguments.kwonlyargs + getattr(arguments, 'posonlyargs', [])}
+        names.update(argument.arg for argument in (arguments.vararg, arguments.kwarg) if argument is not None)
+        declared_global = set()
+        for child in ast.walk(node):
+            if isinstance(child, ast.Name) and isinstance(child.ctx, ast.Store):
+                names.add(child.id)
+            elif isinstance(child, (ast.Global, ast.Nonlocal)):
+                declared_global.update(child.names)
+        return names - declared_global
+    def visit_FunctionDef(self, node: ast.FunctionDef):
+        if self._renamed(node.name):
+            # In python 3.7 the line of a decorated function is the line of its first decorator
+            line = node.lineno
+            pattern = (r'\bdef\s+(' + re.escape(node.name) + r')\b').encode('utf-8')
+            while not re.search(pattern, self.parsed.lines[line-1]):
+                line += 1
+            self._edit(line, pattern, self.name_map[node.name])
+        for decorator in node.decorator_list:
+            self.visit(decorator)
+        for default in node.args.defaults + [default for default in node.args.kw_defaults if default is not None]:
+            self.visit(default)
+        for argument in node.args.args + node.args.kwonlyargs:
+            if argument.annotation is not None:
+                self.visit(argument.annotation)
+        if node.returns is not None:
+            self.visit(node.returns)
+        self.shadowed.append(self._local_names(node))
+        for statement in node.body:
+            self.visit(statement)
+        self.shadowed.pop()
+    visit_AsyncFunctionDef = visit_FunctionDef
+    def visit_Lambda(self, node: ast.Lambda):
+        self._visit_scope(node, self._local_names(node))
+    def visit_ClassDef(self, node: ast.ClassDef):
+        if self._renamed(node.name):
+            line = node.lineno
+            pattern = (r'\bclass\s+(' + re.escape(node.name) + r')\b').encode('utf-8')
+            while not re.search(pattern, self.parsed.lines[line-1]):
+                line += 1
+            self._edit(line, pattern, self.name_map[node.name])
+        self.generic_visit(node)
+    def visit_Global(self, node: ast.Global):
+        for name in node.names:
+            if name in self.name_map:
+                self._edit(node.lineno, (r'\b(' + re.escape(name) + r')\b').encode('utf-8'), self.name_map[name], node.col_offset)
+    visit_Nonlocal = visit_Global
+
+def _rewrite_statements(parsed: ParsedSource, attribute_names, name_map: dict, keep_docstring: bool):
+    # Top-level statements (imports excluded) of a parsed source as (node, source), with module references and renamed
+    # names replaced
+    rewriter = _Rewriter(parsed, parsed.module_aliases(), attribute_names, name_map)
+    rewriter.visit(parsed.tree)
+    lines = list(parsed.lines)
+    for line, start, end, replacement in sorted(rewriter.edits, reverse=True):
+        lines[line] = lines[line][:start] + replacement + lines[line][end:]
+    statements = []
+    for start, end, node in parsed.statements:
+        if isinstance(node, (ast.Import, ast.ImportFrom)) or (node is parsed.docstring and not keep_docstring):
+            continue
+        statements.append((node, b''.join(lines[start:end]).decode('utf-8').rstrip() + '\n'))
+    return statements
+def _used_names(node: ast.stmt, module_aliases: dict, attribute_names, name_map: dict):
+    # Names of the bundle used by a statement, over-estimated as the names bound locally in functions are included
+    names = set()
+    for child in ast.walk(node):
+        if isinstance(child, ast.Name):
+            names.add(name_map.get(child.id, child.id))
+        elif isinstance(child, ast.Attribute) and isinstance(child.value, ast.Name) and child.value.id in module_aliases:
+            names.add(attribute_names(module_aliases[child.value.id], child.attr))
+        elif isinstance(child, (ast.Global, ast.Nonlocal)):
+            names.update(name_map.get(name, name) for name in child.names)
+    return names
+############################################################
+
+def _loaded_labware(tree: ast.AST):
+    # Load names of the labware loaded by a protocol, None if some of them are not given as strings
+    load_names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+            if node.func.attr == 'load_labware_from_definition':
+                return None
+            if node.func.attr == 'load_labware':
+                arguments = node.args[:1] + [keyword.value for keyword in node.keywords if keyword.arg == 'load_name']
+                if len(arguments) != 1 or _string(arguments[0]) is None:
+                    return None
+                load_names.add(_string(arguments[0]))
+    return load_names
+def _pruned_registry(node: ast.stmt, load_names: set, name_map: dict):
+    """
+    Source and used names of a registry assignment, e.g. labware_gradations = {'load name': gradations_name, ...},
+    keeping the load names given only
+    Returns None if the statement is not a dictionary of names keyed by strings
+    """
+    if not (isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name)
+            and isinstance(node.value, ast.Dict)):
+        return None
+    entries = [(_string(key), value) for key, value in zip(node.value.keys, node.value.values)]
+    if not all(key is not None and isinstance(value, ast.Name) for key, value in entries):
+        return None
+    target = name_map.get(node.targets[0].id, node.targets[0].id)
+    kept = [(key, name_map.get(value.id, value.id)) for key, value in entries if key in load_names]
+    separator = ',\n' + ' '*(len(target) + 4)
+    source = '{} = {{{}}}\n'.format(target, separator.join('{!r}: {}'.format(key, name) for key, name in kept))
+    return source, {name for key, name in kept}
+
+class _Statement:
+    # Top-level statement of the bundle, with the names of the bundle it defines and uses
+    __slots__ = ('owner', 'node', 'source', 'defined', 'used')
+
+    def __init__(self, owner: str, node: ast.stmt, source: str, defined: set, used: set):
+        self.owner = owner
+        self.node = node
+        self.source = source
+        self.defined = defined
+        self.used = used
+
+def _reachable_statements(statements: list):
+    """
+    Indices of the statements reachable from the protocol: the statements of the protocol, the module statements
+    not defining names (other than strings, e.g. comments written as strings) and the statements defining
+    the names used by reachable statements
+    """
+    definers = {}
+    for i, statement in enumerate(statements):
+        for name in statement.defined:
+            definers.setdefault(name, []).append(i)
+    pending = [i for i, statement in enumerate(statements)
+               if statement.owner == '__protocol__'
+               or (not statement.defined and not (isinstance(statement.node, ast.Expr) and _string(statement.node.value) is not None))]
+    reachable = set(pending)
+    while pending:
+        for name in statements[pending.pop()].used:
+            for i in definers.get(name, []):
+                if i not in reachable:
+                    reachable.add(i)
+                    pending.append(i)
+    return reachable
+############################################################
+
+def bundle_protocol(source: str,
+                    directory: str = None,
+                    shake: bool = True):
+    """
+    Bundles the source of a protocol with the modules of the package it imports, returns the source of the bundle
+    - directory contains the modules (the directory of this module by default)
+    - shake only keeps the statements reachable from the protocol, and the labware it loads in load_name_registries
+      (labware loaded with load names that are not strings disable the pruning of the registries)
+    Names defined in several modules are renamed, names defined in the protocol are never renamed
+    """
+    protocol = parse_source('\n'.join(line for line in source.split('\n') if not cell_marker.match(line)))
+    # Modules needed, dependencies first
+    order = []
+    visiting = []
+    def add_module(module):
+        if module in order or module in visiting:
+            return
+        visiting.append(module)
+        for dependency in parse_module(module, directory).imported_modules():
+            add_module(dependency)
+        visiting.pop()
+        order.append(module)
+    for module in protocol.imported_modules():
+        add_module(module)
+    modules = {module: parse_module(module, directory) for module in order}
+    modules['__protocol__'] = protocol
+    # Top-level names defined more than once are renamed in the modules
+    owners = {name: ['__protocol__'] for name in protocol.definitions}
+    for module in order:
+        for name in set(modules[module].definitions):
+            owners.setdefault(name, []).append(module)
+    renames = {(module, name): ('_' + module + name if name.startswith('_') else module + '_' + name)
+               for name, name_owners in owners.items() if len(name_owners) > 1
+               for module in name_owners if module != '__protocol__'}
+    def attribute_names(module, attribute):
+        return renames.get((module, attribute), attribute)
+    def name_map(parsed, module):
+        # Replacements of the names of a source: renamed definitions and names imported from modules
+        names = {name: new_name for (owner, name), new_name in renames.items() if owner == module}
+        for name, (imported_module, attribute) in parsed.imports.items():
+            if attribute is not None and attribute_names(imported_module, attribute) != name:
+                names[name] = attribute_names(imported_module, attribute)
+        return names
+    # Statements, with the names they define and use
+    load_names = _loaded_labware(protocol.tree) if shake else None
+    statements = []
+    for module in order + ['__protocol__']:
+        parsed = modules[module]
+        names = name_map(parsed, module)
+        for node, text in _rewrite_statements(parsed, attribute_names, names, module == '__protocol__'):
+            defined = {names.get(name, name) for name in _bound_names(node)}
+            used = _used_names(node, parsed.module_aliases(), attribute_names, names)
+            registry = [(module, name) for name in _bound_names(node) if (module, name) in load_name_registries]
+            if registry and load_names is not None:
+                text, used = _pruned_registry(node, load_names, names) or (text, used)
+            statements.append(_Statement(module, node, text, defined, used))
+    reachable = _reachable_statements(statements) if shake else range(len(statements))
+    statements = [statement for i, statement in enumerate(statements) if i in reachable]
+    used = set().union(*[statement.used for statement in statements])
+    # Imports, without duplicates (imports of modules only kept if they are used)
+    future_imports, external_imports = [], []
+    for module in ['__protocol__'] + order:
+        future_imports.extend(text for text in modules[module].future_imports if text not in future_imports)
+        external_imports.extend(text for text, names in modules[module].external_imports
+                                if text not in external_imports
+                                and (not shake or module == '__protocol__' or used.intersection(names)))
+    chunks = [text + '\n' for text in future_imports + external_imports]
+    owner = None
+    for statement in statements:
+        if statement.owner != owner:
+            owner = statement.owner
+            title = 'Protocol' if owner == '__protocol__' else owner + '.py'
+            chunks.append('############################################################\n# {}\n'.format(title))
+        chunks.append(statement.source)
+    return ''.join(chunks)
+def bundle_report(source: str,
+                  directory: str = None,
+                  repeats: int = 3):
+    """
+    Size and import time of the bundle of a protocol, before and after tree shaking
+    The import time is the time taken to compile and execute the bundle (run() is not called), best of repeats
+    A bundle failing to import is reported with its error instead of raising it, the report is only informative
+    """
+    lines = []
+    for shake in (False, True):
+        bundle = bundle_protocol(source, directory, shake)
+        times = []
+        try:
+            for i in range(repeats):
+                start = time.perf_counter()
+                exec(compile(bundle, '<bundle>', 'exec'), {'__name__': '__bundle__'})
+                times.append(time.perf_counter() - start)
+            imported = 'imported in {} ms'.format(round(1000*min(times), 1))
+        except Exception as error:
+            imported = 'import failed ({}: {})'.format(type(error).__name__, error)
+        lines.append('{}: {} lines, {} kB, {}'
+                     .format('Tree shaken bundle' if shake else 'Full bundle', bundle.count('\n'),
+                             round(len(bundle.encode('utf-8'))/1000, 1), imported))
+    return '\n'.join(lines)
+def bundle_protocol_file(file: str,
+                         output_file: str = None,
+                         directory: str = None,
+                         shake: bool = True,
+                         report: bool = False):
+    # Bundles a protocol file, the bundle is written in one go to output_file (file itself by default)
+    # report prints the size and import time of the bundle before and after tree shaking (see bundle_report())
+    with open(file, 'r') as file_reader:
+        source = file_reader.read()
+    bundle = bundle_protocol(source, directory, shake)
+    if report:
+        print(bundle_report(source, directory))
+    with open(file if output_file is None else output_file, 'w') as outfile:
+        outfile.write(bundle)
+    return bundle
+############################################################
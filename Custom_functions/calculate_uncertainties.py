@@ -13,7 +13,7 @@ from __future__ import absolute_import
 import numpy as np
 
 from opentrons import types
-from Custom_functions import building_blocks as bb
+from Vesynta_Tech.OpenTrons2 import building_blocks as bb
 ############################################################
 
 def profile_to_vu(experimental_uncertainties_data: np.ndarray):
@@ -54,6 +54,89 @@ def volume_uncertainty(pipette: types.Mount,
     return [volume_uncertainty_r, volume_uncertainty_s]
 ############################################################
 
+def _source_uncertainties(pipette: types.Mount, 
+                          volume_transfer: float, 
+                          source: types.Location):
+    # Updates the uncertainties and stock volumes of the source for the aspiration of volume_transfer
+    # Returns the transferred volume uncertainties and stock information (ids of the constituents, stock volumes, 
+    # stock volume uncertainties, stock concentrations and their uncertainties), see uncertainties_calculation()
+    source_info = bb.get_c_info(source)
+    vt = volume_transfer
+    v1 = bb.get_volume(source)
+    del_r_vt, del_s_vt = volume_uncertainty(pipette, volume_transfer)
+    del_r_v1 = source_info['volume_uncertainty']['random']
+    del_s_v1 = source_info['volume_uncertainty']['systematic']
+    if del_r_v1 != 0:
+        del_r_v1 = np.sqrt(del_r_vt**2 + del_r_v1**2)
+    if del_s_v1 != 0:    
+        del_s_v1 = del_s_vt + del_s_v1
+    source_info['volume_uncertainty']['random'] = del_r_v1
+    source_info['volume_uncertainty']['systematic'] = del_s_v1
+    stock_1 = bb.deck_state.get_constituent_info(bb.get_well_id(source))
+    r = vt/v1
+    # Transmission of stock information, all constituents of a well are calculated at once 
+    # Constituents absent from a well have 0 stock volume and uncertainty, as in the formulas for a single constituent
+    # np.float_power is used for squares of arrays: like x**2 on a single number it calls pow(), 
+    # whereas x**2 on an array is calculated as x*x, which can differ on the last bit
+    vs1 = stock_1.volume_stock                        # Initial stock volumes in the source
+    del_vs1 = stock_1.volume_uncertainty_stock        # Stock volume uncertainties in source
+    del_vs_t_pc = np.sqrt((del_r_vt/vt)**2+(del_r_v1/v1)**2+np.float_power(del_vs1/vs1, 2))
+    vs_t = r*vs1                                      # Transferred stock volumes
+    del_vs_t = del_vs_t_pc * (r*vs1)                  # Transferred stock volume uncertainties
+    stock_1.volume_uncertainty_stock = del_vs_t_pc * (1-r)*vs1
+    stock_1.volume_stock = vs1*(1-r)
+    return (del_r_vt, del_s_vt, stock_1.ids, vs_t, del_vs_t, 
+            stock_1.concentrations_stock, stock_1.concentration_uncertainty_stock)
+def _destination_uncertainties(destination: types.Location, 
+                               transferred: tuple):
+    # Updates the uncertainties and stock volumes of the destination receiving the output of _source_uncertainties()
+    del_r_vt, del_s_vt, ids_t, vs_t, del_vs_t, c_t, del_c_t = transferred
+    destination_info = bb.get_c_info(destination)
+    del_r_v2 = destination_info['volume_uncertainty']['random']
+    del_s_v2 = destination_info['volume_uncertainty']['systematic']
+    destination_info['volume_uncertainty']['random'] = np.sqrt(del_r_vt**2 + del_r_v2**2)
+    destination_info['volume_uncertainty']['systematic'] = del_s_vt + del_s_v2
+    stock_2 = bb.deck_state.get_constituent_info(bb.get_well_id(destination))
+    new_in_2 = np.setdiff1d(ids_t, stock_2.ids)       # Constituents added to the destination
+    # Sorted union of the constituents, positions_t gives the positions of the transferred constituents in the destination
+    positions_t = stock_2.merge(ids_t)
+    # Constituents new to the destination take the stock concentrations of the source
+    new_positions_t = np.searchsorted(ids_t, new_in_2)
+    new_positions_2 = np.searchsorted(stock_2.ids, new_in_2)
+    stock_2.concentrations_stock[new_positions_2] = c_t[new_positions_t]
+    stock_2.concentration_uncertainty_stock[new_positions_2] = del_c_t[new_positions_t]
+    # Transferred stock information scattered on all the constituents of the final destination
+    vs_t_3 = np.zeros(len(stock_2.ids))
+    del_vs_t_3 = np.zeros(len(stock_2.ids))
+    vs_t_3[positions_t] = vs_t
+    del_vs_t_3[positions_t] = del_vs_t
+    vs2 = stock_2.volume_stock                        # Initial stock volumes in the destination
+    del_vs2 = stock_2.volume_uncertainty_stock
+    stock_2.volume_stock = vs2 + vs_t_3
+    stock_2.volume_uncertainty_stock = np.sqrt(np.float_power(del_vs2, 2) + np.float_power(del_vs_t_3, 2))
+    stock_2.constituents_number = len(stock_2.ids)
+def _combine_transferred(transfers: list):
+    # Combines the outputs of _source_uncertainties() for several aspirations dispensed together
+    # Random uncertainties add in quadrature and systematic ones linearly, as for successive dispenses
+    # A constituent coming from several sources keeps the stock concentrations of the first one
+    ids_t = transfers[0][2]
+    for transferred in transfers[1:]:
+        ids_t = np.union1d(ids_t, transferred[2])
+    vs_t = np.zeros(len(ids_t))
+    del_vs_t_squared = np.zeros(len(ids_t))
+    c_t = np.zeros(len(ids_t))
+    del_c_t = np.zeros(len(ids_t))
+    for transferred in reversed(transfers):
+        positions = np.searchsorted(ids_t, transferred[2])
+        vs_t[positions] += transferred[3]
+        del_vs_t_squared[positions] += np.float_power(transferred[4], 2)
+        c_t[positions] = transferred[5]
+        del_c_t[positions] = transferred[6]
+    del_r_vt = np.sqrt(sum(transferred[0]**2 for transferred in transfers))
+    del_s_vt = sum(transferred[1] for transferred in transfers)
+    return (del_r_vt, del_s_vt, ids_t, vs_t, np.sqrt(del_vs_t_squared), c_t, del_c_t)
+############################################################
+
 def uncertainties_calculation(pipette: types.Mount, 
                                 volume_transfer: float, 
                                 source:types.Location, 
@@ -76,64 +159,158 @@ def uncertainties_calculation(pipette: types.Mount,
     - t: used in 'vt' to designate the transferred volume
     - v: 'volume'
     """
-    # Extracts all information for the source and destination
-    source_info = bb.get_c_info(source)
-    destination_info = bb.get_c_info(destination)
-    initial_volume_source = bb.get_volume(source)
-    # Variables name simplification for calculation readability
-    vt = volume_transfer
-    v1 = initial_volume_source
-    # Volume uncertainties extractions (deltas = del_ in names, r and s stand for random and systematic)
-    del_r_vt = volume_uncertainty(pipette, volume_transfer)[0]
-    del_r_v1 = source_info['volume_uncertainty']['random']
-    del_r_v2 = destination_info['volume_uncertainty']['random']
-    del_s_vt = volume_uncertainty(pipette, volume_transfer)[1]
-    del_s_v1 = source_info['volume_uncertainty']['systematic']
-    del_s_v2 = destination_info['volume_uncertainty']['systematic']
-    # New volume uncertainties calculations
-    del_r_v3 = np.sqrt(del_r_vt**2 + del_r_v2**2)
-    del_s_v3 = del_s_vt + del_s_v2
-    if del_r_v1 != 0:
-        del_r_v1 = np.sqrt(del_r_vt**2 + del_r_v1**2)
-    if del_s_v1 != 0:    
-        del_s_v1 = del_s_vt + del_s_v1
-    # Transmission of calculated volume uncertainties to the local dictionary
-    source_info['volume_uncertainty']['random'] = del_r_v1
-    source_info['volume_uncertainty']['systematic'] = del_s_v1
-    destination_info['volume_uncertainty']['random'] = del_r_v3
-    destination_info['volume_uncertainty']['systematic'] = del_s_v3
-    # Creation of a list containing all the constituents a single time
-    source_constituents_list = source_info['constituents']
-    destination_constituents_list = destination_info['constituents']
-    final_destination_constituents_list = np.unique(source_constituents_list + destination_constituents_list)
-    r = vt/v1
-    # Transmission of stock information
-    for constituent in final_destination_constituents_list:
-        if constituent in source_constituents_list:
-            vs1 = source_info['volume_stock'][constituent]                  # Initial stock volume in the source
-            del_vs1 = source_info['volume_uncertainty_stock'][constituent]  # Stock volume uncertainty in source
-            del_vs_t_pc = np.sqrt((del_r_vt/vt)**2+(del_r_v1/v1)**2+(del_vs1/vs1)**2)
-            del_vs_t = del_vs_t_pc * (r*vs1)
-            source_info['volume_uncertainty_stock'][constituent] = del_vs_t_pc * (1-r)*vs1  
-            source_info['volume_stock'][constituent] = vs1*(1-r)
-        else: 
-            vs1 = 0  
-            del_vs_t = 0
-        if constituent in destination_constituents_list:
-            vs2 = destination_info['volume_stock'][constituent] # Initial stock volume in the destination
-            del_vs2 = destination_info['volume_uncertainty_stock'][constituent]
-        else:    
-            destination_info['concentrations_stock'][constituent] = source_info['concentrations_stock'][constituent]
-            destination_info['concentration_uncertainty_stock'][constituent] = source_info['concentration_uncertainty_stock'][constituent]
-            vs2 = 0
-            del_vs2 = 0
-            destination_info['constituents'].append(constituent)
-        destination_info['volume_stock'][constituent] = vs2 + r*vs1        
-        destination_info['volume_uncertainty_stock'][constituent] = np.sqrt(del_vs2**2 + del_vs_t**2)
-    destination_info['constituents_number'] = len(final_destination_constituents_list)
-    # Final transmission from local dictionary to well attributes   
-    bb.set_c_info(source, source_info)
-    bb.set_c_info(destination, destination_info)
+    _destination_uncertainties(destination, _source_uncertainties(pipette, volume_transfer, source))
+def uncertainties_calculation_consolidate(pipette: types.Mount, 
+                                          volumes_transfer: list, 
+                                          sources: list, 
+                                          destination: types.Location):
+    """
+    Same as uncertainties_calculation() for several aspirations (1 stroke per source) dispensed together in the destination
+    Each source is updated for its own stroke, the destination is updated once with the combined strokes
+    This function should be called BEFORE the actual transfers
+    """
+    assert len(volumes_transfer) == len(sources)
+    assert all(source._geometry is not destination._geometry for source in sources)
+    transfers = [_source_uncertainties(pipette, volume_transfer, source) 
+                 for volume_transfer, source in zip(volumes_transfer, sources)]
+    _destination_uncertainties(destination, _combine_transferred(transfers))
+############################################################
+
+class PipetteSelection:
+    """
+    Pipette chosen for each volume of a list of transfers, returned by select_pipettes()
+    
+    - pipettes are the candidate pipettes, choice the index of the pipette chosen for each volume
+    - strokes, pass_volume, random and systematic are arrays (candidates x volumes) giving for each candidate 
+      the number of strokes, the volume of each stroke and the total uncertainties of the transfer (in uL),
+      infeasible candidates have 0 strokes
+    """
+    def __init__(self, pipettes: list, volumes: np.ndarray, choice: np.ndarray, 
+                 strokes: np.ndarray, pass_volume: np.ndarray, random: np.ndarray, systematic: np.ndarray):
+        self.pipettes = pipettes
+        self.volumes = volumes
+        self.choice = choice
+        self.strokes = strokes
+        self.pass_volume = pass_volume
+        self.random = random
+        self.systematic = systematic
+
+    def pipette(self, i: int):
+        # Pipette chosen for the transfer i
+        return self.pipettes[self.choice[i]]
+    def explain(self, i: int):
+        # Reason of the choice for the transfer i, compared to the other candidates
+        lines = ['{} uL: {}'.format(self.volumes[i], self.pipettes[self.choice[i]])]
+        for k, pipette in enumerate(self.pipettes):
+            if self.strokes[k, i] == 0:
+                text = 'not possible (below the minimum volume)'
+            else:
+                text = '{} stroke(s) of {} uL, uncertainty {} uL (random {}, systematic {})'.format(
+                    self.strokes[k, i], round(self.pass_volume[k, i], 2), round(np.hypot(self.random[k, i], self.systematic[k, i]), 3),
+                    round(self.random[k, i], 3), round(self.systematic[k, i], 3))
+            lines.append('\t{} {}: {}'.format('*' if k == self.choice[i] else '-', pipette, text))
+        return '\n'.join(lines)
+    def report(self):
+        # Number of transfers (i.e. tips) and strokes for each pipette
+        lines = []
+        for k, pipette in enumerate(self.pipettes):
+            chosen = self.choice == k
+            lines.append('{}: {} transfers, {} strokes'.format(pipette, np.sum(chosen), np.sum(self.strokes[k, chosen])))
+        return '\n'.join(lines)
+
+def select_pipettes(pipettes: list, 
+                    volumes: list):
+    """
+    Chooses the pipette to use for each volume of a list of transfers, among pipettes with uncertainties set 
+    by bb.set_pipette_uncertainties()
+    Volumes larger than the max_volume of a pipette are split in equal strokes as in custom_transfer_forward()
+    
+    The pipette needing the fewest strokes is chosen, then the one with the lowest total uncertainty, 
+    i.e. random and systematic uncertainties of all strokes combined (added in quadrature for random ones,
+    linearly for systematic ones, then in quadrature together)
+    Each transfer uses one tip whichever the pipette, so tip use only depends on the number of transfers
+    All candidates are evaluated at once for the whole list of volumes
+    Returns a PipetteSelection, see PipetteSelection.explain() for the reasons of each choice
+    """
+    volumes = np.asarray(volumes, dtype=float)
+    assert np.all(volumes > 0)
+    strokes = np.zeros((len(pipettes), len(volumes)), dtype=int)
+    pass_volume = np.zeros((len(pipettes), len(volumes)))
+    random = np.zeros((len(pipettes), len(volumes)))
+    systematic = np.zeros((len(pipettes), len(volumes)))
+    for k, pipette in enumerate(pipettes):
+        strokes_k = np.ceil(volumes/pipette.max_volume).astype(int)
+        pass_volume_k = volumes/strokes_k
+        feasible = pass_volume_k >= pipette.min_volume
+        del_r, del_s = volume_uncertainty(pipette, pass_volume_k)
+        strokes[k] = np.where(feasible, strokes_k, 0)
+        pass_volume[k] = np.where(feasible, pass_volume_k, 0)
+        random[k] = np.where(feasible, np.sqrt(strokes_k)*del_r, 0)
+        systematic[k] = np.where(feasible, strokes_k*del_s, 0)
+    if not np.all(np.any(strokes > 0, axis=0)):
+        raise ValueError('Volumes {} are below the minimum volume of all pipettes'.format(volumes[~np.any(strokes > 0, axis=0)]))
+    # Fewest strokes first, then lowest uncertainty among the pipettes with the fewest strokes
+    stroke_count = np.where(strokes > 0, strokes, np.iinfo(int).max)
+    fewest = stroke_count == np.min(stroke_count, axis=0)
+    combined = np.where(fewest, np.hypot(random, systematic), np.inf)
+    choice = np.argmin(combined, axis=0)
+    return PipetteSelection(list(pipettes), volumes, choice, strokes, pass_volume, random, systematic)
+############################################################
+
+def _best_split(pipette: types.Mount, 
+                volume: float, 
+                strokes: int, 
+                min_pass_volume: float, 
+                max_pass_volume: float,
+                grid_points: int = 201):
+    # Stroke volumes splitting volume in a number of strokes with the lowest combined uncertainty, and that uncertainty
+    # Splits of k strokes of a volume a and (strokes-k) strokes of the remainder are evaluated on a grid of volumes a,
+    # the equal split is kept unless another one is better. Returns (None, inf) if no split is possible
+    equal_volume = volume/strokes
+    best_passes, best_uncertainty = None, np.inf
+    if min_pass_volume <= equal_volume <= max_pass_volume or strokes == 1:
+        del_r, del_s = volume_uncertainty(pipette, equal_volume)
+        best_passes = np.ones(strokes)*equal_volume
+        best_uncertainty = np.hypot(np.sqrt(strokes)*del_r, strokes*del_s)
+    if strokes == 1:
+        return best_passes, best_uncertainty
+    a = np.linspace(min_pass_volume, max_pass_volume, grid_points)[np.newaxis, :]
+    k = np.arange(1, strokes)[:, np.newaxis]
+    b = (volume - k*a)/(strokes - k)
+    del_r_a, del_s_a = volume_uncertainty(pipette, a)
+    del_r_b, del_s_b = volume_uncertainty(pipette, b)
+    random = np.sqrt(k*np.float_power(del_r_a, 2) + (strokes-k)*np.float_power(del_r_b, 2))
+    systematic = k*del_s_a + (strokes-k)*del_s_b
+    combined = np.where((b >= min_pass_volume) & (b <= max_pass_volume), np.hypot(random, systematic), np.inf)
+    i, j = np.unravel_index(np.argmin(combined), combined.shape)
+    if combined[i, j] < best_uncertainty:
+        best_passes = np.concatenate([np.ones(k[i, 0])*a[0, j], np.ones(strokes-k[i, 0])*b[i, j]])
+        best_uncertainty = combined[i, j]
+    return best_passes, best_uncertainty
+def split_volume(pipette: types.Mount, 
+                 volume: float, 
+                 max_pass_volume: float = None,
+                 precision_target: float = None):
+    """
+    Splits a transfer volume in strokes with the lowest combined uncertainty (see select_pipettes()), 
+    using the uncertainty functions of the pipette instead of equal strokes
+    
+    - max_pass_volume is the largest stroke volume, pipette.max_volume by default 
+      (e.g. lower for reverse transfers, which also aspirate a disposal volume)
+    - precision_target is a combined uncertainty (in uL) allowing one extra stroke if that is needed to reach it
+    The fewest strokes possible are used otherwise, strokes are at least pipette.min_volume if volume allows it
+    Returns an array of stroke volumes
+    """
+    assert volume > 0
+    max_pass_volume = pipette.max_volume if max_pass_volume is None else max_pass_volume
+    strokes = int(np.ceil(volume/max_pass_volume))
+    passes, uncertainty = _best_split(pipette, volume, strokes, pipette.min_volume, max_pass_volume)
+    if precision_target is not None and uncertainty > precision_target:
+        passes_extra, uncertainty_extra = _best_split(pipette, volume, strokes+1, pipette.min_volume, max_pass_volume)
+        if uncertainty_extra <= precision_target:
+            return passes_extra
+        bb.log_event('precision_target_missed', value=uncertainty)
+    return passes
 ############################################################
 
 ########
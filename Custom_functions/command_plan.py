@@ -0,0 +1,181 @@
+"""
+Deferred execution of the custom functions: the pipette commands are recorded in a plan instead of being sent to the robot,
+optimisation passes are run over the plan, then the plan is replayed on the real pipette
+
+Typical use:
+    plan = cplan.CommandPlan(pipette)
+    cusp.custom_transfer_forward(plan.recorder, 100, source, destination)
+    cusp.custom_mixing(plan.recorder, 100, destination)
+    plan.optimize()
+    plan.replay()
+
+The well information (headrooms, volumes, uncertainties) is updated while recording, as the custom functions do it
+before sending their commands
+The recorder cannot report the state of the pipette (e.g. current_volume or has_tip), which is only known at replay
+"""
+############################################################
+from __future__ import absolute_import
+
+import sys
+
+from opentrons import types
+
+############################################################
+
+# Commands that do not move the pipette when they are given without a location
+STATIONARY_COMMANDS = ['aspirate', 'dispense', 'blow_out', 'mix']
+
+class Command:
+    """
+    Record of a pipette command
+
+    - name is the name of the pipette method, args and kwargs its arguments
+    - functions are the custom functions that sent the command, from the outermost to the innermost
+      e.g. ('custom_transfer_forward', 'custom_touch_tip')
+    """
+    __slots__ = ('name', 'args', 'kwargs', 'functions')
+
+    def __init__(self, name: str, args: tuple, kwargs: dict, functions: tuple = ()):
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+        self.functions = functions
+
+    @property
+    def location(self):
+        # Location the command moves the pipette to, None if it has no location argument
+        if isinstance(self.kwargs.get('location'), types.Location):
+            return self.kwargs['location']
+        for arg in self.args:
+            if isinstance(arg, types.Location):
+                return arg
+        return None
+    @property
+    def force_direct(self):
+        return bool(self.kwargs.get('force_direct', False))
+    def __repr__(self):
+        arguments = [repr(arg) for arg in self.args] + ['{}={!r}'.format(key, value) for key, value in self.kwargs.items()]
+        return '{}({})'.format(self.name, ', '.join(arguments))
+############################################################
+
+def _calling_functions():
+    # Names of the custom functions in the call stack, from the outermost to the innermost
+    functions = []
+    frame = sys._getframe(2)
+    while frame is not None:
+        if frame.f_code.co_name.startswith('custom_'):
+            functions.append(frame.f_code.co_name)
+        frame = frame.f_back
+    return tuple(reversed(functions))
+
+class RecordingPipette:
+    """
+    Stand-in for a pipette, given to the custom functions instead of the pipette to record their commands in a CommandPlan
+    Calls to the pipette methods are recorded, all other attributes (max_volume, flow rates, tip racks, uncertainties...)
+    are read from and written to the real pipette
+    """
+    def __init__(self, plan, pipette: types.Mount):
+        object.__setattr__(self, '_plan', plan)
+        object.__setattr__(self, '_pipette', pipette)
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._pipette, name)
+        if name.startswith('_') or not callable(attribute):
+            return attribute
+        def record(*args, **kwargs):
+            self._plan.record(Command(name, args, kwargs, _calling_functions()))
+            return self
+        return record
+    def __setattr__(self, name: str, value):
+        setattr(self._pipette, name, value)
+
+    @property
+    def location_cache(self):
+        # Location of the pipette at the end of the recorded commands, None if unknown
+        for command in reversed(self._plan.commands):
+            if command.location is not None:
+                return command.location
+            if command.name not in STATIONARY_COMMANDS:
+                return None
+        return None
+############################################################
+
+def _labware_of(location: types.Location):
+    # Well (or labware) of a location, unwrapped from the LabwareLike of recent versions of the API
+    labware = location.labware
+    return getattr(labware, 'object', labware)
+def _same_well(labware_1, labware_2):
+    # Wells are compared by their _geometry, the API giving a new Well object at every access to a well
+    return getattr(labware_1, '_geometry', labware_1) is getattr(labware_2, '_geometry', labware_2)
+def remove_duplicate_moves(commands: list):
+    """
+    Removes the move_to() commands to the location the pipette is already at,
+    e.g. the move_to(well.top()) ending a custom_touch_tip() followed by another custom_touch_tip() of the same well
+    """
+    optimized = []
+    position = None
+    for command in commands:
+        location = command.location
+        if command.name == 'move_to' and location is not None and location == position:
+            continue
+        optimized.append(command)
+        if location is not None:
+            position = location
+        elif command.name not in STATIONARY_COMMANDS:
+            position = None   # e.g. tip pick-up or drop, the position is not known any more
+    return optimized
+def merge_adjacent_moves(commands: list):
+    """
+    Merges a move_to() immediately followed by a move to another well into the second move
+    The pipette arcs above the deck when changing well, so the first move is only an extra stop on the way,
+    e.g. the move_to(well.top()) ending a custom_touch_tip() before the dispense in another well
+    Moves with force_direct, or followed by a move with force_direct, are kept as they define the path of the tip
+    """
+    optimized = []
+    for i, command in enumerate(commands):
+        if command.name == 'move_to' and not command.force_direct and i+1 < len(commands):
+            next_command = commands[i+1]
+            next_location = next_command.location
+            if (next_location is not None and not next_command.force_direct
+                and not _same_well(_labware_of(next_location), _labware_of(command.location))):
+                continue
+        optimized.append(command)
+    return optimized
+
+default_passes = [remove_duplicate_moves, merge_adjacent_moves]
+############################################################
+
+class CommandPlan:
+    """
+    Plan of the commands of a pipette, recorded by giving plan.recorder to the custom functions instead of the pipette
+
+    - commands is the list of Command to replay, in order
+    - recorded_count is the number of commands recorded since the last replay, before optimisation
+    """
+    def __init__(self, pipette: types.Mount):
+        self.pipette = pipette
+        self.commands = []
+        self.recorded_count = 0
+        self.recorder = RecordingPipette(self, pipette)
+
+    def record(self, command: Command):
+        self.commands.append(command)
+        self.recorded_count += 1
+    def optimize(self, passes: list = None):
+        # Runs the optimisation passes (default_passes if None) over the commands, returns the number of commands removed
+        number_before = len(self.commands)
+        for optimization_pass in (default_passes if passes is None else passes):
+            self.commands = optimization_pass(self.commands)
+        return number_before - len(self.commands)
+    def replay(self, pipette: types.Mount = None):
+        # Sends the commands to the pipette (the pipette of the plan if None), the plan is emptied
+        pipette = self.pipette if pipette is None else pipette
+        commands = self.commands
+        self.commands = []
+        self.recorded_count = 0
+        for command in commands:
+            getattr(pipette, command.name)(*command.args, **command.kwargs)
+    def report(self):
+        # Number of commands recorded and left after the optimisation passes
+        return '{} commands recorded, {} after optimisation'.format(self.recorded_count, len(self.commands))
+############################################################
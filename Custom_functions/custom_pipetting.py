@@ -13,6 +13,7 @@ from opentrons import types
 
 from Vesynta_Tech.OpenTrons2 import building_blocks as bb
 from Vesynta_Tech.OpenTrons2 import calculate_uncertainties as calcunc
+from Vesynta_Tech.OpenTrons2 import liquid_classes as liqc
 
 ############################################################
 
@@ -21,7 +22,8 @@ def custom_aspirate(pipette: types.Mount,
                     location: types.Location,
                     immersion_depth: float = 2,
                     safety_height: float = 0.5,                    
-                    rate: float = 75):
+                    rate: float = 75,
+                    liquid_class: str = None):
     """
     Custom aspiration function
     By default: aspirates 2 mm below the meniscus level
@@ -30,13 +32,17 @@ def custom_aspirate(pipette: types.Mount,
     - immersion_depth (in mm) beneath meniscus
     - safety_height prevents the tip from crashing into bottom of the well
     - rate in uL/s
+    - liquid_class replaces rate by the aspirate rate of a liquid class (see liquid_classes.py)
     """
     # Arguments checking
     assert transfer_volume > 0
     assert safety_height >= 0
     
-    # Conversion from a rate in ul/s to a relative rate
-    rate_rel = bb.get_relative_from_flow_rate_aspirate(pipette, rate)
+    # Conversion from a rate in ul/s to a relative rate, already done for the rates of liquid classes
+    if liquid_class is None:
+        rate_rel = bb.get_relative_from_flow_rate_aspirate(pipette, rate)
+    else:
+        rate_rel = liqc.get_liquid_class(pipette, liquid_class)['aspirate_rate_relative']
     
     # Extraction or calculation of headrooms and volumes before and after aspiration
     initial_volume = bb.get_volume(location)
@@ -58,13 +64,13 @@ def custom_aspirate(pipette: types.Mount,
     depth = bb.get_h_from_v(location, 0)
     if depth_to_aspirate > depth - safety_height:
         depth_to_aspirate = depth - safety_height  # e.g. 0.5mm above the bottom of the well
-        print('Warning, aspiration height for well ' +str(location) +' is lower than ' +str(safety_height) +' mm')
+        bb.log_event('low_aspiration_height', location, safety_height)
     
     # Avoids tip submersion in liquid
     tip_length = bb.get_tip_length(pipette)
     if depth_to_aspirate > 0.8*tip_length + initial_headroom:  # Checks that the pipette tip will not be fully submerged
         depth_to_aspirate = 0.8*tip_length + initial_headroom
-        print('Warning, aspiration depth was set lower then pipette tip length, it has been changed to ' +str(depth_to_aspirate))
+        bb.log_event('aspiration_submersion', location, depth_to_aspirate)
     
     if depth_to_aspirate < 0: 
         depth_to_aspirate = 0 # i.e. at the top of the well
@@ -79,7 +85,8 @@ def custom_dispense(pipette: types.Mount,
                     dispense_meniscus: bool = True,
                     immersion_depth: float = 0,
                     safety_height: float = 1,
-                    rate: float = 300):
+                    rate: float = 300,
+                    liquid_class: str = None):
     """
     Custom dispense function, by default: 
     - Dispenses in air (at the top of a position)
@@ -88,13 +95,17 @@ def custom_dispense(pipette: types.Mount,
     - immersion_depth is the position relative to the meniscus, a positive number is lower than the meniscus (in liquid)
     - safety_height is used to prevent overflow of a container
     - rate in uL/s
+    - liquid_class replaces rate by the dispense rate of a liquid class (see liquid_classes.py)
     """ 
     # Arguments checking
     assert transfer_volume > 0
     assert safety_height >= 0
     
-    # Conversion from a rate in ul/s to a relative rate to the default
-    rate_rel = bb.get_relative_from_flow_rate_dispense(pipette, rate)
+    # Conversion from a rate in ul/s to a relative rate to the default, already done for the rates of liquid classes
+    if liquid_class is None:
+        rate_rel = bb.get_relative_from_flow_rate_dispense(pipette, rate)
+    else:
+        rate_rel = liqc.get_liquid_class(pipette, liquid_class)['dispense_rate_relative']
     
     # Extraction or calculation of headrooms and volumes before and after aspiration
     initial_volume = bb.get_volume(location)
@@ -117,25 +128,42 @@ def custom_dispense(pipette: types.Mount,
     tip_length = bb.get_tip_length(pipette)
     if dispense_depth > 0.8*tip_length + initial_headroom:  # Checks that the pipette tip will not be fully submerged
         dispense_depth = 0.8*tip_length + initial_headroom
-        print('Warning, dispense depth was set lower then pipette tip length, it has been changed to ' +str(dispense_depth))
+        bb.log_event('dispense_submersion', location, dispense_depth)
 
     # Safety checking for overflow
     if safety_height == 0:
-        print('Warning, anti-overflow check has been deactivated by setting the safety height to 0')
+        bb.log_event('overflow_check_disabled', location)
     elif final_headroom <= safety_height:
-        print('Overflow risks! Dispense cancelled for ' + str(location))
+        bb.log_event('overflow', location)
     else:
         if final_headroom < safety_height + 1:
-            print('Warning, container is almost full: ' + str(location))
+            bb.log_event('almost_full', location)
         pipette.dispense(transfer_volume, location.top(-dispense_depth), rate = rate_rel)
 ############################################################
+### The touch tip offsets are the same for all wells of a given diameter, they are calculated once ###
+_touch_tip_offsets = {}
+def get_touch_tip_offsets(diameter: float, 
+                          radius_offset: float, 
+                          increments: int, 
+                          depth: float):
+    # Offsets of the touch points from the top centre of a circular well with their labels, cached per well geometry
+    key = (diameter, radius_offset, increments, depth)
+    if key not in _touch_tip_offsets:
+        radius = (diameter/2) - radius_offset
+        thetas = np.linspace(start=0, stop=2*np.pi, num=increments, endpoint=False)
+        x_offsets = radius*np.cos(thetas)
+        y_offsets = radius*np.sin(thetas)
+        _touch_tip_offsets[key] = tuple((types.Point(x_offsets[i], y_offsets[i], -depth), 'Touch point '+str(i+1)) 
+                                        for i in range(increments))
+    return _touch_tip_offsets[key]
 ### The custom_touch_tip() function removes droplets from the shaft of a pipette tip by running the tip around the perimiter of a circular tube ###
 def custom_touch_tip(pipette: types.Mount,
                      well: types.Location, 
                      depth: float = 2,
                      radius_offset: float = 1,
                      speed: float = 200,
-                     increments: int = 3):
+                     increments: int = 3,
+                     reduced_moves: bool = False):
     """
     Movement function that follows the edge of a circular well with the tip in contact with the glass
     Allows complete removal of any pending drop on the tip
@@ -146,27 +174,21 @@ def custom_touch_tip(pipette: types.Mount,
       it allows touching the wall more lightly or simply come in close distance without touching
     - speed changes the movement speed during the touch tip
     - increments are the number of stopping steps along the perimeter of the circle
+    - reduced_moves skips the move to the top of the well when the pipette is already there (e.g. two touch tips in a row)
     """   
     # Arguments checking
     assert increments >= 1
     depth = abs(depth)    # depth must be positive, however inputing a negative number for a depth is an easy mistake
     if well._geometry._diameter:
-        radius = (well._geometry._diameter/2) - radius_offset
         well_top = well._geometry._position
-        thetas = np.linspace(start=0, stop=2*np.pi, num=increments, endpoint=False)
-        x_offsets = radius*np.cos(thetas)
-        y_offsets = radius*np.sin(thetas)
-        touch_locations = [] # initialise list
-        for i in range(increments):
-            offset = types.Point(x_offsets[i], y_offsets[i], -depth)
-            # Populate list of locations
-            touch_locations.append(types.Location(well_top.__add__(offset), 'Touch point '+str(i+1)))
-        pipette.move_to(well.top())
-        for location in touch_locations:
-            pipette.move_to(location, force_direct=True, speed=speed)
+        touch_offsets = get_touch_tip_offsets(well._geometry._diameter, radius_offset, increments, depth)
+        if not (reduced_moves and bb.get_location_cache(pipette) == well.top()):
+            pipette.move_to(well.top())
+        for offset, label in touch_offsets:
+            pipette.move_to(types.Location(well_top + offset, label), force_direct=True, speed=speed)
         pipette.move_to(well.top())  # Might not be required
     else:
-        print('Well is not circular, so just using standard touch_tip() command')
+        bb.log_event('not_circular', well)
         pipette.touch_tip(location=well, v_offset=depth)
 ############################################################
 
@@ -194,7 +216,8 @@ def custom_mixing(pipette: types.Mount,
                   aspiration_depth: float,
                   dispense_immersion_depth: float,
                   aspirate_rate: float = 75,
-                  dispense_rate: float = 600):  
+                  dispense_rate: float = 600,
+                  liquid_class: str = None):  
     """
     Mixing function aspirating close to the meniscus and dispensing at the bottom of the container.
     This can be interesting to improve mixing in conical containers to created vortices in the tapered area
@@ -203,21 +226,23 @@ def custom_mixing(pipette: types.Mount,
     - aspiration_depth is how deep in the liquid the tip will aspirate
     - dispense_height is the distance from the bottom of the container at which dispense will take place
     - rates in uL/s
+    - liquid_class replaces the rates by those of a liquid class (see liquid_classes.py)
     """
     # Arguments checking
     assert mixing_volume > 0
     assert cycles >= 1
-    # Mixing fraction calculation and print
+    # Mixing fraction calculation, recorded in bb.event_log
     max_volume = bb.get_volume(location)
     volume_mixing_fraction = mixing_volume / max_volume
-    print('Volume mixing fraction at ' +str(location), ' is '+str(np.round(volume_mixing_fraction, 2)))
     if volume_mixing_fraction <0.2:
-        print('...which may be too low!')
-    if volume_mixing_fraction >0.8:
-        print('...which may be too high!')
+        bb.log_event('low_mixing_fraction', location, volume_mixing_fraction)
+    elif volume_mixing_fraction >0.8:
+        bb.log_event('high_mixing_fraction', location, volume_mixing_fraction)
+    else:
+        bb.log_event('mixing_fraction', location, volume_mixing_fraction)
     for i in range(0, cycles):
-        custom_aspirate(pipette, mixing_volume, location, rate = aspirate_rate, immersion_depth = aspiration_depth)
-        custom_dispense(pipette, mixing_volume, location, rate = dispense_rate, immersion_depth = dispense_immersion_depth) 
+        custom_aspirate(pipette, mixing_volume, location, rate = aspirate_rate, immersion_depth = aspiration_depth, liquid_class = liquid_class)
+        custom_dispense(pipette, mixing_volume, location, rate = dispense_rate, immersion_depth = dispense_immersion_depth, liquid_class = liquid_class) 
     pipette.blow_out(location.top(-2))
     custom_touch_tip(pipette, location)
 ############################################################
@@ -229,7 +254,8 @@ def custom_mixing_top_to_bottom(pipette: types.Mount,
                                 aspiration_immersion_depth: float = 2,
                                 dispense_height: float = 1,
                                 aspirate_rate: float = 75,
-                                dispense_rate: float = 600):  
+                                dispense_rate: float = 600,
+                                liquid_class: str = None):  
     """
     Mixing function aspirating close to the meniscus and dispensing at the bottom of the container.
     This can be interesting to improve mixing in conical containers to created vortices in the tapered area
@@ -238,6 +264,7 @@ def custom_mixing_top_to_bottom(pipette: types.Mount,
     - aspiration_depth is how deep in the liquid the tip will aspirate
     - dispense_height is the distance from the bottom of the container at which dispense will take place
     - rates in uL/s
+    - liquid_class replaces the rates by those of a liquid class (see liquid_classes.py)
     """
     # Extraction or calculation of headrooms and volumes before and after aspiration
     max_volume = bb.get_volume(location)
@@ -249,7 +276,7 @@ def custom_mixing_top_to_bottom(pipette: types.Mount,
     # immersion_depth from the meniscus (used for custom_dispense())
     dispense_depth = well_depth - dispense_height
     dispense_immersion_depth = dispense_depth - max_headroom
-    custom_mixing(pipette, mixing_volume, location, cycles, aspiration_immersion_depth, dispense_immersion_depth, aspirate_rate, dispense_rate)
+    custom_mixing(pipette, mixing_volume, location, cycles, aspiration_immersion_depth, dispense_immersion_depth, aspirate_rate, dispense_rate, liquid_class)
 ############################################################
 ### This function takes liquid from the bottom of the well and pipettes it to the top of the well i.e. layering the solution in order to aid mixing ###
 def custom_mixing_bottom_to_top(pipette: types.Mount,
@@ -259,7 +286,8 @@ def custom_mixing_bottom_to_top(pipette: types.Mount,
                                 aspirate_height: float = 1,
                                 dispense_immersion_depth: float = 1,
                                 aspirate_rate: float = 75,
-                                dispense_rate: float = 600):  
+                                dispense_rate: float = 600,
+                                liquid_class: str = None):  
     """
     Mixing function aspirating close to the meniscus and dispensing at the bottom of the container.
     This can be interesting to improve mixing in conical containers to created vortices in the tapered area
@@ -268,6 +296,7 @@ def custom_mixing_bottom_to_top(pipette: types.Mount,
     - aspirate_height is the distance from the bottom of the container at which aspiration will take place
     - dispense_depth is how deep in the liquid the tip will dispense
     - rates in uL/s
+    - liquid_class replaces the rates by those of a liquid class (see liquid_classes.py)
     """
     # Extraction or calculation of headrooms and volumes before and after aspiration
     max_volume = bb.get_volume(location)
@@ -279,7 +308,7 @@ def custom_mixing_bottom_to_top(pipette: types.Mount,
     # immersion_depth from the meniscus (used for custom_aspirate())
     aspirate_depth = well_depth - aspirate_height
     aspiration_immersion_depth = aspirate_depth - max_headroom
-    custom_mixing(pipette, mixing_volume, location, cycles, aspiration_immersion_depth, dispense_immersion_depth, aspirate_rate, dispense_rate)
+    custom_mixing(pipette, mixing_volume, location, cycles, aspiration_immersion_depth, dispense_immersion_depth, aspirate_rate, dispense_rate, liquid_class)
 ############################################################
 
 def custom_mixing_static(pipette: types.Mount,
@@ -288,13 +317,15 @@ def custom_mixing_static(pipette: types.Mount,
                                 cycles: int,
                                 relative_depth: float = 0.5,
                                 aspirate_rate: float = 75,
-                                dispense_rate: float = 600):  
+                                dispense_rate: float = 600,
+                                liquid_class: str = None):  
     """
     Mixing function aspirating and dispensing in the same predefined position
     
     Function-specific arguments:
     - relative_depth give the position in the liquid at which mixing will take place, e.g. 0.5 in the middle of the liquid
     - rates in uL/s
+    - liquid_class replaces the rates by those of a liquid class (see liquid_classes.py)
     """
     # Extraction or calculation of headrooms and volumes before and after aspiration
     max_volume = bb.get_volume(location)
@@ -305,7 +336,7 @@ def custom_mixing_static(pipette: types.Mount,
     well_depth = bb.get_h_from_v(location, 0)
     # Determination of the mixing positon within the liquid
     mixing_position = relative_depth*(well_depth - max_headroom)
-    custom_mixing(pipette, mixing_volume, location, cycles, mixing_position, mixing_position, aspirate_rate, dispense_rate)
+    custom_mixing(pipette, mixing_volume, location, cycles, mixing_position, mixing_position, aspirate_rate, dispense_rate, liquid_class)
 ############################################################
 
 def custom_transfer_forward(pipette: types.Mount,
@@ -318,7 +349,11 @@ def custom_transfer_forward(pipette: types.Mount,
                             dispense_rate: float = 300,
                             dispense_meniscus: bool = True,
                             dispense_depth: float = 0,                            
-                            touch_tip_position: str = 'none'):
+                            touch_tip_position: str = 'none',
+                            liquid_class: str = None,
+                            split_strategy: str = 'equal',
+                            precision_target: float = None,
+                            tip_policy: str = None):
     
     """
     A transfer function aspirating the exact desired volume from the source 
@@ -332,25 +367,42 @@ def custom_transfer_forward(pipette: types.Mount,
     - touch_tip_position allows touching tip at the source or destination after each transfer step if desired
     - rates in uL/s
     - dispense_meniscus set to True if a dispense position relative to the meniscus is desired, if False will be relative to the top of the well
+    - liquid_class replaces the rates, aspirate_depth and touch_tip_position by those of a liquid class (see liquid_classes.py)
+    - split_strategy 'equal' splits in equal strokes, 'optimal' chooses the stroke volumes with the lowest uncertainty
+      (see calcunc.split_volume()), in which case precision_target (in uL) allows one extra stroke to reach it
+    - tip_policy picks up a new tip or reuses the current one according to a policy of bb.can_reuse_tip()
+      ('never', 'same_source' or 'same_constituents'), if None tips are not handled by this function
+      pre-wetting is skipped or shortened when the tip is still wet from the source (see bb.get_wetting_cycles())
     """
     # Arguments checking
     assert volume > 0
+    if liquid_class is not None:
+        liquid = liqc.get_liquid_class(pipette, liquid_class)
+        aspirate_depth = liquid['aspirate_depth']
+        touch_tip_position = liquid['touch_tip_position']
+    assert split_strategy in ('equal', 'optimal')
     # If the transfer volume is lower than the pipette max volume, only 1 step is required, otherwise splits in equal strokes
-    if volume <= pipette.max_volume:
+    if split_strategy == 'optimal':
+        volume_list = calcunc.split_volume(pipette, volume, precision_target=precision_target)
+    elif volume <= pipette.max_volume:
         volume_list = [volume]
     else:
         number_of_passes = int(np.ceil((volume / (pipette.max_volume))))
         volume_per_pass = volume/number_of_passes
         volume_list = np.ones(number_of_passes)*volume_per_pass
+    if tip_policy is not None:
+        bb.prepare_tip(pipette, source, tip_policy)
+        # A reused tip may still be wet from the same source
+        pre_wet = bb.get_wetting_cycles(pipette, source, pre_wet)
     # pre_wet determines the number of wetting cycles
     if pre_wet != 0:
         custom_wetting(pipette, volume_list[0], source, pre_wet)
     for pass_volume in volume_list:
         calcunc.uncertainties_calculation(pipette, pass_volume, source, destination) # Uncertainties function need to be called 
                                                                              # before custom_aspirate and custom_dispense
-        custom_aspirate(pipette, pass_volume, source, immersion_depth = aspirate_depth, rate = aspirate_rate)
+        custom_aspirate(pipette, pass_volume, source, immersion_depth = aspirate_depth, rate = aspirate_rate, liquid_class = liquid_class)
         custom_touch_tip(pipette, source)
-        custom_dispense(pipette, pass_volume, destination, dispense_meniscus = dispense_meniscus, immersion_depth = dispense_depth, rate = dispense_rate)
+        custom_dispense(pipette, pass_volume, destination, dispense_meniscus = dispense_meniscus, immersion_depth = dispense_depth, rate = dispense_rate, liquid_class = liquid_class)
         pipette.blow_out(destination.top(-2))
         if touch_tip_position == 'destination':
             custom_touch_tip(pipette, destination)
@@ -358,6 +410,12 @@ def custom_transfer_forward(pipette: types.Mount,
             custom_touch_tip(pipette, source)
         # Generally do NOT touch_tip() on the destination
         # as this could cause backwards contamination
+    if tip_policy is not None:
+        bb.record_tip_contact(pipette, source)
+        bb.record_tip_wetting(pipette, source)
+        # The tip touches the destination liquid when dispensing at or below the meniscus
+        if (dispense_meniscus and dispense_depth >= 0) or touch_tip_position == 'destination':
+            bb.record_tip_contact(pipette, destination)
 ############################################################
 
 def custom_transfer_reverse(pipette: types.Mount,
@@ -371,7 +429,12 @@ def custom_transfer_reverse(pipette: types.Mount,
                             dispense_meniscus: bool = True,
                             dispense_depth: float = 0,
                             pre_wet: int = 0,
-                            touch_tip_position: str = 'none'):
+                            touch_tip_position: str = 'none',
+                            liquid_class: str = None,
+                            split_strategy: str = 'equal',
+                            precision_target: float = None,
+                            tip_policy: str = None,
+                            carry_disposal: bool = False):
     """
     A transfer function aspirating more than required, dispensing the exact volume at destination and excess back at source
     Typically used for solution with high viscosity or a tendency to foam
@@ -385,37 +448,195 @@ def custom_transfer_reverse(pipette: types.Mount,
     - pre_wet defines the number of pre-wetting steps that will be done (0 = no pre wetting)
     - touch_tip_position allows touching tip at the destination after each transfer step if desired
     - rates in uL/s
+    - liquid_class replaces the rates, aspirate_depth, disposal_volume and touch_tip_position by those of a liquid class
+      (see liquid_classes.py)
+    - split_strategy 'equal' splits in equal strokes, 'optimal' chooses the stroke volumes with the lowest uncertainty
+      (see calcunc.split_volume()), in which case precision_target (in uL) allows one extra stroke to reach it
+    - tip_policy picks up a new tip or reuses the current one according to a policy of bb.can_reuse_tip()
+      ('never', 'same_source' or 'same_constituents'), if None tips are not handled by this function
+      pre-wetting is skipped or shortened when the tip is still wet from the source (see bb.get_wetting_cycles())
+    - carry_disposal keeps the disposal volume in the tip between the passes of a multi-pass transfer, 
+      only the pass volume is aspirated after the first pass and the disposal volume is returned to the source at the end
     """
+    if liquid_class is not None:
+        liquid = liqc.get_liquid_class(pipette, liquid_class)
+        aspirate_depth = liquid['aspirate_depth']
+        disposal_volume = liquid['disposal_volume']
+        touch_tip_position = liquid['touch_tip_position']
     # Arguments checking
     assert volume > 0
     assert disposal_volume >= 0
+    assert split_strategy in ('equal', 'optimal')
     # Transfer splitting, the total volume is split in however many equal strokes needed to be fully transferred
     if volume <= pipette.max_volume:
         if volume + disposal_volume > pipette.max_volume:
-            print('Warning, in order to include a disposal volume this transfer will be split into several passes...')
-    if volume + disposal_volume <= pipette.max_volume:
+            bb.log_event('disposal_split', source)
+    if split_strategy == 'optimal':
+        volume_list = calcunc.split_volume(pipette, volume, pipette.max_volume - disposal_volume, precision_target)
+    elif volume + disposal_volume <= pipette.max_volume:
         volume_list = [volume]
     else:
         number_of_passes = int(np.ceil((volume / (pipette.max_volume - disposal_volume))))
         volume_per_pass = volume/number_of_passes
         volume_list = np.ones(number_of_passes)*volume_per_pass
+    if tip_policy is not None:
+        bb.prepare_tip(pipette, source, tip_policy)
+        # A reused tip may still be wet from the same source
+        pre_wet = bb.get_wetting_cycles(pipette, source, pre_wet)
     if pre_wet != 0:
         custom_wetting(pipette, volume_list[0]+disposal_volume, source, pre_wet)
-    for pass_volume in volume_list:
+    for i, pass_volume in enumerate(volume_list):
         calcunc.uncertainties_calculation(pipette, pass_volume, source, destination)
-        custom_aspirate(pipette, pass_volume + disposal_volume, source, immersion_depth = aspirate_depth, rate = aspirate_rate)
+        # With carry_disposal, the disposal volume is only aspirated with the first pass
+        aspirate_volume = pass_volume if carry_disposal and i > 0 else pass_volume + disposal_volume
+        custom_aspirate(pipette, aspirate_volume, source, immersion_depth = aspirate_depth, rate = aspirate_rate, liquid_class = liquid_class)
         custom_touch_tip(pipette, source)
-        custom_dispense(pipette, pass_volume, destination, dispense_meniscus = dispense_meniscus, immersion_depth = dispense_depth, rate = dispense_rate)
+        custom_dispense(pipette, pass_volume, destination, dispense_meniscus = dispense_meniscus, immersion_depth = dispense_depth, rate = dispense_rate, liquid_class = liquid_class)
         if touch_tip_position == 'destination':
             custom_touch_tip(pipette, destination)
         elif touch_tip_position == 'source':
             custom_touch_tip(pipette, source)
+        if carry_disposal and i < len(volume_list) - 1:
+            continue
+        # Return the remainder to the source 
+        custom_dispense(pipette, disposal_volume, source, dispense_meniscus = False, liquid_class = liquid_class)
+        pipette.blow_out(source.top(-2))
+        custom_touch_tip(pipette, source)
+    if tip_policy is not None:
+        bb.record_tip_contact(pipette, source)
+        bb.record_tip_wetting(pipette, source)
+        # The tip touches the destination liquid when dispensing at or below the meniscus
+        if (dispense_meniscus and dispense_depth >= 0) or touch_tip_position == 'destination':
+            bb.record_tip_contact(pipette, destination)
+############################################################
+
+def custom_distribute(pipette: types.Mount,
+                      volume: float,
+                      source: types.Location, 
+                      destinations: list,
+                      disposal_volume: float = 0,
+                      aspirate_rate: float = 75,
+                      aspirate_depth: float = 2,
+                      dispense_rate: float = 300,
+                      dispense_meniscus: bool = True,
+                      dispense_depth: float = -1,
+                      pre_wet: int = 0,
+                      liquid_class: str = None):
+    """
+    A distribute function aspirating once for several destinations, then dispensing an aliquot in each of them
+    Destinations are filled in order, with as many aliquots per aspiration as the pipette max_volume allows
+    Typically used to fill a rack from a single stock solution
+    By default:
+    - Dispenses 1 mm above the meniscus of each destination, so that the tip does not touch the destination liquid 
+      before going back to the source
+    
+    Function-specific arguments:
+    - volume is the volume of each aliquot, either a single value for all destinations or a list (one per destination)
+    - disposal_volume is a supplementary volume aspirated with each batch of aliquots and returned to the source at the end
+    - dispense_meniscus and dispense_depth define the dispense position as in custom_dispense()
+    - pre_wet defines the number of pre-wetting steps that will be done (0 = no pre wetting)
+    - rates in uL/s
+    - liquid_class replaces the rates, aspirate_depth and disposal_volume by those of a liquid class (see liquid_classes.py)
+    """
+    if liquid_class is not None:
+        liquid = liqc.get_liquid_class(pipette, liquid_class)
+        aspirate_depth = liquid['aspirate_depth']
+        disposal_volume = liquid['disposal_volume']
+    # Arguments checking
+    volumes = np.ones(len(destinations))*volume if np.ndim(volume) == 0 else np.asarray(volume, dtype=float)
+    assert len(volumes) == len(destinations)
+    assert np.all(volumes > 0)
+    assert disposal_volume >= 0
+    assert np.max(volumes) + disposal_volume <= pipette.max_volume
+    # Destinations are split in batches, each batch is dispensed from a single aspiration
+    batches = []
+    for destination, aliquot_volume in zip(destinations, volumes):
+        if batches and sum(batches[-1][1]) + aliquot_volume + disposal_volume <= pipette.max_volume:
+            batches[-1][0].append(destination)
+            batches[-1][1].append(aliquot_volume)
+        else:
+            batches.append(([destination], [aliquot_volume]))
+    if pre_wet != 0:
+        custom_wetting(pipette, sum(batches[0][1]) + disposal_volume, source, pre_wet)
+    for batch_destinations, batch_volumes in batches:
+        # Uncertainties are calculated for each aliquot as for separate transfers, so the source volume is
+        # decreased after each aliquot, then restored before the aspiration of the whole batch
+        initial_volume = bb.get_volume(source)
+        for destination, aliquot_volume in zip(batch_destinations, batch_volumes):
+            calcunc.uncertainties_calculation(pipette, aliquot_volume, source, destination)
+            bb.set_volume(source, bb.get_volume(source) - aliquot_volume)
+        bb.set_volume(source, initial_volume)
+        custom_aspirate(pipette, sum(batch_volumes) + disposal_volume, source, immersion_depth = aspirate_depth, rate = aspirate_rate, liquid_class = liquid_class)
+        custom_touch_tip(pipette, source)
+        for destination, aliquot_volume in zip(batch_destinations, batch_volumes):
+            custom_dispense(pipette, aliquot_volume, destination, dispense_meniscus = dispense_meniscus, immersion_depth = dispense_depth, rate = dispense_rate, liquid_class = liquid_class)
         # Return the remainder to the source 
-        custom_dispense(pipette, disposal_volume, source, dispense_meniscus = False)
+        if disposal_volume > 0:
+            custom_dispense(pipette, disposal_volume, source, dispense_meniscus = False, liquid_class = liquid_class)
         pipette.blow_out(source.top(-2))
         custom_touch_tip(pipette, source)
 ############################################################
 
+def custom_consolidate(pipette: types.Mount,
+                       volume: float,
+                       sources: list, 
+                       destination: types.Location,
+                       air_gap: float = 0,
+                       aspirate_rate: float = 75,
+                       aspirate_depth: float = 2,
+                       dispense_rate: float = 300,
+                       dispense_meniscus: bool = True,
+                       dispense_depth: float = -1,
+                       liquid_class: str = None):
+    """
+    A consolidate function aspirating from several sources into the same tip, then dispensing once in the destination
+    Sources are aspirated in order, with as many sources per dispense as the pipette max_volume allows
+    Typically used to pool fractions into a single tube
+    By default:
+    - Does not separate the liquids of different sources with an air gap
+    - Dispenses 1 mm above the meniscus of the destination, so that the tip does not bring the pooled liquid 
+      back to the sources of the next batch
+    
+    Function-specific arguments:
+    - volume is the volume taken from each source, either a single value for all sources or a list (one per source)
+    - air_gap is a volume of air aspirated at the top of a source before moving to the next source of the same dispense,
+      it is counted in the pipette capacity and expelled with the blow out
+    - dispense_meniscus and dispense_depth define the dispense position as in custom_dispense()
+    - rates in uL/s
+    - liquid_class replaces the rates and aspirate_depth by those of a liquid class (see liquid_classes.py)
+    The tip goes into every source: only use it when the sources can be contaminated by each other
+    """
+    # Arguments checking
+    volumes = np.ones(len(sources))*volume if np.ndim(volume) == 0 else np.asarray(volume, dtype=float)
+    assert len(volumes) == len(sources)
+    assert np.all(volumes > 0)
+    assert air_gap >= 0
+    assert np.max(volumes) <= pipette.max_volume
+    assert all(source._geometry is not destination._geometry for source in sources)
+    if liquid_class is not None:
+        aspirate_depth = liqc.get_liquid_class(pipette, liquid_class)['aspirate_depth']
+    # Sources are split in batches, each batch is dispensed at once
+    batches = []
+    for source, source_volume in zip(sources, volumes):
+        if batches and sum(batches[-1][1]) + air_gap*len(batches[-1][1]) + source_volume <= pipette.max_volume:
+            batches[-1][0].append(source)
+            batches[-1][1].append(source_volume)
+        else:
+            batches.append(([source], [source_volume]))
+    for batch_sources, batch_volumes in batches:
+        # Uncertainties need to be called before custom_aspirate and custom_dispense, 
+        # each source is updated for its own stroke and the destination once for the whole batch
+        calcunc.uncertainties_calculation_consolidate(pipette, batch_volumes, batch_sources, destination)
+        for i, (source, source_volume) in enumerate(zip(batch_sources, batch_volumes)):
+            if i > 0 and air_gap > 0:
+                pipette.aspirate(air_gap, batch_sources[i-1].top())
+            custom_aspirate(pipette, source_volume, source, immersion_depth = aspirate_depth, rate = aspirate_rate, liquid_class = liquid_class)
+            custom_touch_tip(pipette, source)
+        custom_dispense(pipette, sum(batch_volumes), destination, dispense_meniscus = dispense_meniscus, immersion_depth = dispense_depth, rate = dispense_rate, liquid_class = liquid_class)
+        # The blow out also expels the air gaps
+        pipette.blow_out(destination.top(-2))
+############################################################
+
 def custom_tlc_spotting(pipette: types.Mount,
                         source: types.Location, 
                         destination: types.Location,
@@ -1,27 +1,15 @@
 from __future__ import absolute_import
 
-import os, re
+import os
 import tkinter
 import tkinter.font as font
-from notebooktoall.transform import transform_notebook
 from pprint import pprint
 
-from opentrons.simulate import simulate
-
 from Vesynta_Tech.Utilities.use_tk_inter import Use_Tkinter
 #Use star imports to import all possible OpenTrons2 modules. The relevant __init__.py has a defined __all__ statement.
 from Vesynta_Tech.OpenTrons2 import *
-
-############################################################
-
-ignore_list = ['from __future__ import absolute_import',
-               'import numpy as np',
-               'from opentrons import types']
-remove_list = ['from Vesynta_Tech.OpenTrons2 import building_blocks as bb',
-               'from Vesynta_Tech.OpenTrons2 import calculate_uncertainties as calcunc',
-               'from Vesynta_Tech.OpenTrons2 import meniscus_tracking as mt',
-               'from Vesynta_Tech.OpenTrons2 import custom_pipetting as cusp']
-cleanup_list = ['bb.', 'calcunc.', 'mt.', 'cusp.'] 
+from Vesynta_Tech.OpenTrons2 import batch_simulator
+from Vesynta_Tech.OpenTrons2 import bundler
 
 ############################################################
 class SelectOT2_Params:
@@ -122,7 +110,7 @@ class SelectOT2_Params:
         return (self.filename, self.labware_dir)
 ############################################################
 class Protocol_Simulator:
-    def __init__(self, notebook_path=None, custom_labware_directory=None):
+    def __init__(self, notebook_path=None, custom_labware_directory=None, use_cache=True):
         self.notebook_path = notebook_path
         self.custom_labware_directory = custom_labware_directory
         if self.notebook_path == None or self.custom_labware_directory == None:
@@ -130,98 +118,36 @@ class Protocol_Simulator:
         
         if self.notebook_path == None:
             print("\nProtocol file is required for protocol simulation...\n")
+        elif os.path.splitext(self.notebook_path)[1] not in (".ipynb", ".py"):
+            print("\nProtocol File Type not Recognised! Please select '.py' or '.ipynb' files...\n")
         else:
             print("\nSelected Protocol:", self.notebook_path)
-            # check notebook file type
-            if os.path.splitext(self.notebook_path)[1] == ".ipynb":
-                self.script_path = os.path.splitext(self.notebook_path)[0] + '.py'
-                self.auto_conversion()
-            elif os.path.splitext(self.notebook_path)[1] == ".py":
-                self.script_path = self.notebook_path
-            else:
-                print("\nProtocol File Type not Recognised! Please select '.py' or '.ipynb' files...\n")
             if self.custom_labware_directory == None:
                 print("\nCustom labware functions not used for protocol simulation...\n")
-                with open(self.script_path, 'r') as file:
-                    self.run_log = simulate(protocol_file=file)
             else:
                 print("\nSelected Labware definitions folder:", self.custom_labware_directory, "\n")
-                with open(self.script_path, 'r') as file:
-                    self.run_log = simulate(protocol_file=file, custom_labware_paths = [self.custom_labware_directory])                
-    def auto_conversion(self):
-        if os.path.exists(self.script_path):
-            print('\nRemoving previous .py script...')
-            os.remove(self.script_path)
-        print('Generating new .py version...')
-        
-        # Transform_notebook saves the converted file in the current working directory. This needs to be temporarily changed
-        # to the directory of notebook_path for conversion.
-        original_cwd = os.getcwd()
-        os.chdir(os.path.split(self.notebook_path)[0]+"/")
-        transform_notebook(ipynb_file=self.notebook_path, export_list=['py'])
-        os.chdir(original_cwd)
-        
-        # Run auto_compiler to compile all Vesynta_Tech modules into one single protocol.py file
-        # along with the protocol itself. 
-        auto_compiler(self.script_path)
-        
-        #Check the conversion worked
-        if os.path.exists(self.script_path):
-            print(os.path.split(self.notebook_path)[1], 'successfully converted to', os.path.split(self.script_path)[1])
-            print()
-        else:
-            raise ValueError('The <.py> file was not found')
+            # The conversion and simulation are made by batch_simulator.simulate_protocol, which can be used without Tk
+            # Notebooks are converted in memory, the converted script is written next to the notebook for the OT-2 app
+            # Unchanged protocols are not converted and simulated again, their cached run_log is sanitized
+            self.script_path = os.path.splitext(self.notebook_path)[0] + '.py'
+            self.script, self.run_log, cached = batch_simulator.simulate_protocol(self.notebook_path,
+                                                                                self.custom_labware_directory,
+                                                                                use_cache,
+                                                                                write_script=True,
+                                                                                report=True)
+            if cached:
+                print("\nProtocol unchanged since its last simulation, cached run_log used...\n")
+            elif self.script_path != self.notebook_path:
+                print(os.path.split(self.notebook_path)[1], 'successfully converted to', os.path.split(self.script_path)[1])
+                print()
     def results(self):
         return (self.notebook_path, self.custom_labware_directory, self.run_log)
 ############################################################
 
 def auto_compiler(file):
-    # Open the autoconverted protocol.py file to find all the Vesynta_Tech modules imported
-    module_list = []
-    with open(file, 'r') as file_reader:
-        for line in file_reader:
-            if "Vesynta_Tech.OpenTrons2" in line and "import" in line:
-                line = line.rstrip()
-                if line.strip('# ') not in module_list:
-                    module_list.append(line)
-    # Find the the abspath of the modules                
-    abspath = os.path.dirname(building_blocks.__file__)
-    file_reader.close()
-    # Overwrite the protocol.py eliminating any references to Vesynta_Tech modules.    
-    with open(file, 'r') as file_reader:
-        lines = file_reader.readlines()
-    file_reader.close()   
-    with open(file, 'w') as outfile:
-        for line in lines:
-            if line.rstrip() != "" and line.rstrip() not in remove_list and line[0] != "#":
-                outfile.write(line)
-        outfile.write("\n")
-        # Then open each Vesynta_Tech module and copy it into the protocol.py
-        if len(module_list) > 0:
-            for module in module_list:
-                searcher = 'import (.*) as'
-                result = re.search(searcher, module)
-                module_path = os.path.join(abspath, result.group(1)+".py")
-                with open(module_path, 'r') as module_reader:
-                    for line1 in module_reader:
-                        if line1.rstrip() not in ignore_list and line1.rstrip() not in remove_list:
-                            outfile.write(line1)
-                    outfile.write("\n")
-    outfile.close()
-           
-    # Finally cleanup the entire protocol.py removing cross-references such as bb. or mt. or cusp. or calcunc.
-    if len(module_list) > 0:
-        for chk in cleanup_list:
-            with open(file, 'r') as file_reader:
-                lines1 = file_reader.readlines()
-            file_reader.close()
-            with open(file, 'w') as outfile1:
-                for line in lines1:
-                    if chk in line.rstrip():
-                        outfile1.write(line.replace(chk,''))
-                    else:
-                        outfile1.write(line)
-            outfile1.close()
+    # Bundles the converted protocol.py file with the Vesynta_Tech modules it imports into one single protocol file
+    # (see bundler.bundle_protocol), the file is overwritten with the tree shaken bundle
+    bundler.bundle_protocol_file(file, report=True)
 ############################################################
 
 def print_logs(log, display_type='basic'):
@@ -0,0 +1,77 @@
+"""
+Liquid classes group the settings of the custom functions adapted to a type of liquid (rates, depths, disposal volume...),
+so that they are tuned in one place instead of being repeated in every call
+
+* liquid_classes gives the settings of each class, with rates (in uL/s) per pipette model
+* bind_liquid_class() stores the settings of a class on a pipette, with the rates converted once to relative rates
+* the custom functions accept the name of a class with their liquid_class argument
+"""
+############################################################
+from __future__ import absolute_import
+
+from opentrons import types
+
+from Vesynta_Tech.OpenTrons2 import building_blocks as bb
+
+############################################################
+
+# Settings of each liquid class:
+# - aspirate_depth (in mm beneath the meniscus), disposal_volume (in uL, for reverse transfers) and touch_tip_position
+#   are the arguments of the transfer functions of the same name
+# - rates gives the aspirate and dispense rates (in uL/s) for each pipette model, 'default' is used for the other models
+liquid_classes = {
+    'aqueous': {'aspirate_depth': 2, 'disposal_volume': 5, 'touch_tip_position': 'none',
+                'rates': {'default': (75, 300), 'p20': (7.6, 7.6), 'p50': (25, 50), 'p1000': (274, 500)}},
+    'viscous': {'aspirate_depth': 3, 'disposal_volume': 10, 'touch_tip_position': 'none',
+                'rates': {'default': (20, 40), 'p20': (2, 4), 'p50': (7, 14), 'p1000': (70, 140)}},
+    'volatile_organic': {'aspirate_depth': 1, 'disposal_volume': 5, 'touch_tip_position': 'destination',
+                         'rates': {'default': (150, 300), 'p20': (7.6, 15), 'p50': (50, 100), 'p1000': (500, 1000)}},
+    'foaming': {'aspirate_depth': 2, 'disposal_volume': 10, 'touch_tip_position': 'none',
+                'rates': {'default': (37, 50), 'p20': (3.8, 5), 'p50': (12, 16), 'p1000': (137, 180)}},
+}
+
+def register_liquid_class(name: str,
+                          aspirate_depth: float,
+                          disposal_volume: float,
+                          touch_tip_position: str,
+                          rates: dict):
+    # Adds or replaces a liquid class, rates is a dictionary of (aspirate, dispense) rates in uL/s per pipette model
+    assert 'default' in rates
+    liquid_classes[name] = {'aspirate_depth': aspirate_depth, 'disposal_volume': disposal_volume,
+                            'touch_tip_position': touch_tip_position, 'rates': dict(rates)}
+############################################################
+
+def get_pipette_model(pipette: types.Mount):
+    # Model of a pipette as used in liquid_classes, e.g. 'p300' for a p300_single_gen2
+    return pipette.name.split('_')[0]
+def bind_liquid_class(pipette: types.Mount,
+                      name: str):
+    """
+    Stores the settings of a liquid class for a pipette, in the attribute pipette.liquid_classes_dict
+    The rates of the pipette model are converted to relative rates (aspirate_rate_relative and dispense_rate_relative)
+    If the default flow rates of the pipette are changed, bb.invalidate_pipette_context() removes the bound classes
+    """
+    if name not in liquid_classes:
+        raise KeyError('Liquid class {} not found, use one of {} or register it with register_liquid_class()'
+                       .format(name, sorted(liquid_classes)))
+    liquid_class = liquid_classes[name]
+    rates = liquid_class['rates']
+    aspirate_rate, dispense_rate = rates.get(get_pipette_model(pipette), rates['default'])
+    settings = {'aspirate_depth': liquid_class['aspirate_depth'],
+                'disposal_volume': liquid_class['disposal_volume'],
+                'touch_tip_position': liquid_class['touch_tip_position'],
+                'aspirate_rate': aspirate_rate,
+                'dispense_rate': dispense_rate,
+                'aspirate_rate_relative': bb.get_relative_from_flow_rate_aspirate(pipette, aspirate_rate),
+                'dispense_rate_relative': bb.get_relative_from_flow_rate_dispense(pipette, dispense_rate)}
+    if not hasattr(pipette, 'liquid_classes_dict'):
+        pipette.liquid_classes_dict = {}
+    pipette.liquid_classes_dict[name] = settings
+    return settings
+def get_liquid_class(pipette: types.Mount,
+                     name: str):
+    # Settings of a liquid class for a pipette, the class is bound to the pipette on first use
+    if hasattr(pipette, 'liquid_classes_dict') and name in pipette.liquid_classes_dict:
+        return pipette.liquid_classes_dict[name]
+    return bind_liquid_class(pipette, name)
+############################################################
@@ -215,6 +215,74 @@ gradations_tlc_50ul = np.array([[0, 50], # Top gradation of container i.e. maxim
                                 [0.1, 0]]) # Bottom of container i.e. no liquid
 ############################################################
 
+class GridInterpolator:
+    """
+    Piecewise linear interpolation function, giving the same results as np.interp(x, xp, fp, left, right)
+    
+    Scalar calls are the hot path of custom_aspirate() and custom_dispense(), they are answered without numpy:
+    - the range of xp is divided once in a uniform grid of bins, no larger than the smallest gap between two points,
+      and the segment of xp starting each bin is stored
+    - a query finds its bin by index arithmetic, then moves at most one segment forward, i.e. in constant time
+    - the value is then calculated on that segment with the same formula as np.interp
+    max_error is the largest difference to np.interp measured on all the points and bin edges when the grid is built
+    Arrays are passed to np.interp directly (e.g. conversions for a full rack)
+    """
+    max_bins = 4096 # Above this, bins may hold several points and queries move over more than one segment
+    
+    def __init__(self, xp: np.ndarray, fp: np.ndarray, left: float, right: float):
+        assert len(xp) == len(fp) and len(xp) >= 2
+        self.xp = np.array(xp, dtype=float)
+        self.fp = np.array(fp, dtype=float)
+        self.xp.setflags(write=False)
+        self.fp.setflags(write=False)
+        self.left = float(left)
+        self.right = float(right)
+        # Uniform grid of bins over the range of xp
+        self._x_start = float(self.xp[0])
+        self._x_end = float(self.xp[-1])
+        span = self._x_end - self._x_start
+        gaps = np.diff(self.xp)
+        smallest_gap = np.min(gaps[gaps > 0]) if np.any(gaps > 0) else span
+        self._bins = int(min(self.max_bins, max(1, np.ceil(span/smallest_gap)))) if span > 0 else 1
+        self._inverse_step = self._bins/span if span > 0 else 0.
+        bin_starts = self._x_start + np.arange(self._bins)/self._inverse_step if span > 0 else np.array([self._x_start])
+        segments = np.searchsorted(self.xp, bin_starts, side='right') - 1
+        self._bin_segments = np.clip(segments, 0, len(self.xp) - 2).tolist()
+        # Segments coefficients as python floats, np.interp formula: slope*(x - xp[j]) + fp[j]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slopes = np.diff(self.fp)/gaps
+        self._slopes = slopes.tolist()
+        self._x = self.xp.tolist()
+        self._f = self.fp.tolist()
+        # Error check against np.interp on every point, bin edge and bin centre
+        check = np.concatenate([self.xp, bin_starts, bin_starts + 0.5/self._inverse_step if span > 0 else []])
+        exact = np.interp(check, self.xp, self.fp, left=self.left, right=self.right)
+        self.max_error = float(np.max(np.abs(np.array([self(float(x)) for x in check]) - exact)))
+    
+    def __call__(self, x):
+        if not isinstance(x, (float, int)):
+            return np.interp(x, self.xp, self.fp, left=self.left, right=self.right)
+        # Same edge values as np.interp: left/right outside of xp, fp[-1] at the last point
+        if x < self._x_start:
+            return self.left
+        if x >= self._x_end:
+            return self.right if x > self._x_end else self._f[-1]
+        if x != x: # NaN
+            return float(np.interp(x, self.xp, self.fp))
+        index = int((x - self._x_start)*self._inverse_step)
+        if index >= self._bins:
+            index = self._bins - 1
+        j = self._bin_segments[index]
+        # Rounding of the bin index may place x at the edge of the neighbouring segment
+        while j < len(self._slopes) - 1 and x >= self._x[j + 1]:
+            j += 1
+        while j > 0 and x < self._x[j]:
+            j -= 1
+        if x == self._x[j]:
+            return self._f[j]
+        return self._slopes[j]*(x - self._x[j]) + self._f[j]
+############################################################
+
 def gradations_to_vh(gradations: np.ndarray):
     # Converts gradations (numpy array):
     # to tuple containg the v_given_h and h_given_v interpolation functions
@@ -232,42 +300,95 @@ def gradations_to_vh(gradations: np.ndarray):
     # Interpolation functions
     # Using linear interpolation (rather than cubic spline) to functions
     # becoming negative close to the bottom of the well
-    v_given_h = lambda x : np.interp(x, h_by_h, v_by_h, left=maximum_volume, right=0)
-    h_given_v = lambda x : np.interp(x, v_by_v, h_by_v, left=maximum_headroom, right=0)
+    v_given_h = GridInterpolator(h_by_h, v_by_h, left=maximum_volume, right=0)
+    h_given_v = GridInterpolator(v_by_v, h_by_v, left=maximum_headroom, right=0)
     
     # The order of the returned function is referenced by 
     # the custom_aspirate() and custom_dispense() functions
     return [v_given_h, h_given_v]
 ############################################################
+_shared_vh_functions = {}
+
+def shared_gradations_to_vh(gradations: np.ndarray):
+    # Returns the volume_headroom_functions of a gradation array, converted once and then shared by every caller
+    # The returned pair is a tuple (same order as gradations_to_vh()) so that wells cannot modify it
+    key = id(gradations)
+    if key not in _shared_vh_functions:
+        # The gradation array is kept alongside its functions so that its id cannot be reused
+        _shared_vh_functions[key] = (gradations, tuple(gradations_to_vh(gradations)))
+    return _shared_vh_functions[key][1]
+############################################################
 
 def call_gradations_epptube_1500ul():
-    return gradations_to_vh(gradations_epptube_1500ul)
+    return shared_gradations_to_vh(gradations_epptube_1500ul)
 def call_gradations_ambtube_1500ul():
-    return gradations_to_vh(gradations_ambtube_1500ul)
+    return shared_gradations_to_vh(gradations_ambtube_1500ul)
 def call_gradations_ftube_15ml():
-    return gradations_to_vh(gradations_ftube_15ml)
+    return shared_gradations_to_vh(gradations_ftube_15ml)
 def call_gradations_epptube_5ml():
-    return gradations_to_vh(gradations_epptube_5ml)
+    return shared_gradations_to_vh(gradations_epptube_5ml)
 def call_gradations_epptube_15ml():
-    return gradations_to_vh(gradations_epptube_15ml)
+    return shared_gradations_to_vh(gradations_epptube_15ml)
 def call_gradations_epptube_50ml():
-    return gradations_to_vh(gradations_epptube_50ml)
+    return shared_gradations_to_vh(gradations_epptube_50ml)
 def call_gradations_ftube_50ml():
-    return gradations_to_vh(gradations_ftube_50ml)
+    return shared_gradations_to_vh(gradations_ftube_50ml)
 def call_gradations_vial_1500ul():
-    return gradations_to_vh(gradations_vial_1500ul)
+    return shared_gradations_to_vh(gradations_vial_1500ul)
 def call_gradations_vial_2ml():
-    return gradations_to_vh(gradations_vial_2ml)
+    return shared_gradations_to_vh(gradations_vial_2ml)
 def call_gradations_vial_4ml():
-    return gradations_to_vh(gradations_vial_4ml)
+    return shared_gradations_to_vh(gradations_vial_4ml)
 def call_gradations_vial_8ml():
-    return gradations_to_vh(gradations_vial_8ml)
+    return shared_gradations_to_vh(gradations_vial_8ml)
 def call_gradations_vial_20ml():
-    return gradations_to_vh(gradations_vial_20ml)
+    return shared_gradations_to_vh(gradations_vial_20ml)
 def call_gradations_vial_30ml():
-    return gradations_to_vh(gradations_vial_30ml)
+    return shared_gradations_to_vh(gradations_vial_30ml)
 def call_gradations_cuvette_70ul():
-    return gradations_to_vh(gradations_cuvette_70ul)
+    return shared_gradations_to_vh(gradations_cuvette_70ul)
 def call_gradations_tlc_50ul():
-    return gradations_to_vh(gradations_tlc_50ul)
-############################################################
\ No newline at end of file
+    return shared_gradations_to_vh(gradations_tlc_50ul)
+############################################################
+
+### Volume_headroom_functions registry, used by initiate_well() to find the functions of a well from its labware ###
+# Keys are labware load names (i.e. "loadName" in the JSON definition), values are the gradations of their wells
+# Several labware using the same tube share a single pair of functions
+labware_gradations = {'adrena_ambtube_1500ul_rack_5row_8column': gradations_ambtube_1500ul,
+                      'adrena_cuvette_70ul_rack_4row_7column': gradations_cuvette_70ul,
+                      'adrena_epptube_1500ul_rack_5row_8column': gradations_epptube_1500ul,
+                      'adrena_epptube_5000ul_rack_4row_6column': gradations_epptube_5ml,
+                      'adrena_epptube_15ml_rack_3row_5column': gradations_epptube_15ml,
+                      'adrena_epptube_50ml_rack_2row_3column': gradations_epptube_50ml,
+                      'adrena_falctube_15ml_rack_3row_5column': gradations_ftube_15ml,
+                      'adrena_falctube_50ml_rack_2row_3column': gradations_ftube_50ml,
+                      'adrena_tlc_plate_50ul_1row_10column': gradations_tlc_50ul,
+                      'adrena_vial_1500ul_rack_5row_8column': gradations_vial_1500ul,
+                      'adrena_vial_2ml_rack_5row_8column': gradations_vial_2ml,
+                      'adrena_vial_4ml_rack_4row_7column': gradations_vial_4ml,
+                      'adrena_vial_8ml_rack_4row_6column': gradations_vial_8ml,
+                      'adrena_vial_20ml_rack_2row_4column': gradations_vial_20ml,
+                      'adrena_vial_30ml_rack_3row_4column': gradations_vial_30ml,
+                      'vs_000152_pn': gradations_ambtube_1500ul,
+                      'vs_000153_pn': gradations_epptube_5ml}
+############################################################
+
+def register_labware_gradations(load_name: str, 
+                                gradations: np.ndarray):
+    # Adds (or replaces) the gradations used for the wells of a labware
+    assert np.shape(gradations)[1] == 2
+    labware_gradations[load_name] = gradations
+def get_vh_functions(load_name: str):
+    """
+    Returns the volume_headroom_functions [v_given_h, h_given_v] for the wells of a labware
+    
+    - load_name is the "loadName" of the labware JSON definition, e.g. 'adrena_epptube_1500ul_rack_5row_8column'
+    - functions are generated the first time a labware type is used and then shared by all its wells
+    """
+    try:
+        gradations = labware_gradations[load_name]
+    except KeyError:
+        raise KeyError('No gradations are registered for labware {}, use register_labware_gradations() '
+                       'or give the volume_headroom_functions to initiate_well()'.format(load_name))
+    return shared_gradations_to_vh(gradations)
+############################################################
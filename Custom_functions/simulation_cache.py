@@ -0,0 +1,155 @@
+"""
+On-disk cache of protocol simulations, used by debugger.Protocol_Simulator to skip the conversion and simulation
+of protocols that did not change
+
+* simulations are keyed by a hash of the protocol file (notebook or script), of the Custom_functions sources
+  bundled with it, of the custom labware definitions and of the opentrons version
+* each entry stores the converted script and the run_log, sanitized to texts and plain values (see sanitize_run_log())
+* the least recently used entries are removed when the cache is larger than its maximum size
+"""
+############################################################
+from __future__ import absolute_import
+
+import hashlib
+import json
+import os
+import shutil
+
+from opentrons import types
+
+############################################################
+
+default_cache_directory = os.path.join(os.path.expanduser('~'), '.ot2_simulation_cache')
+package_directory = os.path.dirname(os.path.abspath(__file__))
+
+def get_opentrons_version():
+    # Version of the opentrons package used for simulations, None if it is not installed
+    try:
+        import opentrons
+    except ImportError:
+        return None
+    return getattr(opentrons, '__version__', None)
+def _sanitize_location(location: types.Location):
+    # Point and description of the well (or labware) of a location, as read by time_estimator
+    # Locations not attached to a well (labware None or a string) have no description, as time_estimator treats them
+    labware = getattr(location.labware, 'object', location.labware)  # LabwareLike of recent versions of the API
+    return {'point': [float(coordinate) for coordinate in location.point],
+            'labware': None if labware is None or isinstance(labware, str) else str(labware)}
+def _sanitize_value(value):
+    # Plain version of a run_log value: numbers, strings, booleans and None are kept, other objects become their str()
+    # Locations keep their coordinates, wells their top location and instruments their flow rates
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, types.Location):
+        return _sanitize_location(value)
+    if callable(getattr(value, 'top', None)):
+        return _sanitize_location(value.top())
+    if hasattr(value, 'flow_rate'):
+        return {'description': str(value),
+                'flow_rate': {command: float(getattr(value.flow_rate, command))
+                              for command in ('aspirate', 'dispense', 'blow_out')}}
+    if isinstance(value, (list, tuple)):
+        return [_sanitize_value(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): _sanitize_value(item) for key, item in value.items()}
+    return str(value)
+def sanitize_run_log(run_log):
+    """
+    Returns a copy of a run_log (as returned by opentrons.simulate.simulate) that can be stored as JSON
+    Locations are replaced by their coordinates and the description of their well (e.g. 'A1 of Tiprack on 5'),
+    instruments by their description and flow rates, the texts, volumes and rates are kept,
+    so that print_logs() can be used and time_estimator.estimate_run_log_time() gives the same estimate
+    """
+    entries = run_log[0] if isinstance(run_log, tuple) else run_log
+    return ([{'level': entry['level'],
+              'payload': _sanitize_value(entry['payload']),
+              'logs': _sanitize_value(entry.get('logs', []))} for entry in entries], None)
+############################################################
+
+class SimulationCache:
+    """
+    Cache of simulations in a directory, one sub-directory per simulation key containing
+    the converted script (protocol.py) and the sanitized run_log (run_log.json)
+
+    - max_size is the maximum size of the cache (bytes), the least recently used entries are removed beyond it
+    """
+    def __init__(self, directory: str = default_cache_directory, max_size: int = 100*10**6):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, protocol_path: str, custom_labware_directory: str = None):
+        # Hash of everything the result of a simulation depends on
+        digest = hashlib.sha256()
+        def add_file(path):
+            digest.update(os.path.basename(path).encode('utf-8'))
+            with open(path, 'rb') as file_reader:
+                digest.update(hashlib.sha256(file_reader.read()).digest())
+        add_file(protocol_path)
+        for name in sorted(os.listdir(package_directory)):
+            if name.endswith('.py'):
+                add_file(os.path.join(package_directory, name))
+        if custom_labware_directory is not None:
+            for name in sorted(os.listdir(custom_labware_directory)):
+                if name.endswith('.json'):
+                    add_file(os.path.join(custom_labware_directory, name))
+        digest.update(str(get_opentrons_version()).encode('utf-8'))
+        return digest.hexdigest()
+    def get(self, key: str):
+        # (script, run_log) of a cached simulation, None if it is not cached
+        entry = os.path.join(self.directory, key)
+        try:
+            with open(os.path.join(entry, 'protocol.py'), 'r') as file_reader:
+                script = file_reader.read()
+            with open(os.path.join(entry, 'run_log.json'), 'r') as file_reader:
+                entries = json.load(file_reader)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        os.utime(entry)  # Most recently used
+        self.hits += 1
+        return script, (entries, None)
+    def put(self, key: str, script: str, run_log):
+        # Stores a simulation, the entry is written to a temporary directory first so that it is never read half written
+        os.makedirs(self.directory, exist_ok=True)
+        entry = os.path.join(self.directory, key)
+        temporary = entry + '.{}.tmp'.format(os.getpid())
+        shutil.rmtree(temporary, ignore_errors=True)
+        os.makedirs(temporary)
+        with open(os.path.join(temporary, 'protocol.py'), 'w') as outfile:
+            outfile.write(script)
+        with open(os.path.join(temporary, 'run_log.json'), 'w') as outfile:
+            json.dump(sanitize_run_log(run_log)[0], outfile)
+        shutil.rmtree(entry, ignore_errors=True)
+        try:
+            os.rename(temporary, entry)
+        except OSError:
+            shutil.rmtree(temporary, ignore_errors=True)  # Stored by another process in the meantime
+        self.evict()
+    def entries(self):
+        # (last use time, size in bytes, path) of the cached simulations, least recently used first
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isdir(path) and not name.endswith('.tmp'):
+                size = sum(os.path.getsize(os.path.join(path, file)) for file in os.listdir(path))
+                entries.append((os.path.getmtime(path), size, path))
+        return sorted(entries)
+    def evict(self):
+        # Removes the least recently used simulations until the cache is within max_size, returns the number removed
+        entries = self.entries()
+        total = sum(size for last_use, size, path in entries)
+        removed = 0
+        for last_use, size, path in entries:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            removed += 1
+        return removed
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+############################################################
@@ -0,0 +1,206 @@
+"""
+Estimation of the run time of a protocol, either from the run_log returned by debugger.Protocol_Simulator
+or from a command_plan.CommandPlan recorded with the custom functions
+
+The estimate adds up:
+* gantry moves, from the distances between the well coordinates of the labware definitions and the move speeds
+  (moves between different wells arc above the deck, moves within a well or with force_direct are straight)
+* aspirations and dispenses, from their volumes and flow rates (in uL/s)
+* fixed durations for the other commands (tip pick-up and drop, blow out, delays...)
+Accelerations and the real arc heights of the deck are not known: the estimate is only meant to compare runs
+and to find which functions take most of the time
+"""
+############################################################
+from __future__ import absolute_import
+
+import re
+
+import numpy as np
+
+from opentrons import types
+
+from Vesynta_Tech.OpenTrons2 import building_blocks as bb
+
+############################################################
+
+# Default OT-2 gantry speeds (mm/s)
+XY_SPEED = 400
+Z_SPEED = 125
+# Height (mm) above the highest point of a move reached by the arcs between wells
+ARC_CLEARANCE = 10
+# Time (s) added to every move for the acceleration and deceleration of the gantry
+MOVE_OVERHEAD = 0.2
+# Fixed durations (s) of the commands not calculated from distances or volumes
+COMMAND_TIMES = {'pick_up_tip': 6, 'drop_tip': 5, 'blow_out': 1, 'touch_tip': 3, 'home': 10}
+
+class TimeEstimate:
+    """
+    Run time estimated by estimate_plan_time() or estimate_run_log_time()
+
+    - total is the estimated run time (s)
+    - by_function gives the time (s) spent in each function: the innermost custom function of a command plan
+      (e.g. custom_touch_tip) or the top command of a run_log (e.g. Mixing)
+    - by_command gives the time (s) spent in each kind of pipette command (move_to, aspirate...)
+    """
+    def __init__(self):
+        self.total = 0
+        self.by_function = {}
+        self.by_command = {}
+
+    def add(self, function: str, command: str, time: float):
+        self.total += time
+        self.by_function[function] = self.by_function.get(function, 0) + time
+        self.by_command[command] = self.by_command.get(command, 0) + time
+    def report(self):
+        # Time breakdown, most time consuming functions and commands first
+        lines = ['Estimated run time: {} min {} s'.format(int(self.total//60), round(self.total % 60))]
+        for title, times in (('function', self.by_function), ('command', self.by_command)):
+            lines.append('By {}:'.format(title))
+            for name, time in sorted(times.items(), key=lambda item: -item[1]):
+                lines.append('\t{}: {} s ({}%)'.format(name, round(time, 1), round(100*time/self.total, 1)))
+        return '\n'.join(lines)
+############################################################
+
+def _labware_of(location: types.Location):
+    # Well of a location, None for the locations not attached to a well (e.g. the touch points of custom_touch_tip)
+    labware = location.labware
+    labware = getattr(labware, 'object', labware)  # LabwareLike of recent versions of the API
+    return None if labware is None or isinstance(labware, str) else labware
+def _same_well(labware_1, labware_2):
+    # Wells are compared by their _geometry, the API giving a new Well object at every access to a well
+    return getattr(labware_1, '_geometry', labware_1) is getattr(labware_2, '_geometry', labware_2)
+def move_time(start: types.Location,
+              end: types.Location,
+              speed: float = None,
+              force_direct: bool = False):
+    """
+    Estimated time (s) of a move between two locations
+    The move is straight if force_direct or if it stays in a well, otherwise it arcs above both locations
+    - speed limits the gantry speed (mm/s) as in pipette.move_to()
+    """
+    if start is None:
+        return MOVE_OVERHEAD  # Unknown start position (e.g. after a tip change)
+    xy_speed = XY_SPEED if speed is None else min(speed, XY_SPEED)
+    z_speed = Z_SPEED if speed is None else min(speed, Z_SPEED)
+    start_point = np.array(start.point, dtype=float)
+    end_point = np.array(end.point, dtype=float)
+    start_labware = _labware_of(start)
+    end_labware = _labware_of(end)
+    if force_direct or start_labware is None or end_labware is None or _same_well(start_labware, end_labware):
+        horizontal = float(np.hypot(*(end_point[:2] - start_point[:2])))
+        vertical = abs(end_point[2] - start_point[2])
+        return MOVE_OVERHEAD + max(horizontal/xy_speed, vertical/z_speed)
+    arc_height = max(start_point[2], end_point[2]) + ARC_CLEARANCE
+    horizontal = float(np.hypot(*(end_point[:2] - start_point[:2])))
+    vertical = (arc_height - start_point[2]) + (arc_height - end_point[2])
+    return 3*MOVE_OVERHEAD + horizontal/xy_speed + vertical/z_speed
+############################################################
+
+def estimate_plan_time(plan):
+    """
+    Estimates the run time of a command_plan.CommandPlan, before or after plan.optimize()
+    Times are attributed to the innermost custom function having sent each command, or to the command itself if
+    it was not sent by a custom function (e.g. pick_up_tip)
+    The aspirate and dispense rates are converted to uL/s with the default flow rates of the pipette of the plan
+    """
+    flow_rates = bb.get_default_flow_rates(plan.pipette)
+    estimate = TimeEstimate()
+    position = None
+    for command in plan.commands:
+        function = command.functions[-1] if command.functions else command.name
+        location = command.location
+        time = 0
+        if location is not None:
+            time += move_time(position, location, command.kwargs.get('speed'), command.force_direct)
+            position = location
+        elif command.name not in ('aspirate', 'dispense', 'blow_out', 'mix'):
+            position = None
+        if command.name in ('aspirate', 'dispense'):
+            volume = command.args[0] if command.args else command.kwargs.get('volume', 0)
+            rate = command.kwargs.get('rate', 1.0)
+            time += volume/(rate*flow_rates[command.name])
+        else:
+            time += COMMAND_TIMES.get(command.name, 0)
+        estimate.add(function, command.name, time)
+    return estimate
+############################################################
+
+# First words of the run_log texts of each command
+RUN_LOG_COMMANDS = {'Aspirating': 'aspirate', 'Dispensing': 'dispense', 'Moving': 'move_to', 'Blowing': 'blow_out',
+                    'Picking': 'pick_up_tip', 'Dropping': 'drop_tip', 'Touching': 'touch_tip', 'Homing': 'home',
+                    'Delaying': 'delay', 'Mixing': 'mix', 'Transferring': 'transfer', 'Distributing': 'distribute',
+                    'Consolidating': 'consolidate', 'Air': 'air_gap', 'Returning': 'return_tip'}
+
+class _CachedWell:
+    # Stand-in for the well of a location of a cached run_log, one per description so that wells compare by identity
+    __slots__ = ('description',)
+    
+    def __init__(self, description: str):
+        self.description = description
+_cached_wells = {}
+
+def _run_log_location(payload: dict):
+    """
+    Location of a run_log command, tip pick-ups and drops give a well instead of a location
+    The locations of the run_logs read from the simulation cache are dictionaries (see simulation_cache.sanitize_run_log)
+    """
+    location = payload.get('location')
+    if location is None or isinstance(location, types.Location):
+        return location
+    if isinstance(location, dict) and 'point' in location:
+        description = location['labware']
+        if description is not None and description not in _cached_wells:
+            _cached_wells[description] = _CachedWell(description)
+        return types.Location(types.Point(*location['point']), _cached_wells.get(description))
+    if hasattr(location, 'top'):
+        return location.top()
+    return None
+def _run_log_flow_rate(payload: dict, command: str):
+    # Flow rate (uL/s) of an aspiration or dispense, given in the text of the command
+    result = re.search(r'at ([0-9.]+) uL/sec', payload['text'])
+    if result:
+        return float(result.group(1))
+    instrument = payload['instrument']
+    if isinstance(instrument, dict):
+        return payload.get('rate', 1.0)*instrument['flow_rate'][command]   # Cached run_log
+    return payload.get('rate', 1.0)*getattr(instrument.flow_rate, command)
+def _run_log_delay(text: str):
+    # Duration (s) of a delay, e.g. 'Delaying for 1 minutes and 5.0 seconds'
+    result = re.search(r'([0-9.]+) minutes and ([0-9.]+) seconds', text)
+    return 60*float(result.group(1)) + float(result.group(2)) if result else 0
+
+def estimate_run_log_time(run_log):
+    """
+    Estimates the run time of a simulated protocol, from the run_log returned by debugger.Protocol_Simulator
+    The run_log does not name the custom functions: times are attributed to the top command of each entry,
+    e.g. the moves of a touch tip are attributed to 'Touching' and the strokes of pipette.mix() to 'Mixing'
+    """
+    entries = run_log[0] if isinstance(run_log, tuple) else run_log
+    estimate = TimeEstimate()
+    position = None
+    function = None
+    for i, entry in enumerate(entries):
+        payload = entry['payload']
+        words = payload['text'].split()
+        command = RUN_LOG_COMMANDS.get(words[0] if words else '', 'other')
+        if entry['level'] == 0:
+            function = words[0] if words else 'other'
+        # Commands made of other commands (e.g. mix) are only counted through the following entries
+        if i+1 < len(entries) and entries[i+1]['level'] > entry['level']:
+            continue
+        location = _run_log_location(payload)
+        time = 0
+        if location is not None:
+            time += move_time(position, location)
+            position = location
+        elif command in ('pick_up_tip', 'drop_tip', 'home'):
+            position = None
+        if command in ('aspirate', 'dispense'):
+            time += payload['volume']/_run_log_flow_rate(payload, command)
+        elif command == 'delay':
+            time += _run_log_delay(payload['text'])
+        else:
+            time += COMMAND_TIMES.get(command, 0)
+        estimate.add(function, command, time)
+    return estimate
+############################################################
@@ -0,0 +1,173 @@
+"""
+Planning of batches of transfers (e.g. a 96-sample dilution) before they are executed with the custom transfer functions:
+* transfers using the same source and liquid settings are grouped so that they can share one tip, if the tip does not
+  touch the destination liquid (which it would bring back to the source)
+* transfers are ordered to shorten gantry travel between wells
+* transfers depending on each other (e.g. serial dilutions) keep their order
+
+Jobs are given as (source, destination, volume, liquid_settings) tuples:
+- liquid_settings is an optional dictionary of arguments for custom_transfer_forward() or custom_transfer_reverse(),
+  the key 'mode' selects the function ('forward' by default, or 'reverse')
+"""
+############################################################
+from __future__ import absolute_import
+
+import numpy as np
+
+from opentrons import types
+
+from Vesynta_Tech.OpenTrons2 import building_blocks as bb
+from Vesynta_Tech.OpenTrons2 import custom_pipetting as cusp
+from Vesynta_Tech.OpenTrons2 import liquid_classes as liqc
+############################################################
+
+class TransferPlan:
+    """
+    Execution order of a batch of transfers, returned by plan_transfers()
+
+    - jobs are the (source, destination, volume, liquid_settings) jobs in execution order
+    - new_tip is True for the jobs starting with a new tip
+    - travel and tips are estimated for the planned order, input_travel and input_tips for the order given
+    Travel is the horizontal distance (in mm) between the wells visited, calculated from the well positions
+    of the labware definitions
+    """
+    def __init__(self, jobs: list, new_tip: list, travel: float, tips: int, input_travel: float, input_tips: int):
+        self.jobs = jobs
+        self.new_tip = new_tip
+        self.travel = travel
+        self.tips = tips
+        self.input_travel = input_travel
+        self.input_tips = input_tips
+
+    def travel_saved(self):
+        # Travel (in mm) saved compared to the order given
+        return self.input_travel - self.travel
+    def report(self):
+        # Summary of the plan compared to the order given
+        return ('{} transfers planned with {} tips (instead of {}), '
+                'estimated travel {} mm (instead of {} mm, {} mm saved)'.format(len(self.jobs), self.tips, self.input_tips,
+                                                                             round(self.travel), round(self.input_travel),
+                                                                             round(self.travel_saved())))
+############################################################
+
+def _format_job(job: tuple):
+    # Completes a job with an empty liquid_settings dictionary if none was given
+    if len(job) == 3:
+        return (job[0], job[1], job[2], {})
+    assert len(job) == 4
+    return (job[0], job[1], job[2], dict(job[3]) if job[3] else {})
+def _tip_key(job: tuple):
+    # Jobs with the same key can be done with the same tip: same source and same liquid settings
+    # Wells are keyed by their _geometry, the API giving a new Well object at every access to a well
+    return (id(job[0]._geometry), tuple(sorted(job[3].items())))
+def _touches_destination(settings: dict):
+    # True if the tip touches the destination liquid: dispense at or below the meniscus, or touch tip at the destination
+    # (same rule as the custom transfer functions use for bb.record_tip_contact())
+    touch_tip_position = settings.get('touch_tip_position', 'none')
+    if settings.get('liquid_class') is not None:
+        touch_tip_position = liqc.liquid_classes[settings['liquid_class']]['touch_tip_position']
+    return ((settings.get('dispense_meniscus', True) and settings.get('dispense_depth', 0) >= 0)
+            or touch_tip_position == 'destination')
+def _can_share_tip(job: tuple, next_job: tuple):
+    # The tip of job can be used for next_job: same source and liquid settings, destination liquid not touched
+    return _tip_key(job) == _tip_key(next_job) and not _touches_destination(job[3])
+def _position(well: types.Location):
+    # Horizontal position of a well on the deck
+    position = well._geometry._position
+    return np.array([position.x, position.y])
+def _distance(position_1: np.ndarray, position_2: np.ndarray):
+    return float(np.hypot(*(position_1 - position_2)))
+############################################################
+
+def order_travel(jobs: list):
+    # Estimated horizontal travel (in mm) of the pipette going from source to destination for each job in order
+    travel = 0
+    previous_position = None
+    for source, destination, volume, settings in jobs:
+        source_position = _position(source)
+        if previous_position is not None:
+            travel += _distance(previous_position, source_position)
+        previous_position = _position(destination)
+        travel += _distance(source_position, previous_position)
+    return travel
+def order_tips(jobs: list, share_tips: bool = True):
+    # Tips needed to execute jobs in order, a new tip is used whenever source or liquid settings change
+    # or the previous job touched its destination liquid
+    new_tip = []
+    previous_job = None
+    for job in jobs:
+        new_tip.append(not share_tips or previous_job is None or not _can_share_tip(previous_job, job))
+        previous_job = job
+    return new_tip
+############################################################
+
+def plan_transfers(jobs: list,
+                   share_tips: bool = True):
+    """
+    Orders a batch of transfers to minimise tip pick-ups, then gantry travel
+
+    - jobs is a list of (source, destination, volume, liquid_settings) tuples, liquid_settings can be omitted
+    - share_tips allows consecutive jobs from the same source with the same liquid settings to use the same tip,
+      only if their tip does not touch the destination liquid: dispense above the meniscus (dispense_meniscus False
+      or a negative dispense_depth) and no touch tip at the destination
+    Jobs using a well as destination that another job uses as source (or the reverse) are kept in the order given,
+    the other jobs can be reordered (including several dispenses in the same well)
+    Returns a TransferPlan, see TransferPlan.report() for the travel and tips saved
+    """
+    jobs = [_format_job(job) for job in jobs]
+    # Dependencies: a job must come after earlier jobs dispensing in its source or aspirating from its destination
+    predecessors = [set() for job in jobs]
+    for j, (source_j, destination_j, volume_j, settings_j) in enumerate(jobs):
+        for i in range(j):
+            source_i, destination_i = jobs[i][0], jobs[i][1]
+            if destination_i._geometry is source_j._geometry or source_i._geometry is destination_j._geometry:
+                predecessors[j].add(i)
+    # Greedy ordering: stay with the current tip as long as possible, picking the closest job
+    remaining = list(range(len(jobs)))
+    order = []
+    current_position = None
+    while remaining:
+        ready = [j for j in remaining if not predecessors[j].difference(order)]
+        same_tip = [j for j in ready if share_tips and order and _can_share_tip(jobs[order[-1]], jobs[j])]
+        candidates = same_tip if same_tip else ready
+        if current_position is None:
+            chosen = candidates[0]
+        else:
+            chosen = min(candidates, key=lambda j: _distance(current_position, _position(jobs[j][0])) +
+                                                   _distance(_position(jobs[j][0]), _position(jobs[j][1])))
+        order.append(chosen)
+        remaining.remove(chosen)
+        current_position = _position(jobs[chosen][1])
+    ordered_jobs = [jobs[j] for j in order]
+    new_tip = order_tips(ordered_jobs, share_tips)
+    input_new_tip = order_tips(jobs, share_tips)
+    return TransferPlan(ordered_jobs, new_tip, order_travel(ordered_jobs), sum(new_tip),
+                        order_travel(jobs), sum(input_new_tip))
+############################################################
+
+def execute_transfer_plan(pipette: types.Mount,
+                          plan: TransferPlan,
+                          change_tips: bool = True):
+    """
+    Executes the jobs of a TransferPlan in order with custom_transfer_forward() or custom_transfer_reverse()
+
+    - change_tips handles the tips with bb.prepare_tip() through the tip_policy argument of the transfer functions:
+      'never' where the plan requires a new tip, 'same_source' where it shares the tip (so the tip is only reused
+      if it did not touch another liquid), unless the liquid_settings of the job give their own tip_policy
+      The last tip is dropped, the pipette should not carry a tip at the start
+      If False, tips are not handled by this function
+    """
+    for (source, destination, volume, settings), new_tip in zip(plan.jobs, plan.new_tip):
+        settings = dict(settings)
+        if change_tips:
+            settings.setdefault('tip_policy', 'never' if new_tip else 'same_source')
+        mode = settings.pop('mode', 'forward')
+        if mode == 'forward':
+            cusp.custom_transfer_forward(pipette, volume, source, destination, **settings)
+        elif mode == 'reverse':
+            cusp.custom_transfer_reverse(pipette, volume, source, destination, **settings)
+        else:
+            raise ValueError('Transfer mode {} not recognised, use "forward" or "reverse"'.format(mode))
+    if change_tips:
+        bb.release_tip(pipette)
+############################################################
@@ -0,0 +1,12 @@
+import pytest
+
+@pytest.fixture(autouse=True)
+def empty_deck_state():
+    # Every test starts with no initiated well and an empty event log
+    try:
+        from Vesynta_Tech.OpenTrons2 import building_blocks as bb
+    except ImportError:
+        yield
+        return
+    bb.reset_deck_state()
+    yield
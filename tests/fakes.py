@@ -0,0 +1,112 @@
+"""
+Stand-ins for the labware and pipettes of the OpenTrons API, recording the commands sent by the custom functions
+Only the attributes read by the custom functions are given
+"""
+from opentrons import types
+
+class Geometry:
+    def __init__(self, depth: float, diameter: float, position: types.Point):
+        self._depth = depth
+        self._diameter = diameter
+        self._position = position
+
+class Well:
+    # As in the OpenTrons API 4.2, a new Well wrapper is returned by every access to a well, sharing its _geometry
+    def __init__(self, parent, name: str, geometry: Geometry):
+        self.parent = parent
+        self.name = name
+        self._geometry = geometry
+
+    def top(self, z: float = 0):
+        return types.Location(self._geometry._position + types.Point(0, 0, z), self)
+    def bottom(self, z: float = 0):
+        return types.Location(self._geometry._position + types.Point(0, 0, z - self._geometry._depth), self)
+    def __eq__(self, other):
+        # Wells are equal if their tops are at the same coordinates, as in the OpenTrons API
+        if not isinstance(other, Well):
+            return NotImplemented
+        return self.top().point == other.top().point
+    def __hash__(self):
+        return hash(self.top().point)
+    def __repr__(self):
+        return '{} of {}'.format(self.name, self.parent.load_name)
+
+class Labware:
+    # A single row of wells, 9 mm apart
+    def __init__(self, load_name: str, number: int = 3, depth: float = 42.2, diameter: float = 10.75, slot: tuple = (0, 0, 0)):
+        self.load_name = load_name
+        self._geometries = [('A{}'.format(i+1), Geometry(depth, diameter, types.Point(slot[0] + 9*i, slot[1], slot[2] + 50)))
+                            for i in range(number)]
+
+    def wells(self):
+        return [Well(self, name, geometry) for name, geometry in self._geometries]
+    def __getitem__(self, name: str):
+        return self.wells()[[well_name for well_name, geometry in self._geometries].index(name)]
+
+class FlowRates:
+    def __init__(self, rate: float):
+        self.aspirate = rate
+        self.dispense = rate
+        self.blow_out = rate
+
+class Implementation:
+    def __init__(self, rate: float):
+        self._flow_rates = FlowRates(rate)
+
+class TipRack:
+    tip_length = 50
+
+class Context:
+    location_cache = None
+
+class Pipette:
+    """
+    Pipette recording its commands in log as (name, args, kwargs)
+    has_tip and the location cache of its context are updated as by the OpenTrons API
+    """
+    def __init__(self, max_volume: float = 300, name: str = 'p300_single_gen2', rate: float = 92.86):
+        self.name = name
+        self.max_volume = max_volume
+        self.min_volume = max_volume/10
+        self.has_tip = False
+        self.log = []
+        self.flow_rate = FlowRates(rate)
+        self._implementation = Implementation(rate)
+        self._tip_racks = [TipRack()]
+        self._ctx = Context()
+
+    def _record(self, name: str, args: tuple, kwargs: dict):
+        self.log.append((name, args, kwargs))
+        for argument in list(args) + list(kwargs.values()):
+            if isinstance(argument, types.Location):
+                self._ctx.location_cache = argument
+        return self
+    def commands(self, name: str = None):
+        # Names of the commands sent, or the commands of one name
+        return [command[0] for command in self.log] if name is None else [command for command in self.log if command[0] == name]
+    def aspirate(self, *args, **kwargs):
+        return self._record('aspirate', args, kwargs)
+    def dispense(self, *args, **kwargs):
+        return self._record('dispense', args, kwargs)
+    def blow_out(self, *args, **kwargs):
+        return self._record('blow_out', args, kwargs)
+    def move_to(self, *args, **kwargs):
+        return self._record('move_to', args, kwargs)
+    def touch_tip(self, *args, **kwargs):
+        return self._record('touch_tip', args, kwargs)
+    def mix(self, *args, **kwargs):
+        return self._record('mix', args, kwargs)
+    def air_gap(self, *args, **kwargs):
+        return self._record('air_gap', args, kwargs)
+    def pick_up_tip(self, *args, **kwargs):
+        if self.has_tip:
+            raise RuntimeError('Tip already attached')
+        self.has_tip = True
+        self._ctx.location_cache = None
+        return self._record('pick_up_tip', args, kwargs)
+    def drop_tip(self, *args, **kwargs):
+        if not self.has_tip:
+            raise RuntimeError('No tip attached')
+        self.has_tip = False
+        self._ctx.location_cache = None
+        return self._record('drop_tip', args, kwargs)
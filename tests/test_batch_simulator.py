@@ -0,0 +1,122 @@
+import json
+
+import pytest
+
+pytest.importorskip('opentrons.simulate')
+batch_simulator = pytest.importorskip('Vesynta_Tech.OpenTrons2.batch_simulator')
+bb = pytest.importorskip('Vesynta_Tech.OpenTrons2.building_blocks')
+
+import fakes
+
+def write_notebook(path, cells):
+    notebook = {'cells': [{'cell_type': cell_type, 'metadata': {}, 'source': source} for cell_type, source in cells],
+                'metadata': {}, 'nbformat': 4, 'nbformat_minor': 4}
+    path.write_text(json.dumps(notebook))
+    return str(path)
+
+############################################################
+# In-memory notebook conversion (user-025)
+
+def test_notebook_source_keeps_code_cells_only(tmp_path):
+    notebook = write_notebook(tmp_path / 'protocol.ipynb', [('markdown', '# Title'),
+                                                            ('code', ['x = 1\n', 'y = x + 1']),
+                                                            ('code', 'z = y')])
+    namespace = {}
+    exec(compile(batch_simulator.notebook_source(notebook), 'protocol', 'exec'), namespace)
+    assert namespace['z'] == 2
+    assert not (tmp_path / 'protocol.py').exists()
+
+def test_notebook_source_comments_out_magics(tmp_path):
+    notebook = write_notebook(tmp_path / 'protocol.ipynb', [('code', '%matplotlib inline\n!pip list\nx = 1'),
+                                                            ('code', '%%bash\necho "not python" > file'),
+                                                            ('code', '%%HTML\n<b>not python</b>'),
+                                                            ('code', 'y = x')])
+    source = batch_simulator.notebook_source(notebook)
+    namespace = {}
+    exec(compile(source, 'protocol', 'exec'), namespace)
+    assert namespace['y'] == 1
+    assert '# echo "not python" > file' in source
+
+############################################################
+# Deck state reset between simulations (user-004)
+
+def test_simulate_protocol_resets_deck_state(tmp_path, monkeypatch):
+    well = fakes.Labware('adrena_epptube_1500ul_rack_5row_8column', 1).wells()[0]
+    bb.initiate_well(well)
+    wells_seen = []
+    def simulate(protocol_file, file_name=None, custom_labware_paths=None):
+        wells_seen.append(len(bb.deck_state.wells))
+        return [], None
+    monkeypatch.setattr(batch_simulator, 'simulate', simulate)
+    protocol = tmp_path / 'protocol.py'
+    protocol.write_text('metadata = {}\n')
+    batch_simulator.simulate_protocol(str(protocol), use_cache=False)
+    assert wells_seen == [0]
+############################################################
+# Headless batch simulation (user-024)
+
+def fake_simulate(protocol_file, file_name=None, custom_labware_paths=None):
+    # run_log of the entries printed by the protocol, e.g. print('Aspirating')
+    source = protocol_file.read()
+    if 'raise' in source:
+        raise RuntimeError('protocol failed')
+    texts = [line.split("'")[1] for line in source.split('\n') if line.startswith('print(')]
+    return [{'level': 0, 'payload': {'text': text}, 'logs': []} for text in texts], None
+
+def test_simulation_task_logs_the_run_log(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_simulator, 'simulate', fake_simulate)
+    protocol = tmp_path / 'protocol.py'
+    protocol.write_text("print('Picking up tip')\nprint('Dropping tip')\n")
+    log = tmp_path / 'protocol.log'
+    result = batch_simulator._simulation_task(str(protocol), None, str(log), False, False)
+    assert (result.passed, result.commands, result.cached) == (True, 2, False)
+    assert log.read_text().endswith('Picking up tip\nDropping tip\n')
+
+def test_simulation_task_reports_errors(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_simulator, 'simulate', fake_simulate)
+    protocol = tmp_path / 'broken.py'
+    protocol.write_text("raise RuntimeError('protocol failed')\n")
+    log = tmp_path / 'broken.log'
+    result = batch_simulator._simulation_task(str(protocol), None, str(log), False, False)
+    assert (result.passed, result.error) == (False, 'RuntimeError: protocol failed')
+    assert 'Traceback' in log.read_text()
+
+def test_summary_table_lists_failures():
+    results = [batch_simulator.BatchResult('/protocols/good.py', 'logs/001_good.log', True, 120, 3.14, True),
+               batch_simulator.BatchResult('/protocols/broken.ipynb', 'logs/002_broken.log', False, 0, 0.5, False,
+                                           'RuntimeError: protocol failed')]
+    lines = batch_simulator.summary_table(results).split('\n')
+    assert lines[0].split() == ['Protocol', 'Result', 'Commands', 'Time', '(s)', 'Cached']
+    assert lines[2].split() == ['good.py', 'pass', '120', '3.1', 'yes']
+    assert lines[3].split() == ['broken.ipynb', 'FAIL', '0', '0.5', 'no']
+    assert lines[-2] == 'broken.ipynb: RuntimeError: protocol failed (see logs/002_broken.log)'
+    assert lines[-1] == '1 of 2 protocols passed'
+
+def test_main_exit_code(monkeypatch, capsys):
+    results = []
+    monkeypatch.setattr(batch_simulator, 'simulate_batch', lambda *arguments: results)
+    results.append(batch_simulator.BatchResult('good.py', 'good.log', True, 1, 0, False))
+    assert batch_simulator.main(['good.py', '--no-cache']) == 0
+    results.append(batch_simulator.BatchResult('broken.py', 'broken.log', False, 0, 0, False, 'error'))
+    assert batch_simulator.main(['good.py', 'broken.py']) == 1
+    assert '1 of 2 protocols passed' in capsys.readouterr().out
+############################################################
+# Simulation cache (user-023)
+
+def test_unchanged_protocols_are_read_from_the_cache(tmp_path, monkeypatch):
+    calls = []
+    def simulate(protocol_file, file_name=None, custom_labware_paths=None):
+        calls.append(file_name)
+        return fake_simulate(protocol_file)
+    monkeypatch.setattr(batch_simulator, 'simulate', simulate)
+    monkeypatch.setattr(batch_simulator, 'cached_simulations',
+                        batch_simulator.SimulationCache(str(tmp_path / 'cache')))
+    notebook = write_notebook(tmp_path / 'protocol.ipynb', [('code', "print('Homing')")])
+    script, run_log, cached = batch_simulator.simulate_protocol(notebook)
+    assert not cached and calls == ['protocol.py']
+    cached_script, cached_run_log, cached = batch_simulator.simulate_protocol(notebook, write_script=True)
+    assert cached and calls == ['protocol.py']
+    assert cached_script == script and cached_run_log[0] == run_log[0]
+    assert (tmp_path / 'protocol.py').read_text() == script
+    write_notebook(tmp_path / 'protocol.ipynb', [('code', "print('Homing')\nprint('Delaying')")])
+    assert not batch_simulator.simulate_protocol(notebook)[2]
@@ -0,0 +1,238 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('opentrons')
+bb = pytest.importorskip('Vesynta_Tech.OpenTrons2.building_blocks')
+mt = pytest.importorskip('Vesynta_Tech.OpenTrons2.meniscus_tracking')
+
+import fakes
+
+@pytest.fixture
+def tubes():
+    labware = fakes.Labware('adrena_epptube_1500ul_rack_5row_8column', 4)
+    for well in labware.wells():
+        bb.initiate_well(well)
+    return labware
+
+############################################################
+# Event log (user-020)
+
+def test_event_log_formats_messages_when_read():
+    log = bb.EventLog()
+    log.record('almost_full', 'A1', 0)
+    log.record('mixing_fraction', 'A2', 0.1234)
+    assert log.messages() == ['Warning, container is almost full: A1', 'Volume mixing fraction at A2 is 0.12']
+    assert log.messages(bb.WARNING) == ['Warning, container is almost full: A1']
+    assert log.get_counts() == {'almost_full': 1, 'mixing_fraction': 1}
+
+def test_event_log_keeps_last_events_and_counts_all():
+    log = bb.EventLog(capacity=2)
+    for i in range(5):
+        log.record('mixing_fraction', 'A{}'.format(i), i)
+    assert log.messages() == ['Volume mixing fraction at A3 is 3.00', 'Volume mixing fraction at A4 is 4.00']
+    assert log.get_counts() == {'mixing_fraction': 5}
+
+def test_event_log_only_counts_events_below_min_severity():
+    log = bb.EventLog(min_severity=bb.WARNING)
+    log.record('mixing_fraction', 'A1', 0.5)
+    assert log.messages() == []
+    assert log.get_counts() == {'mixing_fraction': 1}
+
+def test_event_log_rejects_unknown_event_types():
+    with pytest.raises(KeyError):
+        bb.EventLog().record('not_an_event')
+
+def test_event_ids_match_event_names():
+    assert [bb.event_ids[name] for name in bb.event_names] == list(range(len(bb.event_names)))
+############################################################
+# Struct-of-arrays deck state (user-004)
+
+def test_initiate_well_stores_an_empty_well(tubes):
+    well = tubes.wells()[0]
+    c_info = bb.get_c_info(well)
+    assert c_info['volume'] == 0
+    assert c_info['headroom'] == well._geometry._depth
+    assert dict(c_info['volume_uncertainty']) == {'random': 0, 'systematic': 0}
+    assert c_info['constituents'] == []
+
+def test_c_info_views_write_in_deck_state(tubes):
+    well = tubes.wells()[1]
+    c_info = bb.get_c_info(well)
+    c_info['volume'] = 250
+    c_info['volume_uncertainty']['random'] = 1.5
+    assert bb.get_volume(well) == 250
+    assert bb.deck_state.volume_uncertainty_random[bb.get_well_id(well)] == 1.5
+    bb.set_volume(well, 100)
+    assert c_info['volume'] == 100
+    assert bb.get_volumes(tubes).tolist() == [0, 100, 0, 0]
+
+def test_constituent_views_follow_the_order_of_addition(tubes):
+    well = tubes.wells()[0]
+    bb.set_headroom(well, 20)
+    bb.set_constituent(well, 'water', 1000)
+    bb.set_constituent(well, 'dox', 15000, 150)
+    c_info = bb.get_c_info(well)
+    assert c_info['constituents'] == ['water', 'dox']
+    assert dict(c_info['concentrations_stock']) == {'water': 1000, 'dox': 15000}
+    assert c_info['volume_stock']['dox'] == bb.get_volume(well)
+    assert bb.has_constituent(well, 'dox') and not bb.has_constituent(tubes.wells()[1], 'dox')
+
+def test_wells_are_found_again_through_new_well_objects(tubes):
+    bb.set_volume(tubes['A2'], 250)
+    assert tubes['A2'] is not tubes['A2']
+    assert bb.get_volume(tubes.wells()[1]) == 250
+    assert bb.get_well_id(tubes['A2']) == bb.get_well_id(tubes.wells()[1]) == 1
+    bb.initiate_well(tubes['A2'])
+    assert len(bb.deck_state.wells) == 4 and bb.get_volume(tubes['A2']) == 0
+    with pytest.raises(AttributeError, match='has not been initiated'):
+        bb.get_volume(fakes.Labware('adrena_epptube_1500ul_rack_5row_8column', 1)['A1'])
+
+def test_deck_state_grows_beyond_its_capacity():
+    labware = fakes.Labware('adrena_epptube_1500ul_rack_5row_8column', 200)
+    for i, well in enumerate(labware.wells()):
+        bb.initiate_well(well)
+        bb.set_volume(well, i)
+    assert bb.get_volumes(labware).tolist() == list(range(200))
+
+def test_wells_of_the_same_labware_share_their_vh_functions(tubes):
+    assert len(bb.deck_state.vh_functions) == 1
+    assert bb.get_c_info(tubes.wells()[0])['vh_functions'] == bb.get_c_info(tubes.wells()[3])['vh_functions']
+
+def test_reset_deck_state_forgets_the_wells_of_a_previous_run(tubes):
+    bb.log_event('almost_full', tubes.wells()[0])
+    bb.reset_deck_state()
+    assert bb.deck_state.wells == []
+    assert bb.event_log.get_counts() == {}
+    with pytest.raises(AttributeError):
+        bb.get_volume(tubes.wells()[0])
+############################################################
+# Rack-wide volume/headroom conversions (user-003)
+
+def test_rack_conversions_match_well_conversions(tubes):
+    vials = fakes.Labware('adrena_vial_4ml_rack_4row_7column', 2, depth=40)
+    for well in vials.wells():
+        bb.initiate_well(well)
+    wells = tubes.wells()[:2] + vials.wells() + tubes.wells()[2:]
+    volumes = np.array([0, 100, 750, 1400])
+    headrooms = bb.get_h_from_v_wells(wells, volumes)
+    assert headrooms.shape == (6, 4)
+    for well, well_headrooms in zip(wells, headrooms):
+        assert well_headrooms.tolist() == [bb.get_h_from_v(well, volume) for volume in volumes]
+    assert bb.get_v_from_h_wells(wells, headrooms, per_well=True).tolist() == \
+           [[bb.get_v_from_h(well, headroom) for headroom in well_headrooms]
+            for well, well_headrooms in zip(wells, headrooms)]
+
+def test_rack_conversions_per_well(tubes):
+    volumes = np.array([10, 200, 300, 1000])
+    assert bb.get_h_from_v_wells(tubes, volumes, per_well=True).tolist() == \
+           [bb.get_h_from_v(well, volume) for well, volume in zip(tubes.wells(), volumes)]
+############################################################
+# Sparse constituent vectors (user-006)
+
+def test_well_constituents_merge_keeps_stock_information():
+    for name in ('salt', 'water', 'dox'):
+        bb.get_constituent_id(name)
+    constituents = bb.WellConstituents()
+    position = constituents.add(bb.get_constituent_id('water'))
+    constituents.volume_stock[position] = 100
+    positions = constituents.merge(np.array(sorted([bb.get_constituent_id('dox'), bb.get_constituent_id('salt')])))
+    assert constituents.ids.tolist() == [0, 1, 2]
+    assert constituents.volume_stock.tolist() == [0, 100, 0]
+    assert positions.tolist() == [0, 2]
+    assert constituents.position(bb.get_constituent_id('water')) == 1
+    assert constituents.position(3) is None
+    assert [bb.deck_state.constituent_names[i] for i in constituents.order] == ['water', 'dox', 'salt']
+
+def test_wells_only_store_their_own_constituents(tubes):
+    for i in range(50):
+        bb.get_constituent_id('constituent {}'.format(i))
+    well = tubes.wells()[0]
+    bb.set_volume(well, 100)
+    bb.set_constituent(well, 'constituent 7', 1000)
+    info = bb.deck_state.get_constituent_info(bb.get_well_id(well))
+    assert info.ids.tolist() == [bb.get_constituent_id('constituent 7')]
+    assert len(info.volume_stock) == 1
+############################################################
+# Pipette context cache (user-014)
+
+def test_pipette_values_are_read_once():
+    pipette = fakes.Pipette(300)
+    for i in range(3):
+        assert bb.get_tip_length(pipette) == 50
+        assert bb.get_default_flow_rates(pipette)['aspirate'] == 92.86
+    context = bb.get_pipette_context(pipette)
+    assert (context.hits, context.misses) == (4, 2)
+    assert context.report() == '4 values served from the cache, 2 read from the pipette'
+
+def test_invalidated_pipette_context_reads_the_new_values():
+    pipette = fakes.Pipette(300)
+    bb.get_relative_from_flow_rate_aspirate(pipette, 50)
+    pipette._implementation._flow_rates.aspirate = 100
+    pipette._tip_racks[0] = fakes.TipRack()
+    pipette._tip_racks[0].tip_length = 40
+    assert bb.get_relative_from_flow_rate_aspirate(pipette, 50) == pytest.approx(50/92.86)
+    bb.invalidate_pipette_context(pipette)
+    assert bb.get_relative_from_flow_rate_aspirate(pipette, 50) == 0.5
+    assert bb.get_tip_length(pipette) == 40
+############################################################
+# Tip contamination tracking (user-017)
+
+@pytest.fixture
+def tip_wells(tubes):
+    # Two wells of the same stock, one of another stock and an empty well
+    for well, constituent in zip(tubes.wells()[:3], ['dox', 'dox', 'water']):
+        bb.set_volume(well, 500)
+        bb.set_constituent(well, constituent, 1000)
+    return tubes.wells()
+
+def test_tips_are_not_reused_without_a_tip():
+    pipette = fakes.Pipette(300)
+    well = fakes.Labware('adrena_epptube_1500ul_rack_5row_8column', 1).wells()[0]
+    bb.initiate_well(well)
+    for policy in bb.tip_policies:
+        assert not bb.can_reuse_tip(pipette, well, policy)
+    with pytest.raises(AssertionError):
+        bb.can_reuse_tip(pipette, well, 'always')
+
+def test_tip_reuse_policies(tip_wells):
+    pipette = fakes.Pipette(300)
+    dox_1, dox_2, water, empty = tip_wells
+    bb.prepare_tip(pipette, dox_1, 'never')
+    bb.record_tip_contact(pipette, dox_1)
+    assert not bb.can_reuse_tip(pipette, dox_1, 'never')
+    assert bb.can_reuse_tip(pipette, dox_1, 'same_source')
+    assert not bb.can_reuse_tip(pipette, dox_2, 'same_source')
+    assert bb.can_reuse_tip(pipette, dox_2, 'same_constituents')
+    assert not bb.can_reuse_tip(pipette, water, 'same_constituents')
+    bb.record_tip_contact(pipette, empty)   # Untracked well, the tip constituents are not known any more
+    assert not bb.can_reuse_tip(pipette, dox_2, 'same_constituents')
+
+def test_prepare_tip_changes_tips_only_when_needed(tip_wells):
+    pipette = fakes.Pipette(300)
+    dox_1, dox_2, water, empty = tip_wells
+    for source in [dox_1, dox_2, dox_1, water, water]:
+        bb.prepare_tip(pipette, source, 'same_constituents')
+        bb.record_tip_contact(pipette, source)
+    assert pipette.commands() == ['pick_up_tip', 'drop_tip', 'pick_up_tip']
+    bb.release_tip(pipette)
+    bb.release_tip(pipette)
+    assert not pipette.has_tip
+    assert bb.tip_report(pipette) == '2 tips used, 3 tips saved by reusing tips, 0 pre-wetting cycles skipped'
+############################################################
+# Pre-wetting skip (user-018)
+
+def test_wetting_cycles_depend_on_the_last_source(tip_wells):
+    pipette = fakes.Pipette(300)
+    dox_1, dox_2, water, empty = tip_wells
+    assert bb.get_wetting_cycles(pipette, dox_1, 3) == 3   # No tip handled by prepare_tip()
+    bb.prepare_tip(pipette, dox_1, 'never')
+    assert bb.get_wetting_cycles(pipette, dox_1, 3) == 3
+    bb.record_tip_wetting(pipette, dox_1)
+    assert bb.get_wetting_cycles(pipette, dox_1, 3) == 0
+    assert bb.get_wetting_cycles(pipette, dox_1, 3, timeout=-1) == 1
+    assert bb.get_wetting_cycles(pipette, dox_2, 3) == 1
+    assert bb.get_wetting_cycles(pipette, water, 3) == 3
+    assert bb.get_wetting_cycles(pipette, dox_2, 0) == 0
+    bb.prepare_tip(pipette, dox_1, 'never')
+    assert bb.get_wetting_cycles(pipette, dox_1, 3) == 3   # New tip
+    assert bb.get_tip_state(pipette).wetting_cycles_saved == 3 + 2 + 2
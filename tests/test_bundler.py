@@ -0,0 +1,178 @@
+import ast
+import textwrap
+
+import pytest
+
+bundler = pytest.importorskip('Vesynta_Tech.OpenTrons2.bundler')
+
+@pytest.fixture
+def modules(tmp_path):
+    # Two modules of the package defining the same names, the second one importing the first one
+    (tmp_path / 'alpha.py').write_text(textwrap.dedent('''\
+        """Alpha module"""
+        import math
+
+        scale = 2
+        def _helper(x):
+            return scale*x
+        def area(radius):
+            return _helper(math.pi*radius**2)
+        def unused():
+            return 'unused'
+        '''))
+    (tmp_path / 'beta.py').write_text(textwrap.dedent('''\
+        import json
+
+        from Vesynta_Tech.OpenTrons2 import alpha as al
+
+        scale = 3
+        def _helper(x, scale=1):
+            return scale*x
+        def volume(radius, height):
+            return _helper(al.area(radius)*height, scale)
+        def dumps(value):
+            return json.dumps(value)
+        '''))
+    return str(tmp_path)
+
+def run_bundle(bundle):
+    namespace = {'__name__': '__bundle__'}
+    exec(compile(bundle, '<bundle>', 'exec'), namespace)
+    return namespace
+
+@pytest.fixture
+def python37_linenos(monkeypatch):
+    # Multi-line strings start at their last line in python 3.7, as are the expressions made of them
+    parse = ast.parse
+    def parse_37(source, *args, **kwargs):
+        tree = parse(source, *args, **kwargs)
+        for node in ast.walk(tree):
+            value = node.value if isinstance(node, ast.Expr) else node
+            if bundler._string(value) is not None and getattr(value, 'end_lineno', None):
+                node.lineno = value.end_lineno
+        return tree
+    monkeypatch.setattr(ast, 'parse', parse_37)
+
+############################################################
+# Single-pass ast bundler (user-021)
+
+protocol = textwrap.dedent('''\
+    from Vesynta_Tech.OpenTrons2 import alpha as al
+    from Vesynta_Tech.OpenTrons2 import beta
+    from Vesynta_Tech.OpenTrons2.alpha import scale
+
+    # In[ ]:
+
+    def run():
+        return al.area(1), beta.volume(1, 2), scale
+    ''')
+
+def test_names_defined_in_several_modules_are_renamed(modules):
+    bundle = bundler.bundle_protocol(protocol, modules, shake=False)
+    assert 'def _alpha_helper(x):' in bundle and 'def _beta_helper(x, scale=1):' in bundle
+    assert 'alpha_scale = 2' in bundle and 'beta_scale = 3' in bundle
+    assert 'return _beta_helper(area(radius)*height, beta_scale)' in bundle
+    assert 'return beta_scale*x' not in bundle   # The argument shadowing the module name is not renamed
+    assert 'In[' not in bundle and 'Vesynta_Tech' not in bundle and '"""Alpha module"""' not in bundle
+    area, volume, scale = run_bundle(bundle)['run']()
+    assert (area, scale) == (pytest.approx(2*3.14159265), 2)
+    assert volume == pytest.approx(3*2*area)
+
+def test_protocol_names_are_never_renamed(modules):
+    source = protocol + 'def area(radius):\n    return 0\n'
+    bundle = bundler.bundle_protocol(source, modules, shake=False)
+    assert 'def alpha_area(radius):' in bundle and '\ndef area(radius):' in bundle
+    assert 'return _beta_helper(alpha_area(radius)*height, beta_scale)' in bundle
+    assert run_bundle(bundle)['run']()[0] == pytest.approx(2*3.14159265)
+
+def test_multiline_strings_are_kept_whole(tmp_path, python37_linenos):
+    (tmp_path / 'gamma.py').write_text(textwrap.dedent('''\
+        """
+        Gamma module
+        """
+        scale = 2
+        """
+        Classification
+        - a = first
+        """
+        def area(radius):
+            """
+            Area of a disc
+            """
+            return scale*radius**2
+        '''))
+    source = 'from Vesynta_Tech.OpenTrons2 import gamma\n\ndef run():\n    return gamma.area(1)\n'
+    parsed = bundler.ParsedSource((tmp_path / 'gamma.py').read_text())
+    assert [(start, end) for start, end, node in parsed.statements] == [(0, 3), (3, 4), (4, 8), (8, 13)]
+    for shake in (False, True):
+        bundle = bundler.bundle_protocol(source, str(tmp_path), shake=shake)
+        assert ('Classification' in bundle) is not shake
+        assert run_bundle(bundle)['run']() == 2
+
+def test_modules_must_be_imported_with_an_alias(modules):
+    with pytest.raises(ValueError, match='import Vesynta_Tech.OpenTrons2.alpha as'):
+        bundler.bundle_protocol('import Vesynta_Tech.OpenTrons2.alpha\n', modules)
+    with pytest.raises(ValueError, match='star imports'):
+        bundler.bundle_protocol('from Vesynta_Tech.OpenTrons2 import *\n', modules)
+############################################################
+# Tree shaking (user-022)
+
+def test_unreachable_statements_and_imports_are_removed(modules):
+    source = 'from Vesynta_Tech.OpenTrons2 import beta\n\ndef run():\n    return beta.volume(1, 2)\n'
+    full = bundler.bundle_protocol(source, modules, shake=False)
+    shaken = bundler.bundle_protocol(source, modules)
+    assert 'def unused' in full and 'def dumps' in full and 'import json' in full
+    assert 'def unused' not in shaken and 'def dumps' not in shaken and 'import json' not in shaken
+    assert 'import math' in shaken and 'alpha_scale = 2' in shaken
+    assert run_bundle(shaken)['run']() == run_bundle(full)['run']()
+
+def test_registries_keep_the_labware_loaded(tmp_path):
+    (tmp_path / 'meniscus_tracking.py').write_text(textwrap.dedent('''\
+        tube_1 = [1]
+        tube_2 = [2]
+        labware_gradations = {'rack_1': tube_1,
+                              'rack_2': tube_2}
+        def get_vh_functions(load_name):
+            return labware_gradations[load_name]
+        '''))
+    source = textwrap.dedent('''\
+        from Vesynta_Tech.OpenTrons2 import meniscus_tracking as mt
+
+        def run(protocol, load_name='rack_2'):
+            protocol.load_labware('rack_1', 1)
+            return mt.get_vh_functions('rack_1')
+        ''')
+    shaken = bundler.bundle_protocol(source, str(tmp_path))
+    assert "labware_gradations = {'rack_1': tube_1}" in shaken and 'tube_2' not in shaken
+    # Load names that are not strings keep the whole registry
+    dynamic = bundler.bundle_protocol(source.replace("load_labware('rack_1', 1)", 'load_labware(load_name, 1)'),
+                                      str(tmp_path))
+    assert 'tube_2 = [2]' in dynamic
+
+def test_report_lists_the_bundles_failing_to_import(tmp_path, capsys):
+    (tmp_path / 'delta.py').write_text('broken = 1/0\ndef area(radius):\n    return radius**2\n')
+    protocol_file = tmp_path / 'protocol.py'
+    protocol_file.write_text('from Vesynta_Tech.OpenTrons2 import delta\n\ndef run():\n    return delta.area(2)\n')
+    bundle = bundler.bundle_protocol_file(str(protocol_file), directory=str(tmp_path), report=True)
+    full, shaken = capsys.readouterr().out.strip().split('\n')
+    assert full.startswith('Full bundle: ') and full.endswith('import failed (ZeroDivisionError: division by zero)')
+    assert shaken.startswith('Tree shaken bundle: ') and 'imported in' in shaken
+    assert run_bundle(bundle)['run']() == 4
+
+def test_package_bundle_imports_without_the_package(python37_linenos):
+    pytest.importorskip('opentrons')
+    source = textwrap.dedent('''\
+        from Vesynta_Tech.OpenTrons2 import building_blocks as bb
+        from Vesynta_Tech.OpenTrons2 import custom_pipetting as cusp
+
+        def run(protocol):
+            tubes = protocol.load_labware('adrena_epptube_1500ul_rack_5row_8column', 1)
+            bb.initiate_well(tubes['A1'])
+            cusp.custom_transfer_forward(protocol.pipette, 100, tubes['A1'], tubes['A2'])
+        ''')
+    shaken = bundler.bundle_protocol(source)
+    full = bundler.bundle_protocol(source, shake=False)
+    assert len(shaken) < len(full)
+    assert "'adrena_epptube_1500ul_rack_5row_8column': gradations_epptube_1500ul}" in shaken
+    assert 'gradations_vial_30ml' not in shaken
+    assert callable(run_bundle(full)['run']) and callable(run_bundle(shaken)['run'])
@@ -0,0 +1,152 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('opentrons')
+bb = pytest.importorskip('Vesynta_Tech.OpenTrons2.building_blocks')
+calcunc = pytest.importorskip('Vesynta_Tech.OpenTrons2.calculate_uncertainties')
+
+import fakes
+
+@pytest.fixture
+def p300():
+    pipette = fakes.Pipette(300)
+    bb.set_pipette_uncertainties(pipette, calcunc.call_p300_error_to_vu())
+    return pipette
+
+@pytest.fixture
+def tubes():
+    labware = fakes.Labware('adrena_epptube_1500ul_rack_5row_8column', 3)
+    for well in labware.wells():
+        bb.initiate_well(well)
+    return labware
+
+def snapshot(well):
+    # Plain copy of the c_info of a well
+    c_info = bb.get_c_info(well)
+    snapshot = {key: dict(c_info[key]) for key in ('volume_uncertainty', 'volume_stock', 'volume_uncertainty_stock',
+                                                   'concentrations_stock')}
+    snapshot.update(volume=c_info['volume'], constituents=list(c_info['constituents']))
+    return snapshot
+
+def reference_transfer(pipette, vt, source_info, destination_info):
+    # Stock information after a transfer, with the per-constituent formulas of uncertainties_calculation()
+    del_r_vt = calcunc.volume_uncertainty(pipette, vt)[0]
+    v1 = source_info['volume']
+    del_r_v1 = source_info['volume_uncertainty']['random']
+    if del_r_v1 != 0:
+        del_r_v1 = np.sqrt(del_r_vt**2 + del_r_v1**2)
+    r = vt/v1
+    for constituent in np.unique(source_info['constituents'] + destination_info['constituents']):
+        if constituent in source_info['constituents']:
+            vs1 = source_info['volume_stock'][constituent]
+            del_vs1 = source_info['volume_uncertainty_stock'][constituent]
+            del_vs_t_pc = np.sqrt((del_r_vt/vt)**2+(del_r_v1/v1)**2+(del_vs1/vs1)**2)
+            del_vs_t = del_vs_t_pc * (r*vs1)
+            source_info['volume_uncertainty_stock'][constituent] = del_vs_t_pc * (1-r)*vs1
+            source_info['volume_stock'][constituent] = vs1*(1-r)
+        else:
+            vs1 = 0
+            del_vs_t = 0
+        if constituent in destination_info['constituents']:
+            vs2 = destination_info['volume_stock'][constituent]
+            del_vs2 = destination_info['volume_uncertainty_stock'][constituent]
+        else:
+            destination_info['concentrations_stock'][constituent] = source_info['concentrations_stock'][constituent]
+            vs2 = 0
+            del_vs2 = 0
+        destination_info['volume_stock'][constituent] = vs2 + r*vs1
+        destination_info['volume_uncertainty_stock'][constituent] = np.sqrt(del_vs2**2 + del_vs_t**2)
+
+############################################################
+# Array propagation of stock uncertainties (user-005)
+
+def test_uncertainties_calculation_matches_the_per_constituent_formulas(p300, tubes):
+    source, destination = tubes.wells()[:2]
+    bb.set_volume(source, 1200)
+    bb.set_constituent(source, 'water', 1000, v_uncertainty=2)
+    bb.set_constituent(source, 'dox', 15000, 150, v_uncertainty=0.5)
+    bb.get_c_info(source)['volume_uncertainty']['random'] = 1.5
+    bb.set_volume(destination, 400)
+    bb.set_constituent(destination, 'salt', 500, v_uncertainty=1)
+    bb.set_constituent(destination, 'water', 1000, v_uncertainty=1)
+    source_info, destination_info = snapshot(source), snapshot(destination)
+    reference_transfer(p300, 250, source_info, destination_info)
+    calcunc.uncertainties_calculation(p300, 250, source, destination)
+    for well, expected in [(source, source_info), (destination, destination_info)]:
+        c_info = bb.get_c_info(well)
+        for key in ('volume_stock', 'volume_uncertainty_stock', 'concentrations_stock'):
+            assert dict(c_info[key]) == expected[key]
+    assert sorted(bb.get_constituents(destination)) == ['dox', 'salt', 'water']
+    assert bb.get_c_info(destination)['constituents_number'] == 3
+
+############################################################
+# Pipette selection (user-015)
+
+@pytest.fixture
+def pipettes():
+    pipettes = [fakes.Pipette(50, 'p50_single'), fakes.Pipette(300), fakes.Pipette(1000, 'p1000_single_gen2')]
+    for pipette, vu_function in zip(pipettes, [calcunc.call_p50_error_to_vu(), calcunc.call_p300_error_to_vu(),
+                                               calcunc.call_p1000_error_to_vu()]):
+        bb.set_pipette_uncertainties(pipette, vu_function)
+    return pipettes
+
+def test_select_pipettes_uses_the_fewest_strokes(pipettes):
+    selection = calcunc.select_pipettes(pipettes, [10, 900, 2500])
+    assert [selection.pipette(i) for i in range(3)] == [pipettes[0], pipettes[2], pipettes[2]]
+    assert selection.strokes[:, 1].tolist() == [18, 3, 1]
+    assert selection.strokes[:, 0].tolist() == [1, 0, 0]
+    assert 'not possible' in selection.explain(0)
+
+def test_select_pipettes_breaks_ties_by_uncertainty(pipettes):
+    selection = calcunc.select_pipettes(pipettes, [40, 150])
+    for i, volume in enumerate([40, 150]):
+        candidates = [k for k in range(3) if selection.strokes[k, i] == 1]
+        uncertainties = [np.hypot(*calcunc.volume_uncertainty(pipettes[k], volume)) for k in candidates]
+        assert selection.choice[i] == candidates[int(np.argmin(uncertainties))]
+    assert selection.report().count('transfers') == 3
+
+def test_select_pipettes_rejects_volumes_below_every_minimum(pipettes):
+    with pytest.raises(ValueError):
+        calcunc.select_pipettes(pipettes, [100, 2])
+
+############################################################
+# Uncertainty-optimal stroke splitting (user-016)
+
+@pytest.mark.parametrize('volume', [45, 300, 450, 700, 1234.5])
+def test_split_volume_uses_fewest_strokes_within_pipette_range(p300, volume):
+    strokes = calcunc.split_volume(p300, volume)
+    assert len(strokes) == int(np.ceil(volume/300))
+    assert np.isclose(np.sum(strokes), volume)
+    assert np.all(strokes <= 300)
+    if volume >= 30*len(strokes):
+        assert np.all(strokes >= 30)
+
+def test_split_volume_respects_max_pass_volume(p300):
+    strokes = calcunc.split_volume(p300, 700, max_pass_volume=250)
+    assert len(strokes) == 3
+    assert np.all(strokes <= 250)
+
+def test_unreachable_precision_target_is_logged_not_printed(p300, capsys):
+    strokes = calcunc.split_volume(p300, 700, precision_target=0.01)
+    assert len(strokes) == 3
+    assert capsys.readouterr().out == ''
+    assert bb.event_log.get_counts() == {'precision_target_missed': 1}
+
+def combined_uncertainty(pipette, strokes):
+    random, systematic = calcunc.volume_uncertainty(pipette, np.asarray(strokes))
+    return np.hypot(np.sqrt(np.sum(random**2)), np.sum(systematic))
+
+@pytest.mark.parametrize('volume', [350, 520, 880])
+def test_split_volume_is_not_worse_than_equal_strokes(p300, volume):
+    strokes = calcunc.split_volume(p300, volume)
+    equal = np.ones(len(strokes))*volume/len(strokes)
+    assert combined_uncertainty(p300, strokes) <= combined_uncertainty(p300, equal)
+
+def test_precision_target_allows_one_extra_stroke():
+    p1000 = fakes.Pipette(1000, 'p1000_single_gen2')
+    bb.set_pipette_uncertainties(p1000, calcunc.call_p1000_error_to_vu())
+    assert calcunc.split_volume(p1000, 1000).tolist() == [1000]
+    strokes = calcunc.split_volume(p1000, 1000, precision_target=1)
+    assert len(strokes) == 2 and np.isclose(np.sum(strokes), 1000)
+    assert combined_uncertainty(p1000, strokes) <= 1
+    assert bb.event_log.get_counts() == {}
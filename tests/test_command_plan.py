@@ -0,0 +1,79 @@
+import pytest
+
+pytest.importorskip('opentrons')
+bb = pytest.importorskip('Vesynta_Tech.OpenTrons2.building_blocks')
+calcunc = pytest.importorskip('Vesynta_Tech.OpenTrons2.calculate_uncertainties')
+cplan = pytest.importorskip('Vesynta_Tech.OpenTrons2.command_plan')
+cusp = pytest.importorskip('Vesynta_Tech.OpenTrons2.custom_pipetting')
+
+from opentrons import types
+
+import fakes
+
+@pytest.fixture
+def p300():
+    pipette = fakes.Pipette(300)
+    bb.set_pipette_uncertainties(pipette, calcunc.call_p300_error_to_vu())
+    return pipette
+
+@pytest.fixture
+def tubes():
+    labware = fakes.Labware('adrena_epptube_1500ul_rack_5row_8column', 3)
+    for well in labware.wells():
+        bb.initiate_well(well)
+    bb.set_volume(labware.wells()[0], 1000)
+    bb.set_headroom(labware.wells()[0], bb.get_h_from_v(labware.wells()[0], 1000))
+    return labware
+
+def moves(*locations, force_direct=False):
+    return [cplan.Command('move_to', (location,), {'force_direct': force_direct}) for location in locations]
+
+############################################################
+# Deferred command plan (user-010)
+
+def test_recorded_commands_replay_on_the_pipette(p300, tubes):
+    source, destination = tubes.wells()[:2]
+    plan = cplan.CommandPlan(p300)
+    cusp.custom_transfer_forward(plan.recorder, 100, source, destination, touch_tip_position='source')
+    assert p300.log == []
+    assert bb.get_volume(destination) == pytest.approx(100)   # Well information is updated while recording
+    assert plan.commands[0].functions == ('custom_transfer_forward', 'custom_aspirate')
+    recorded = [(command.name, command.args) for command in plan.commands]
+    plan.replay()
+    assert [(name, args) for name, args, kwargs in p300.log] == recorded
+    assert plan.commands == [] and plan.recorded_count == 0
+
+def test_optimize_removes_repeated_and_intermediate_moves(p300, tubes):
+    source, destination = tubes.wells()[:2]
+    plan = cplan.CommandPlan(p300)
+    cusp.custom_touch_tip(plan.recorder, source)
+    cusp.custom_touch_tip(plan.recorder, source)
+    plan.recorder.dispense(50, destination.top())
+    removed = plan.optimize()
+    names = [command.name for command in plan.commands]
+    assert removed == 2
+    assert names == ['move_to']*8 + ['dispense']
+    assert plan.report() == '11 commands recorded, 9 after optimisation'
+
+def test_remove_duplicate_moves_forgets_the_position_after_tip_changes(tubes):
+    top = tubes.wells()[0].top()
+    commands = moves(top) + [cplan.Command('aspirate', (10,), {})] + moves(top) + \
+               [cplan.Command('drop_tip', (), {})] + moves(top)
+    assert [command.name for command in cplan.remove_duplicate_moves(commands)] == \
+           ['move_to', 'aspirate', 'drop_tip', 'move_to']
+
+def test_merge_adjacent_moves_keeps_direct_paths(tubes):
+    well_1, well_2 = tubes.wells()[:2]
+    touch_point = types.Location(well_1.top().point, 'Touch point 1')
+    commands = moves(well_1.top()) + moves(well_2.top())
+    assert cplan.merge_adjacent_moves(commands) == commands[1:]
+    commands = moves(well_1.top()) + moves(well_2.top(), force_direct=True)
+    assert cplan.merge_adjacent_moves(commands) == commands
+    commands = moves(well_1.top(), touch_point)
+    assert cplan.merge_adjacent_moves(commands) == commands[1:]
+    commands = moves(well_1.top(), well_1.top(-2))
+    assert cplan.merge_adjacent_moves(commands) == commands
+
+def test_moves_in_a_well_fetched_again_are_not_merged(tubes):
+    commands = moves(tubes['A1'].top(), tubes['A1'].top(-2))
+    assert cplan.merge_adjacent_moves(commands) == commands
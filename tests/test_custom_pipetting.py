@@ -0,0 +1,135 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('opentrons')
+bb = pytest.importorskip('Vesynta_Tech.OpenTrons2.building_blocks')
+calcunc = pytest.importorskip('Vesynta_Tech.OpenTrons2.calculate_uncertainties')
+cusp = pytest.importorskip('Vesynta_Tech.OpenTrons2.custom_pipetting')
+
+from opentrons import types
+
+import fakes
+
+@pytest.fixture
+def p300():
+    pipette = fakes.Pipette(300)
+    bb.set_pipette_uncertainties(pipette, calcunc.call_p300_error_to_vu())
+    return pipette
+
+@pytest.fixture
+def tubes():
+    labware = fakes.Labware('adrena_epptube_1500ul_rack_5row_8column', 6)
+    for well in labware.wells():
+        bb.initiate_well(well)
+    return labware
+
+def fill(well, volume, constituent):
+    bb.set_volume(well, volume)
+    bb.set_headroom(well, bb.get_h_from_v(well, volume))
+    bb.set_constituent(well, constituent, 1000, v_uncertainty=1)
+
+############################################################
+# One-aspirate multi-dispense (user-008)
+
+def test_distribute_fills_destinations_in_batches(p300, tubes):
+    source, destinations = tubes.wells()[0], tubes.wells()[1:]
+    fill(source, 1400, 'buffer')
+    cusp.custom_distribute(p300, 100, source, destinations, disposal_volume=20)
+    assert [command[1][0] for command in p300.commands('aspirate')] == [220, 220, 120]
+    assert [command[1][0] for command in p300.commands('dispense')] == [100, 100, 20, 100, 100, 20, 100, 20]
+    assert bb.get_volumes(destinations) == pytest.approx([100]*5)
+    assert bb.get_volume(source) == pytest.approx(900)
+
+def test_distribute_uncertainties_match_separate_transfers(p300, tubes):
+    source, destinations = tubes.wells()[0], tubes.wells()[1:3]
+    fill(source, 1400, 'buffer')
+    cusp.custom_distribute(p300, [50, 80], source, destinations)
+    distributed = [dict(bb.get_c_info(well)['volume_uncertainty_stock']) for well in tubes.wells()[:3]]
+    bb.reset_deck_state()
+    for well in tubes.wells():
+        bb.initiate_well(well)
+    fill(source, 1400, 'buffer')
+    for destination, volume in zip(destinations, [50, 80]):
+        calcunc.uncertainties_calculation(p300, volume, source, destination)
+        bb.set_volume(source, bb.get_volume(source) - volume)
+    assert [dict(bb.get_c_info(well)['volume_uncertainty_stock']) for well in tubes.wells()[:3]] == distributed
+
+def test_distribute_checks_the_pipette_capacity(p300, tubes):
+    with pytest.raises(AssertionError):
+        cusp.custom_distribute(p300, 290, tubes.wells()[0], tubes.wells()[1:], disposal_volume=20)
+############################################################
+# Multi-aspirate pooling (user-009)
+
+def test_consolidate_pools_sources_in_batches(p300, tubes):
+    sources, destination = tubes.wells()[:3], tubes.wells()[5]
+    for i, source in enumerate(sources):
+        fill(source, 500, 'fraction {}'.format(i))
+    cusp.custom_consolidate(p300, 120, sources, destination, air_gap=10)
+    assert [command[1][0] for command in p300.commands('aspirate')] == [120, 10, 120, 120]
+    assert [command[1][0] for command in p300.commands('dispense')] == [240, 120]
+    assert len(p300.commands('blow_out')) == 2
+    assert bb.get_volumes(sources) == pytest.approx([380]*3)
+    assert bb.get_volume(destination) == pytest.approx(360)
+    assert sorted(bb.get_constituents(destination)) == ['fraction 0', 'fraction 1', 'fraction 2']
+    assert bb.get_c_info(destination)['volume_stock']['fraction 1'] == pytest.approx(120)
+
+def test_consolidate_dispenses_above_the_pooled_liquid(p300, tubes):
+    sources, destination = tubes.wells()[:2], tubes.wells()[5]
+    for i, source in enumerate(sources):
+        fill(source, 500, 'fraction {}'.format(i))
+    cusp.custom_consolidate(p300, 100, sources, destination)
+    location = p300.commands('dispense')[0][1][1]
+    assert location.point.z == pytest.approx(destination.top(-(bb.get_headroom(destination) - 1)).point.z)
+
+def test_consolidate_rejects_the_destination_as_source(p300, tubes):
+    for well in tubes.wells()[:2]:
+        fill(well, 500, 'buffer')
+    with pytest.raises(AssertionError):
+        cusp.custom_consolidate(p300, 50, tubes.wells()[:2], tubes.wells()[1])
+    assert p300.log == []
+############################################################
+# Touch tip offsets cache (user-011)
+
+def test_touch_tip_offsets_are_cached_per_geometry():
+    offsets = cusp.get_touch_tip_offsets(10.75, 1, 4, 2)
+    assert cusp.get_touch_tip_offsets(10.75, 1, 4, 2) is offsets
+    assert [label for point, label in offsets] == ['Touch point 1', 'Touch point 2', 'Touch point 3', 'Touch point 4']
+    assert np.allclose([tuple(point) for point, label in offsets],
+                       [(4.375, 0, -2), (0, 4.375, -2), (-4.375, 0, -2), (0, -4.375, -2)])
+    assert cusp.get_touch_tip_offsets(8, 1, 4, 2) is not offsets
+
+def test_touch_tips_follow_the_well_perimeter(p300, tubes):
+    well = tubes.wells()[2]
+    cusp.custom_touch_tip(p300, well)
+    cusp.custom_touch_tip(p300, well, reduced_moves=True)
+    locations = [command[1][0] for command in p300.commands('move_to')]
+    assert len(locations) == 9
+    assert locations[0] == locations[4] == locations[8] == well.top()
+    assert [location.point for location in locations[1:4]] == [location.point for location in locations[5:8]]
+    assert locations[1].point == well.top().point + types.Point(4.375, 0, -2)
+############################################################
+# Pre-wetting skip (user-018)
+
+def test_reused_tip_skips_pre_wetting(p300, tubes):
+    source, destination_1, destination_2 = tubes.wells()[:3]
+    fill(source, 1000, 'buffer')
+    for destination in (destination_1, destination_2):
+        cusp.custom_transfer_forward(p300, 100, source, destination, pre_wet=2, dispense_meniscus=False,
+                                     tip_policy='same_source')
+    assert len(p300.commands('pick_up_tip')) == 1
+    assert [command[1][0] for command in p300.commands('aspirate')] == [100, 100, 100, 100]
+    assert bb.get_tip_state(p300).wetting_cycles_saved == 2
+############################################################
+# Disposal carry-over (user-019)
+
+@pytest.mark.parametrize('carry_disposal, aspirated, dispensed', [
+    (False, [255, 255, 255], [250, 5, 250, 5, 250, 5]),
+    (True, [255, 250, 250], [250, 250, 250, 5])])
+def test_reverse_transfer_carries_the_disposal_volume(p300, tubes, carry_disposal, aspirated, dispensed):
+    source, destination = tubes.wells()[:2]
+    fill(source, 1400, 'buffer')
+    cusp.custom_transfer_reverse(p300, 750, source, destination, disposal_volume=5, carry_disposal=carry_disposal)
+    assert [command[1][0] for command in p300.commands('aspirate')] == pytest.approx(aspirated)
+    assert [command[1][0] for command in p300.commands('dispense')] == pytest.approx(dispensed)
+    assert bb.get_volume(destination) == pytest.approx(750)
+    assert bb.get_volume(source) == pytest.approx(650)
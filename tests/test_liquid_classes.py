@@ -0,0 +1,56 @@
+import pytest
+
+pytest.importorskip('opentrons')
+bb = pytest.importorskip('Vesynta_Tech.OpenTrons2.building_blocks')
+calcunc = pytest.importorskip('Vesynta_Tech.OpenTrons2.calculate_uncertainties')
+cusp = pytest.importorskip('Vesynta_Tech.OpenTrons2.custom_pipetting')
+liqc = pytest.importorskip('Vesynta_Tech.OpenTrons2.liquid_classes')
+
+import fakes
+
+@pytest.fixture
+def p300():
+    pipette = fakes.Pipette(300)
+    bb.set_pipette_uncertainties(pipette, calcunc.call_p300_error_to_vu())
+    return pipette
+
+############################################################
+# Liquid classes (user-013)
+
+def test_liquid_class_rates_depend_on_the_pipette_model(p300):
+    settings = liqc.get_liquid_class(p300, 'viscous')
+    assert (settings['aspirate_rate'], settings['dispense_rate']) == (20, 40)
+    assert settings['aspirate_rate_relative'] == pytest.approx(20/92.86)
+    p1000 = fakes.Pipette(1000, 'p1000_single_gen2', 274.7)
+    assert liqc.get_liquid_class(p1000, 'viscous')['aspirate_rate'] == 70
+
+def test_liquid_classes_are_bound_once_and_invalidated_with_the_flow_rates(p300):
+    settings = liqc.get_liquid_class(p300, 'aqueous')
+    assert liqc.get_liquid_class(p300, 'aqueous') is settings
+    p300._implementation._flow_rates.aspirate = 150
+    bb.invalidate_pipette_context(p300)
+    assert liqc.get_liquid_class(p300, 'aqueous')['aspirate_rate_relative'] == pytest.approx(75/150)
+
+def test_unknown_liquid_classes_are_rejected(p300):
+    with pytest.raises(KeyError, match='register_liquid_class'):
+        liqc.get_liquid_class(p300, 'test_oil')
+    liqc.register_liquid_class('test_oil', 4, 20, 'source', {'default': (10, 20)})
+    try:
+        assert liqc.get_liquid_class(p300, 'test_oil')['disposal_volume'] == 20
+    finally:
+        del liqc.liquid_classes['test_oil']
+
+def test_transfer_uses_the_liquid_class_settings(p300):
+    tubes = fakes.Labware('adrena_epptube_1500ul_rack_5row_8column', 2)
+    for well in tubes.wells():
+        bb.initiate_well(well)
+    source, destination = tubes.wells()
+    bb.set_volume(source, 1000)
+    bb.set_headroom(source, bb.get_h_from_v(source, 1000))
+    cusp.custom_transfer_forward(p300, 100, source, destination, liquid_class='volatile_organic')
+    aspirate, dispense = p300.commands('aspirate')[0], p300.commands('dispense')[0]
+    assert aspirate[2]['rate'] == pytest.approx(150/92.86)
+    assert aspirate[1][1].point.z == pytest.approx(source.top(-(bb.get_headroom(source) + 1)).point.z)
+    assert dispense[2]['rate'] == pytest.approx(300/92.86)
+    # Touch tip at the destination after the blow out
+    assert p300.commands()[-1] == 'move_to' and p300.commands('move_to')[-1][1][0] == destination.top()
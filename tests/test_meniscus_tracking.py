@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+mt = pytest.importorskip('Vesynta_Tech.OpenTrons2.meniscus_tracking')
+
+############################################################
+# Labware registry of shared volume_headroom_functions (user-001)
+
+def test_labware_of_the_same_tube_share_their_vh_functions():
+    epptube_5ml = mt.get_vh_functions('adrena_epptube_5000ul_rack_4row_6column')
+    assert mt.get_vh_functions('vs_000153_pn') is epptube_5ml
+    assert mt.call_gradations_epptube_5ml() is epptube_5ml
+    assert mt.get_vh_functions('adrena_vial_2ml_rack_5row_8column') is not epptube_5ml
+
+def test_shared_vh_functions_match_gradations_to_vh():
+    shared = mt.call_gradations_epptube_1500ul()
+    converted = mt.gradations_to_vh(mt.gradations_epptube_1500ul)
+    headrooms = np.linspace(-1, 45, 50)
+    volumes = np.linspace(-10, 1600, 50)
+    assert np.array_equal(shared[0](headrooms), converted[0](headrooms))
+    assert np.array_equal(shared[1](volumes), converted[1](volumes))
+
+def test_unknown_labware_needs_registered_gradations():
+    with pytest.raises(KeyError, match='register_labware_gradations'):
+        mt.get_vh_functions('test_unknown_rack')
+    mt.register_labware_gradations('test_unknown_rack', mt.gradations_vial_4ml)
+    try:
+        assert mt.get_vh_functions('test_unknown_rack') is mt.call_gradations_vial_4ml()
+    finally:
+        del mt.labware_gradations['test_unknown_rack']
+############################################################
+# Uniform segment grid interpolation (user-002)
+
+all_gradations = [mt.gradations_epptube_1500ul, mt.gradations_ftube_15ml, mt.gradations_vial_30ml,
+                  mt.gradations_cuvette_70ul, mt.gradations_tlc_50ul]
+
+@pytest.mark.parametrize('gradations', all_gradations)
+def test_grid_interpolator_matches_np_interp(gradations):
+    for function, (xp, fp, left, right) in zip(mt.gradations_to_vh(gradations), interp_arguments(gradations)):
+        assert function.max_error == 0
+        queries = np.concatenate([xp, (xp[1:] + xp[:-1])/2, np.linspace(xp[0] - 1, xp[-1] + 1, 1001),
+                                  np.nextafter(xp, np.inf), np.nextafter(xp, -np.inf)])
+        exact = np.interp(queries, xp, fp, left=left, right=right)
+        assert [function(float(x)) for x in queries] == exact.tolist()
+        assert np.array_equal(function(queries), exact)
+
+def interp_arguments(gradations):
+    # (xp, fp, left, right) of np.interp for v_given_h and h_given_v, as in gradations_to_vh()
+    by_headroom = gradations[gradations[:,0].argsort()]
+    by_volume = gradations[gradations[:,1].argsort()]
+    return [(by_headroom[:,0], by_headroom[:,1], np.max(gradations[:,1]), 0),
+            (by_volume[:,1], by_volume[:,0], np.max(gradations[:,0]), 0)]
+
+def test_grid_interpolator_handles_uneven_and_repeated_points():
+    xp = np.array([0, 1e-3, 0.5, 0.5, 7, 100])
+    fp = np.array([3, 4, 5, 9, 2, 1])
+    function = mt.GridInterpolator(xp, fp, left=-1, right=-2)
+    queries = np.linspace(-5, 105, 20001)
+    assert [function(float(x)) for x in queries] == np.interp(queries, xp, fp, left=-1, right=-2).tolist()
+    assert function(100) == 1 and function(0) == 3
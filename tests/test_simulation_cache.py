@@ -0,0 +1,83 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip('opentrons')
+simulation_cache = pytest.importorskip('Vesynta_Tech.OpenTrons2.simulation_cache')
+time_estimator = pytest.importorskip('Vesynta_Tech.OpenTrons2.time_estimator')
+
+from opentrons import types
+
+import fakes
+
+def simulated_run_log():
+    # run_log of a short protocol, as returned by opentrons.simulate.simulate()
+    pipette = fakes.Pipette(300)
+    pipette.flow_rate.aspirate = 50
+    tubes = fakes.Labware('adrena_epptube_1500ul_rack_5row_8column', 3)
+    tips = fakes.Labware('adrena_tiprack_300ul_8row_12column', 2, slot=(100, 0, 0))
+    source, destination = tubes.wells()[0], tubes.wells()[2]
+    def entry(text, level=0, **payload):
+        payload['text'] = text
+        return {'level': level, 'payload': payload, 'logs': []}
+    return ([entry('Picking up tip from A1', location=tips.wells()[0], instrument=pipette),
+             entry('Moving to A1', location=source.top(), instrument=pipette),
+             entry('Aspirating 100.0 uL from A1', location=source.bottom(2), instrument=pipette, volume=100, rate=0.5),
+             entry('Moving to A1', location=source.top(-1), instrument=pipette),
+             entry('Moving to A1', location=types.Location(types.Point(1, 2, 3), 'touch point'), instrument=pipette),
+             entry('Mixing 3 times', location=destination.bottom(1), instrument=pipette),
+             entry('Dispensing 100.0 uL into A3 at 92.86 uL/sec', 1, location=destination.bottom(1),
+                   instrument=pipette, volume=100, rate=1.0),
+             entry('Dispensing 100.0 uL into A3', 1, location=destination.bottom(1), instrument=pipette,
+                   volume=100, rate=2.0),
+             entry('Delaying for 0 minutes and 2.5 seconds'),
+             entry('Dropping tip into A2', location=tips.wells()[1], instrument=pipette)], None)
+
+############################################################
+# Simulation cache (user-023)
+
+def test_cached_run_log_gives_the_live_time_estimate():
+    run_log = simulated_run_log()
+    cached_run_log = (json.loads(json.dumps(simulation_cache.sanitize_run_log(run_log)[0])), None)
+    live = time_estimator.estimate_run_log_time(run_log)
+    cached = time_estimator.estimate_run_log_time(cached_run_log)
+    assert cached.total == pytest.approx(live.total)
+    assert cached.by_command == pytest.approx(live.by_command)
+    assert live.by_command['move_to'] > 0
+
+def test_cache_round_trip(tmp_path):
+    cache = simulation_cache.SimulationCache(str(tmp_path / 'cache'))
+    protocol = tmp_path / 'protocol.py'
+    protocol.write_text('metadata = {}\n')
+    key = cache.key(str(protocol))
+    assert cache.get(key) is None
+    cache.put(key, 'bundled script', simulated_run_log())
+    script, run_log = cache.get(key)
+    assert script == 'bundled script'
+    assert [entry['payload']['text'] for entry in run_log[0]] == [entry['payload']['text'] for entry in simulated_run_log()[0]]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_cache_key_changes_with_the_protocol_and_labware(tmp_path):
+    cache = simulation_cache.SimulationCache(str(tmp_path / 'cache'))
+    protocol = tmp_path / 'protocol.py'
+    protocol.write_text('metadata = {}\n')
+    labware = tmp_path / 'labware'
+    labware.mkdir()
+    (labware / 'rack.json').write_text('{}')
+    key = cache.key(str(protocol), str(labware))
+    assert cache.key(str(protocol), str(labware)) == key
+    (labware / 'rack.json').write_text('{"version": 2}')
+    assert cache.key(str(protocol), str(labware)) != key
+    protocol.write_text('metadata = {"apiLevel": "2.9"}\n')
+    assert cache.key(str(protocol)) != cache.key(str(protocol), str(labware))
+
+def test_cache_evicts_least_recently_used_entries(tmp_path):
+    cache = simulation_cache.SimulationCache(str(tmp_path / 'cache'), max_size=3500)
+    for i, key in enumerate(['first', 'second', 'third']):
+        cache.put(key, 'x'*1000, ([], None))
+        os.utime(os.path.join(cache.directory, key), (i, i))
+    cache.get('first')   # Most recently used, the second entry is the least recently used
+    cache.max_size = 2500
+    assert cache.evict() == 1
+    assert sorted(os.path.basename(path) for last_use, size, path in cache.entries()) == ['first', 'third']
@@ -0,0 +1,79 @@
+import pytest
+
+pytest.importorskip('opentrons')
+bb = pytest.importorskip('Vesynta_Tech.OpenTrons2.building_blocks')
+calcunc = pytest.importorskip('Vesynta_Tech.OpenTrons2.calculate_uncertainties')
+cplan = pytest.importorskip('Vesynta_Tech.OpenTrons2.command_plan')
+cusp = pytest.importorskip('Vesynta_Tech.OpenTrons2.custom_pipetting')
+time_estimator = pytest.importorskip('Vesynta_Tech.OpenTrons2.time_estimator')
+
+import fakes
+
+@pytest.fixture
+def p300():
+    pipette = fakes.Pipette(300)
+    bb.set_pipette_uncertainties(pipette, calcunc.call_p300_error_to_vu())
+    return pipette
+
+@pytest.fixture
+def tubes():
+    labware = fakes.Labware('adrena_epptube_1500ul_rack_5row_8column', 3)
+    for well in labware.wells():
+        bb.initiate_well(well)
+    bb.set_volume(labware.wells()[0], 1000)
+    bb.set_headroom(labware.wells()[0], bb.get_h_from_v(labware.wells()[0], 1000))
+    return labware
+
+############################################################
+# Run time estimator (user-012)
+
+def test_moves_within_a_well_are_straight(tubes):
+    well = tubes.wells()[0]
+    assert time_estimator.move_time(well.top(), well.top(-25)) == pytest.approx(0.2 + 25/125)
+    assert time_estimator.move_time(well.top(), well.top(-25), speed=50) == pytest.approx(0.2 + 25/50)
+    assert time_estimator.move_time(None, well.top()) == time_estimator.MOVE_OVERHEAD
+
+def test_moves_between_wells_arc_above_them(tubes):
+    well_1, well_2 = tubes.wells()[:2]
+    arc = time_estimator.move_time(well_1.top(-10), well_2.top())
+    assert arc == pytest.approx(3*0.2 + 9/400 + (20 + 10)/125)
+    assert time_estimator.move_time(well_1.top(-10), well_2.top(), force_direct=True) == pytest.approx(0.2 + 10/125)
+
+def test_plan_time_by_function_and_command(p300, tubes):
+    source, destination = tubes.wells()[:2]
+    plan = cplan.CommandPlan(p300)
+    plan.recorder.pick_up_tip()
+    cusp.custom_aspirate(plan.recorder, 100, source, rate=46.43)
+    cusp.custom_touch_tip(plan.recorder, source)
+    estimate = time_estimator.estimate_plan_time(plan)
+    assert estimate.by_function['pick_up_tip'] == time_estimator.COMMAND_TIMES['pick_up_tip']
+    assert estimate.by_command['aspirate'] == pytest.approx(time_estimator.MOVE_OVERHEAD + 100/46.43)
+    assert estimate.by_function['custom_touch_tip'] == pytest.approx(estimate.by_command['move_to'])
+    assert estimate.total == pytest.approx(sum(estimate.by_function.values()))
+    assert estimate.report().startswith('Estimated run time: 0 min ')
+
+def test_optimized_plans_are_faster(p300, tubes):
+    source, destination = tubes.wells()[:2]
+    plan = cplan.CommandPlan(p300)
+    cusp.custom_transfer_forward(plan.recorder, 100, source, destination, touch_tip_position='destination')
+    cusp.custom_touch_tip(plan.recorder, destination)
+    before = time_estimator.estimate_plan_time(plan).total
+    assert plan.optimize() > 0
+    assert time_estimator.estimate_plan_time(plan).total < before
+
+def test_run_log_counts_nested_commands_once(tubes):
+    pipette = fakes.Pipette(300)
+    well = tubes.wells()[0]
+    def entry(text, level=0, **payload):
+        payload['text'] = text
+        return {'level': level, 'payload': payload, 'logs': []}
+    run_log = ([entry('Mixing 1 times with a volume of 50.0 ul'),
+                entry('Aspirating 50.0 uL from A1 at 25.0 uL/sec', 1, location=well.top(), instrument=pipette, volume=50),
+                entry('Dispensing 50.0 uL into A1', 1, location=well.top(), instrument=pipette, volume=50, rate=0.5),
+                entry('Delaying for 1 minutes and 5.0 seconds')], None)
+    estimate = time_estimator.estimate_run_log_time(run_log)
+    assert estimate.by_function == pytest.approx({'Mixing': 0.2 + 50/25 + 0.2 + 50/(0.5*92.86), 'Delaying': 65})
+    assert estimate.by_command == pytest.approx({'aspirate': 0.2 + 2, 'dispense': 0.2 + 50/46.43, 'delay': 65})
+
+def test_moves_in_a_well_fetched_again_are_straight(tubes):
+    assert time_estimator.move_time(tubes['A1'].top(), tubes['A1'].top(-25)) == pytest.approx(0.2 + 25/125)
@@ -0,0 +1,86 @@
+import pytest
+
+pytest.importorskip('opentrons')
+bb = pytest.importorskip('Vesynta_Tech.OpenTrons2.building_blocks')
+calcunc = pytest.importorskip('Vesynta_Tech.OpenTrons2.calculate_uncertainties')
+tplan = pytest.importorskip('Vesynta_Tech.OpenTrons2.transfer_planner')
+
+import fakes
+
+@pytest.fixture
+def p300():
+    pipette = fakes.Pipette(300)
+    bb.set_pipette_uncertainties(pipette, calcunc.call_p300_error_to_vu())
+    return pipette
+
+@pytest.fixture
+def tubes():
+    labware = fakes.Labware('adrena_epptube_1500ul_rack_5row_8column', 4)
+    for well in labware.wells():
+        bb.initiate_well(well)
+    source = labware.wells()[0]
+    bb.set_volume(source, 1000)
+    bb.set_constituent(source, 'NaCl', 1000)
+    return labware
+
+above_meniscus = {'dispense_meniscus': False}
+
+############################################################
+# Transfer planning (user-007)
+
+def test_tips_are_not_shared_after_dispensing_in_the_destination_liquid(tubes):
+    source, destination_1, destination_2, destination_3 = tubes.wells()
+    plan = tplan.plan_transfers([(source, destination_1, 50), (source, destination_2, 50), (source, destination_3, 50)])
+    assert plan.new_tip == [True, True, True]
+    plan = tplan.plan_transfers([(source, destination_1, 50, {'dispense_depth': -2}),
+                                 (source, destination_2, 50, {'dispense_depth': -2})])
+    assert plan.new_tip == [True, False]
+
+def test_tips_are_not_shared_after_touch_tip_at_the_destination(tubes):
+    source, destination_1, destination_2, destination_3 = tubes.wells()
+    settings = dict(above_meniscus, liquid_class='volatile_organic')
+    plan = tplan.plan_transfers([(source, destination_1, 50, settings), (source, destination_2, 50, settings)])
+    assert plan.new_tip == [True, True]
+
+def test_tips_are_shared_for_dispenses_above_the_meniscus(tubes):
+    source, destination_1, destination_2, destination_3 = tubes.wells()
+    jobs = [(source, destination_1, 50, above_meniscus), (destination_1, destination_3, 20),
+            (source, destination_2, 50, above_meniscus)]
+    plan = tplan.plan_transfers(jobs)
+    assert plan.jobs[:2] == [tplan._format_job(jobs[0]), tplan._format_job(jobs[2])]
+    assert plan.new_tip == [True, False, True]
+    assert tplan.plan_transfers(jobs, share_tips=False).new_tip == [True, True, True]
+
+def test_executed_plan_picks_up_each_tip_once(p300, tubes):
+    source, destination_1, destination_2, destination_3 = tubes.wells()
+    plan = tplan.plan_transfers([(source, destination_1, 50, above_meniscus), (source, destination_2, 50, above_meniscus),
+                                 (source, destination_3, 50)])
+    tplan.execute_transfer_plan(p300, plan)
+    assert len(p300.commands('pick_up_tip')) == plan.tips == 2
+    assert len(p300.commands('drop_tip')) == 2
+    assert not p300.has_tip
+
+def test_job_tip_policy_is_not_picked_up_twice(p300, tubes):
+    source, destination_1, destination_2, destination_3 = tubes.wells()
+    plan = tplan.plan_transfers([(source, destination_1, 50, {'tip_policy': 'never'}),
+                                 (source, destination_2, 50, {'tip_policy': 'never'})])
+    tplan.execute_transfer_plan(p300, plan)
+    assert len(p300.commands('pick_up_tip')) == 2
+    assert not p300.has_tip
+
+def test_executed_plan_does_not_reuse_a_contaminated_tip(p300, tubes):
+    source, destination_1, destination_2, destination_3 = tubes.wells()
+    plan = tplan.plan_transfers([(source, destination_1, 50), (source, destination_2, 50)], share_tips=True)
+    plan.new_tip = [True, False]   # Even if the plan shares the tip, the tip touched destination_1
+    tplan.execute_transfer_plan(p300, plan)
+    assert len(p300.commands('pick_up_tip')) == 2
+
+def test_wells_fetched_again_keep_dependencies_and_tips():
+    rack = fakes.Labware('adrena_epptube_1500ul_rack_5row_8column', 5)
+    jobs = [(rack['A3'], rack['A4'], 50), (rack['A1'], rack['A2'], 50), (rack['A2'], rack['A5'], 50)]
+    plan = tplan.plan_transfers(jobs)
+    assert [(source.name, destination.name) for source, destination, volume, settings in plan.jobs] == \
+           [('A3', 'A4'), ('A1', 'A2'), ('A2', 'A5')]
+    plan = tplan.plan_transfers([(rack['A1'], rack['A2'], 50, above_meniscus),
+                                 (rack['A1'], rack['A3'], 50, above_meniscus)])
+    assert plan.new_tip == [True, False]